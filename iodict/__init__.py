@@ -12,17 +12,40 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
+import array
+import bisect
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import cProfile
+import fcntl
+import fnmatch
+import functools
 import hashlib
+import heapq
+import io
+import json
+import logging
+import math
+import mmap
 import multiprocessing
 import operator
 import os
 import pickle
+import pstats
 import queue
+import re
+import shutil
+import stat
 import struct
+import threading
 import traceback
 import time
+import tracemalloc
 import typing
 import uuid
+import zlib
 
 if os.uname().sysname == "Darwin":
     import xattr
@@ -36,29 +59,185 @@ if os.uname().sysname == "Darwin":
 else:
     getxattr, setxattr, listxattr = (os.getxattr, os.setxattr, os.listxattr)
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import ctypes
+
+    _syncfs = ctypes.CDLL(None, use_errno=True).syncfs
+except (AttributeError, ImportError, OSError):
+    _syncfs = None
+
+try:
+    from multiprocessing import resource_tracker
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+_LOG = logging.getLogger(__name__)
 
 _S = typing.TypeVar("_S")
 _T = typing.TypeVar("_T")
 _KT = typing.TypeVar("_KT")
 _VT = typing.TypeVar("_VT")
 
+# Names within a storage path starting with this prefix are reserved for
+# internal use, such as in-flight writes, and are never returned as items.
+_RESERVED_PREFIX = ".iodict"
 
-def _get_create_time(path: str):
-    """Return the file object birthtime.
+# Snapshots start with a magic string, followed by one record per item in
+# birthtime order. A record header holds the key length, value length,
+# birthtime, sequence number, and a CRC32 of the key and value bytes. The
+# stream ends with a record whose key length is `_SNAPSHOT_END` and whose
+# value length is the number of records written.
+_SNAPSHOT_MAGIC = b"IODICT\x00\x01"
+_SNAPSHOT_RECORD = struct.Struct(">IQdQI")
+_SNAPSHOT_END = 0xFFFFFFFF
+
+# Store metadata, such as the key digest algorithm, is kept in this file
+# within the storage path.
+_METADATA_FILE = "{}.meta".format(_RESERVED_PREFIX)
+
+# Item metadata modes. Xattr stores keep the key and birthtime of items in
+# xattrs, header stores keep them in a header in front of the serialized
+# object, and legacy stores, created without xattr support before headers
+# existed, name items by their key and order them by ctime.
+_METADATA_MODES = ("xattr", "header", "legacy")
+
+# Header of items within header stores, followed by the UTF-8 encoded key:
+# magic, birthtime, sequence number, and key length.
+_HEADER_MAGIC = b"IODICT\x00\x02"
+_HEADER = struct.Struct(">8sdQI")
+
+# Bloom filter of the item names of a store, when it has one. The file holds
+# a header of magic, number of bits, and number of hashes, then the bits.
+_BLOOM_FILE = "{}.bloom".format(_RESERVED_PREFIX)
+_BLOOM_MAGIC = b"IODICT\x00\x03"
+_BLOOM_HEADER = struct.Struct(">8sQI4x")
+
+# Transactions are logged to a file within this directory before they are
+# applied. The log uses the snapshot record format with its own magic, and
+# the sequence number of a record holding its operation.
+_WAL_DIR = "{}.wal".format(_RESERVED_PREFIX)
+_WAL_MAGIC = b"IODICT\x00\x04"
+_WAL_SET = 0
+_WAL_DELETE = 1
+
+# Changes to a store are appended to this file, when it exists. A record
+# holds the operation, the key length, and a CRC32 of the key, followed by
+# the UTF-8 encoded key. Clear records have no key.
+_CHANGES_FILE = "{}.changes".format(_RESERVED_PREFIX)
+_CHANGE_RECORD = struct.Struct(">BII")
+_CHANGE_OPS = ("set", "delete", "clear")
+_CHANGE_SET = 0
+_CHANGE_DELETE = 1
+_CHANGE_CLEAR = 2
+
+# Deduplicated values are stored once, within this directory, named by the
+# BLAKE2b digest of their serialized bytes. Items hold a reference to the
+# blob instead of the value: a magic string followed by the hex digest.
+# Values smaller than `_DEDUP_MIN_SIZE` are always stored in place.
+_BLOB_DIR = "{}.blobs".format(_RESERVED_PREFIX)
+_BLOB_REF_MAGIC = b"IODICT\x00\x05"
+_BLOB_REF_SIZE = len(_BLOB_REF_MAGIC) + 64
+_DEDUP_MIN_SIZE = 256
+
+# Values streamed into a store are kept as raw bytes, after this magic,
+# instead of being pickled. Pickles never start with it.
+_RAW_MAGIC = b"IODICT\x00\x06"
+
+# Streams are copied in chunks of this many bytes.
+_COPY_CHUNK = 1 << 20
+
+# Shared indexes are published to shared memory, in a segment per
+# publication, described by a control segment named after the storage path:
+# magic, publication number, the inode and counter of the store generation
+# the index is current for, size, and a CRC32 of the published index.
+# Publishing and loading are serialized by locking a file within the path.
+_INDEX_LOCK_FILE = "{}.index".format(_RESERVED_PREFIX)
+_INDEX_MAGIC = b"IODICT\x00\x07"
+_INDEX_CONTROL = struct.Struct(">8sQQQQI")
+
+# Serialized ordered indexes start with their number of rows, and the
+# lengths of their name and key arenas.
+_INDEX_COLUMNS = struct.Struct(">QQQ")
+
+# Every write to a store advances the counter held by this file, so handles
+# can tell whether their ordered index is current without listing the
+# storage path.
+_GENERATION_FILE = "{}.generation".format(_RESERVED_PREFIX)
+_GENERATION = struct.Struct("=Q")
+
+# Spill queues checkpoint the items they hold in memory to this file within
+# their storage path, using the snapshot record format with its own magic.
+_CHECKPOINT_FILE = "{}.checkpoint".format(_RESERVED_PREFIX)
+_CHECKPOINT_MAGIC = b"IODICT\x00\x08"
+
+# Spill queues write the items they spill to numbered segment files within
+# their storage path, drained in number order. Segments use the snapshot
+# record format with their own magic.
+_SEGMENT_PREFIX = "segment-"
+_SEGMENT_MAGIC = b"IODICT\x00\x09"
+
+# ioctl cloning a file into another, sharing its data blocks.
+_FICLONE = 0x40049409
+
+# File locked by FileLock objects created for a storage path.
+_LOCK_FILE = "{}.lock".format(_RESERVED_PREFIX)
+
+# Reserved files kept open, or locked, by store handles. Clearing a store in
+# the background links them into the new storage path instead of copying.
+_LINKED_FILES = (
+    _BLOOM_FILE,
+    _CHANGES_FILE,
+    _GENERATION_FILE,
+    _INDEX_LOCK_FILE,
+    _LOCK_FILE,
+)
+
+# Stores created before the key digest was configurable use this digest.
+_DEFAULT_DIGEST = "sha3_224"
+
+
+def _get_create_order(path: str, stat: typing.Callable = None):
+    """Return the file object birthtime and sequence number.
+
+    Items written in a batch share a birthtime and carry a sequence
+    number, which orders them within the batch. Items without a sequence
+    number use 0.
 
     :param path: Storage path
     :type path: String
-    :returns: Float
+    :param stat: Callable returning the file stat, such as the cached
+                 `stat` method of an `os.DirEntry`.
+    :type stat: Callable
+    :returns: Tuple
     """
     try:
         birthtime = getxattr(path, "user.birthtime")
-        return struct.unpack(">d", birthtime)[0]
+        if len(birthtime) == 16:
+            return struct.unpack(">dQ", birthtime)
+        return struct.unpack(">d", birthtime)[0], 0
     except OSError:
-        stat = os.stat(path)
+        stat = stat() if stat else os.stat(path)
         try:
-            return stat.st_birthtime
+            return stat.st_birthtime, 0
         except AttributeError:
-            return stat.st_ctime
+            return stat.st_ctime, 0
+
+
+def _get_create_time(path: str):
+    """Return the file object birthtime.
+
+    :param path: Storage path
+    :type path: String
+    :returns: Float
+    """
+    return _get_create_order(path)[0]
 
 
 def _get_item_key(path: str):
@@ -96,6 +275,29 @@ def _makedirs(path: str, key: _KT = None):
     _setxattr(path=path, key=key)
 
 
+def _object_bytes(obj: object):
+    """Return the bytes used to generate the digest of a given object.
+
+    :param obj: Object
+    :type obj: Object
+    :returns: Bytes
+    """
+    try:
+        return obj.encode()
+    except AttributeError:
+        return pickle.dumps(obj)
+
+
+def _object_blake2b(obj: object):
+    """Return the 128 bit BLAKE2b sum of a given object.
+
+    :param obj: Object
+    :type obj: Object
+    :returns: String
+    """
+    return hashlib.blake2b(_object_bytes(obj), digest_size=16).hexdigest()
+
+
 def _object_sha3_224(obj: object):
     """Return the SHA3_224 sum of a given object.
 
@@ -105,362 +307,5189 @@ def _object_sha3_224(obj: object):
     :type file_path: String
     :returns: String
     """
+    return hashlib.sha3_224(_object_bytes(obj)).hexdigest()
+
+
+def _object_xxh3_128(obj: object):
+    """Return the XXH3 128 bit sum of a given object.
+
+    > Requires the optional xxhash library.
+
+    :param obj: Object
+    :type obj: Object
+    :returns: String
+    """
+    return xxhash.xxh3_128_hexdigest(_object_bytes(obj))
+
+
+_DIGESTS = {
+    "blake2b": _object_blake2b,
+    "sha3_224": _object_sha3_224,
+}
+if xxhash is not None:
+    _DIGESTS["xxh3_128"] = _object_xxh3_128
+
+
+def _read_metadata(path: str):
+    """Return the metadata of a store, or None when it has none.
+
+    :param path: Storage path
+    :type path: String
+    :returns: Dictionary
+    """
     try:
-        return hashlib.sha3_224(obj.encode()).hexdigest()
-    except AttributeError:
-        return hashlib.sha3_224(pickle.dumps(obj)).hexdigest()
+        with open(os.path.join(path, _METADATA_FILE), "r") as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return None
 
 
-def _setxattr(path: str, key: _KT = None):
-    """Set file object attributes.
+def _write_metadata(path: str, metadata: dict):
+    """Write the metadata of a store.
 
-    :param path: File path
+    Metadata is written to a temporary file and renamed into place. Stores
+    which can not be written to are left without metadata.
+
+    :param path: Storage path
     :type path: String
-    :param key: Key information
-    :type key: String
-    :returns: Boolean
+    :param metadata: Store metadata
+    :type metadata: Dictionary
     """
+    tmp_file = os.path.join(
+        path, "{}-{}".format(_RESERVED_PREFIX, _get_uuid())
+    )
     try:
+        with open(tmp_file, "w") as f:
+            f.write(json.dumps(metadata, sort_keys=True))
+        os.rename(tmp_file, os.path.join(path, _METADATA_FILE))
+    except OSError:
         try:
-            getxattr(path, "user.birthtime")
+            os.unlink(tmp_file)
         except OSError:
-            setxattr(
-                path,
-                "user.birthtime",
-                struct.pack(">d", time.time()),
-            )
+            pass
+
+
+def _has_items(path: str):
+    """Return True if a storage path holds any items.
+
+    :param path: Storage path
+    :type path: String
+    :returns: Boolean
+    """
+    try:
+        for item in os.scandir(path):
+            if not item.name.startswith(_RESERVED_PREFIX):
+                return True
     except OSError:
         pass
+
+    return False
+
+
+def _has_xattrs(path: str):
+    """Return True if the filesystem of a storage path supports xattrs.
+
+    :param path: Storage path
+    :type path: String
+    :returns: Boolean
+    """
+    try:
+        listxattr(path)
+    except Exception:
+        return False
     else:
-        if key:
-            setxattr(path, "user.key", key.encode())
+        return True
 
 
-class BaseClass:
-    """Base class for the iodict library."""
+def _pack_header(key: _KT, birthtime: float, sequence: int = 0):
+    """Return the header of an item within a header store.
 
-    def __exit__(
-        self, exc_type: typing.Any, exc_value: typing.Any, tb: typing.Any
-    ):
-        """Exit and return boolean.
+    :param key: Named object.
+    :type key: Object
+    :param birthtime: Birthtime of the item.
+    :type birthtime: Float
+    :param sequence: Sequence number of the item.
+    :type sequence: Integer
+    :returns: Bytes
+    """
+    key = str(key).encode()
+    return _HEADER.pack(_HEADER_MAGIC, birthtime, sequence, len(key)) + key
 
-        :returns: Boolean
+
+def _unpack_header(data: bytes):
+    """Return the key, order, and payload offset of an item header.
+
+    :param data: Item data, starting with its header.
+    :type data: Bytes
+    :returns: Tuple
+    """
+    try:
+        magic, birthtime, sequence, length = _HEADER.unpack_from(data)
+    except struct.error:
+        magic = None
+    if magic != _HEADER_MAGIC or len(data) < _HEADER.size + length:
+        raise ValueError("Item has no metadata header")
+
+    start = _HEADER.size
+    offset = start + length
+    key = bytes(data[start:offset]).decode()
+    return key, (birthtime, sequence), offset
+
+
+def _read_header(path: str):
+    """Return the key and order stored in the header of an item file.
+
+    :param path: File path
+    :type path: String
+    :returns: Tuple
+    """
+    with open(path, "rb", buffering=0) as f:
+        data = f.read(_HEADER.size + 256)
+        try:
+            length = _HEADER.unpack_from(data)[3]
+        except struct.error:
+            length = 0
+        if len(data) < _HEADER.size + length:
+            data += f.read(_HEADER.size + length - len(data))
+
+    key, order, _ = _unpack_header(data)
+    return key, order
+
+
+@contextlib.contextmanager
+def _open_snapshot(snapshot: typing.Any, mode: str):
+    """Open a snapshot path, or pass through an open file object.
+
+    :param snapshot: Snapshot path or file object.
+    :type snapshot: String || Object
+    :param mode: File open mode.
+    :type mode: String
+    :yields: Object
+    """
+    if hasattr(snapshot, "read") or hasattr(snapshot, "write"):
+        yield snapshot
+    else:
+        with open(snapshot, mode) as f:
+            yield f
+
+
+def _remove_tree(path: str, background: bool = False):
+    """Remove a directory tree, optionally on a background thread.
+
+    :param path: Directory path
+    :type path: String
+    :param background: Remove the tree on a background thread.
+    :type background: Boolean
+    """
+    if background:
+        threading.Thread(
+            target=shutil.rmtree,
+            args=(path,),
+            kwargs={"ignore_errors": True},
+            daemon=True,
+        ).start()
+    else:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _clone_file(source: str, dest: str):
+    """Create a reflink of a file, along with its attributes.
+
+    :param source: Source file path
+    :type source: String
+    :param dest: New file path
+    :type dest: String
+    """
+    with open(source, "rb") as src, open(dest, "xb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        except OSError:
+            os.unlink(dest)
+            raise
+    shutil.copystat(source, dest)
+
+
+def _fsync(path: str):
+    """Flush a file, or a directory, to disk.
+
+    :param path: File or directory path.
+    :type path: String
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _sync_filesystem(path: str):
+    """Flush every file of the filesystem holding a path to disk.
+
+    Uses `syncfs` where the C library has it, and `os.sync`, which flushes
+    every filesystem, elsewhere.
+
+    :param path: Path within the filesystem.
+    :type path: String
+    """
+    if _syncfs is None:
+        os.sync()
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if _syncfs(fd) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+    finally:
+        os.close(fd)
+
+
+def _write_record(
+    f: typing.BinaryIO, key: bytes, value: bytes, birthtime, sequence
+):
+    """Write a snapshot record.
+
+    :param f: Writable binary file object.
+    :type f: Object
+    :param key: Encoded key.
+    :type key: Bytes
+    :param value: Serialized object.
+    :type value: Bytes
+    :param birthtime: Birthtime of the item.
+    :type birthtime: Float
+    :param sequence: Sequence number of the item.
+    :type sequence: Integer
+    """
+    f.write(
+        _SNAPSHOT_RECORD.pack(
+            len(key),
+            len(value),
+            birthtime,
+            sequence,
+            zlib.crc32(value, zlib.crc32(key)),
+        )
+    )
+    f.write(key)
+    f.write(value)
+
+
+def _copy_stream(source: typing.BinaryIO, f: typing.BinaryIO):
+    """Copy a file object, from its position to its end, into a file.
+
+    Regular files are copied by the kernel, with `copy_file_range`, or
+    `sendfile` when it is not supported. Other file objects are copied in
+    chunks of `_COPY_CHUNK` bytes.
+
+    :param source: Readable binary file object.
+    :type source: Object
+    :param f: Writable binary file, opened on a file descriptor.
+    :type f: Object
+    :returns: Integer
+    """
+    f.flush()
+    try:
+        src = source.fileno()
+        offset = source.tell()
+    except (AttributeError, OSError):
+        src = None
+
+    total = 0
+    if src is not None and stat.S_ISREG(os.fstat(src).st_mode):
+        dst = f.fileno()
+        copies = [
+            lambda: os.sendfile(dst, src, offset + total, _COPY_CHUNK * 64),
+        ]
+        if hasattr(os, "copy_file_range"):
+            copies.insert(
+                0,
+                lambda: os.copy_file_range(
+                    src, dst, _COPY_CHUNK * 64, offset + total
+                ),
+            )
+        while copies:
+            try:
+                copied = copies[0]()
+            except OSError:
+                copies.pop(0)
+                continue
+            if not copied:
+                source.seek(offset + total)
+                return total
+            total += copied
+
+        source.seek(offset + total)
+
+    while True:
+        chunk = source.read(_COPY_CHUNK)
+        if not chunk:
+            return total
+        f.write(chunk)
+        total += len(chunk)
+
+
+class _ValueFile(io.RawIOBase):
+    """Read only file object of a raw value within an item file."""
+
+    def __init__(self, fd: int, offset: int):
+        """Wrap an item file descriptor.
+
+        :param fd: Item file descriptor, owned by the object.
+        :type fd: Integer
+        :param offset: Offset of the value within the item file.
+        :type offset: Integer
         """
-        if exc_type is not None:
-            traceback.print_exception(exc_type, exc_value, tb)
-            return False
+        super().__init__()
+        self._fd = fd
+        self._offset = offset
+        self._position = 0
 
+    def close(self):
+        """Close the item file."""
+        if not self.closed:
+            os.close(self._fd)
+        super().close()
+
+    def readable(self):
+        """Return True.
+
+        :returns: Boolean
+        """
         return True
 
+    def readinto(self, buffer: typing.Any):
+        """Read bytes into a buffer, and return their number.
 
-class IODict(BaseClass):
-    def __init__(self, path: str, lock: typing.Any = None):
-        """Initialize the POSIX compatible datastore.
+        :param buffer: Writable buffer.
+        :type buffer: Object
+        :returns: Integer
+        """
+        data = os.pread(self._fd, len(buffer), self._offset + self._position)
+        size = len(data)
+        buffer[:size] = data
+        self._position += size
+        return size
 
-        The POSIX cache store uses xattrs to store metadata about stored
-        objects. Metadata is used to store the key and expiry information
-        which is used to ensure we're maintaining a POSIX compliant data
-        store which leverages simple file hashing. If xattrs are not
-        availble on the filesystem, the cache method will fallback to a
-        standard string encoding, and rely on in file information for
-        expiry times.
+    def seek(self, position: int, whence: int = os.SEEK_SET):
+        """Move to a position of the value, and return it.
 
-        > If a lock object is not provided, a multiprocessing lock will
-          be used.
+        :param position: Position, relative to `whence`.
+        :type position: Integer
+        :param whence: `os.SEEK_SET`, `os.SEEK_CUR`, or `os.SEEK_END`.
+        :type whence: Integer
+        :returns: Integer
+        """
+        if whence == os.SEEK_CUR:
+            position += self._position
+        elif whence == os.SEEK_END:
+            position += os.fstat(self._fd).st_size - self._offset
+        if position < 0:
+            raise ValueError("negative seek position {}".format(position))
+        self._position = position
+        return position
 
-        :param path: Storage path
-        :type path: String
-        :param lock: Lock type object
-        :type lock: Object
+    def seekable(self):
+        """Return True.
+
+        :returns: Boolean
         """
-        if not lock:
-            lock = multiprocessing.Lock()
+        return True
 
-        self._lock = lock
-        self._db_path = os.path.abspath(os.path.expanduser(path))
-        _makedirs(path=self._db_path)
+    def tell(self):
+        """Return the position within the value.
+
+        :returns: Integer
+        """
+        return self._position
+
+
+def _read_snapshot(
+    f: typing.BinaryIO,
+    magic: bytes = _SNAPSHOT_MAGIC,
+    load_key: typing.Callable = bytes.decode,
+):
+    """Read a snapshot stream and yield its records.
+
+    Records are read one at a time, and every record is checked against
+    its checksum before being returned.
+
+    :param f: Readable binary file object.
+    :type f: Object
+    :param magic: Magic string the stream starts with.
+    :type magic: Bytes
+    :param load_key: Callable returning the key of a record from its bytes.
+    :type load_key: Object
+    :yields: Tuple
+    """
+    if f.read(len(magic)) != magic:
+        raise ValueError("Not an iodict snapshot")
+
+    count = 0
+    while True:
+        header = f.read(_SNAPSHOT_RECORD.size)
+        if len(header) != _SNAPSHOT_RECORD.size:
+            raise ValueError("Snapshot is truncated")
+
+        key_len, value_len, birthtime, sequence, crc = _SNAPSHOT_RECORD.unpack(
+            header
+        )
+        if key_len == _SNAPSHOT_END:
+            if value_len != count:
+                raise ValueError("Snapshot record count mismatch")
+            return
+
+        key = f.read(key_len)
+        value = f.read(value_len)
+        if len(key) != key_len or len(value) != value_len:
+            raise ValueError("Snapshot is truncated")
+        elif zlib.crc32(value, zlib.crc32(key)) != crc:
+            raise ValueError("Snapshot checksum mismatch")
+
+        count += 1
+        yield load_key(key), birthtime, sequence, value
+
+
+def _setxattr(
+    path: str,
+    key: _KT = None,
+    birthtime: float = None,
+    sequence: int = None,
+):
+    """Set file object attributes.
+
+    :param path: File path
+    :type path: String
+    :param key: Key information
+    :type key: String
+    :param birthtime: Birthtime to set, defaults to now.
+    :type birthtime: Float
+    :param sequence: Sequence number within a batch sharing a birthtime.
+    :type sequence: Integer
+    :returns: Integer
+    """
+    calls = 0
+    if birthtime is None:
+        birthtime = time.time()
+
+    if sequence is None:
+        value = struct.pack(">d", birthtime)
+    else:
+        value = struct.pack(">dQ", birthtime, sequence)
+
+    try:
         try:
-            listxattr(self._db_path)
-        except Exception:
-            self._encoder = str
-        else:
-            self._encoder = _object_sha3_224
+            getxattr(path, "user.birthtime")
+        except OSError:
+            calls += 1
+            setxattr(path, "user.birthtime", value)
+    except OSError:
+        pass
+    else:
+        if key:
+            calls += 1
+            setxattr(path, "user.key", key.encode())
 
-    def __delitem__(self, key: _KT):
-        """Delete an item from the datastore.
+    return calls
 
-        :param key: Named object.
-        :type key: Object
-        """
-        item = os.path.join(self._db_path, self._encoder(key))
-        with self._lock:
-            try:
-                os.unlink(item)
-            except FileNotFoundError:
-                raise KeyError(key) from None
 
-    def __enter__(self):
-        """Contect manager enter object.
+# Upper bounds, in seconds, of the latency histogram buckets.
+_LATENCY_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.5,
+    1.0,
+    5.0,
+)
 
-        Entering the context manager will return itself.
 
-        :returns: Object
-        """
-        return self
+class _NullTimer:
+    """Context manager timing nothing, for phases without metrics.
+
+    Stands in for `contextlib.nullcontext`, which Python 3.6 lacks.
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def _instrumented(name: str):
+    """Record the latency of a store method, when metrics are enabled.
+
+    :param name: Histogram name.
+    :type name: String
+    :returns: Callable
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if self._metrics is None:
+                return func(self, *args, **kwargs)
+            elif self._slow_log is None:
+                with self._metrics.timer(name):
+                    return func(self, *args, **kwargs)
+
+            key = args[0] if args else None
+            with self._slow_log.operation(self, name, key):
+                with self._metrics.timer(name):
+                    return func(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class Metrics:
+    """Counters and latency histograms for store operations.
+
+    A Metrics object can be shared by several stores. Every recorded value
+    is also passed to the hooks, callables receiving the metric name and
+    value, which allows forwarding metrics to another collector.
+
+    >>> metrics = iodict.Metrics()
+    >>> d = iodict.IODict(path="/tmp/iodict", metrics=metrics)
+    >>> d.stats()["set_seconds"]["count"]
+    """
+
+    def __init__(self, hooks: typing.Iterable[typing.Callable] = None):
+        """Initialize the metrics.
+
+        :param hooks: Callables receiving the name and value of every
+                      recorded metric.
+        :type hooks: Iterable
+        """
+        self._lock = threading.Lock()
+        self._counters = dict()
+        self._histograms = dict()
+        self._hooks = list(hooks or list())
+
+    def add_hook(self, hook: typing.Callable):
+        """Add a hook receiving the name and value of every metric.
+
+        :param hook: Callable.
+        :type hook: Object
+        """
+        self._hooks.append(hook)
+
+    def count(self, name: str, value: int = 1):
+        """Increment a counter.
+
+        :param name: Counter name.
+        :type name: String
+        :param value: Increment.
+        :type value: Integer
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        for hook in self._hooks:
+            hook(name, value)
+
+    def observe(self, name: str, seconds: float):
+        """Record a latency within a histogram.
+
+        :param name: Histogram name.
+        :type name: String
+        :param seconds: Latency.
+        :type seconds: Float
+        """
+        position = bisect.bisect_left(_LATENCY_BUCKETS, seconds)
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {
+                    "count": 0,
+                    "sum": 0.0,
+                    "buckets": [0] * (len(_LATENCY_BUCKETS) + 1),
+                }
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["buckets"][position] += 1
+        for hook in self._hooks:
+            hook(name, seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        """Record the latency of the wrapped block.
+
+        :param name: Histogram name.
+        :type name: String
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def lock(self, lock: typing.Any):
+        """Acquire a lock, recording the time spent waiting for it.
+
+        :param lock: Lock type object
+        :type lock: Object
+        """
+        start = time.perf_counter()
+        with lock:
+            self.observe("lock_wait_seconds", time.perf_counter() - start)
+            yield
+
+    def stats(self):
+        """Return a snapshot of all metrics.
+
+        Counters are returned as integers. Histograms are returned as
+        dictionaries of count, sum and cumulative buckets, keyed by their
+        upper bound. The index hit rate is derived from the index hit and
+        miss counters.
+
+        :returns: Dictionary
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            for name, histogram in self._histograms.items():
+                cumulative = 0
+                buckets = dict()
+                bounds = _LATENCY_BUCKETS + (float("inf"),)
+                for bound, value in zip(bounds, histogram["buckets"]):
+                    cumulative += value
+                    buckets[bound] = cumulative
+                stats[name] = {
+                    "count": histogram["count"],
+                    "sum": histogram["sum"],
+                    "buckets": buckets,
+                }
+
+        lookups = stats.get("index_hits", 0) + stats.get("index_misses", 0)
+        if lookups:
+            stats["index_hit_rate"] = stats.get("index_hits", 0) / lookups
+        return stats
+
+    def collect(self, namespace: str = "iodict"):
+        """Return all metrics in the Prometheus text exposition format.
+
+        :param namespace: Prefix of every metric name.
+        :type namespace: String
+        :returns: String
+        """
+        lines = list()
+        for name, value in sorted(self.stats().items()):
+            metric = "{}_{}".format(namespace, name)
+            if not isinstance(value, dict):
+                kind = "gauge" if name == "index_hit_rate" else "counter"
+                lines.append("# TYPE {} {}".format(metric, kind))
+                lines.append("{} {}".format(metric, value))
+                continue
+
+            lines.append("# TYPE {} histogram".format(metric))
+            for bound, count in value["buckets"].items():
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    '{}_bucket{{le="{}"}} {}'.format(metric, le, count)
+                )
+            lines.append("{}_sum {}".format(metric, value["sum"]))
+            lines.append("{}_count {}".format(metric, value["count"]))
+
+        return "\n".join(lines) + "\n"
+
+
+class SlowLog:
+    """Record individual store operations slower than a threshold.
+
+    Every slow operation is kept as a record, logged as a warning by the
+    `iodict` logger, and passed to the callback when one is set. Records
+    carry the operation, key digest, store size, elapsed time, and the time
+    spent in each phase of the operation, such as lock wait, scan, sort,
+    io, serialize and deserialize.
+
+    >>> slow_log = iodict.SlowLog(threshold=0.5, stack=True)
+    >>> d = iodict.IODict(path="/tmp/iodict", slow_log=slow_log)
+    >>> slow_log.records
+    """
+
+    def __init__(
+        self,
+        threshold: float = 1.0,
+        stack: bool = False,
+        memory: bool = False,
+        profile: bool = False,
+        callback: typing.Callable = None,
+        maxlen: int = 1000,
+    ):
+        """Initialize the slow operation log.
+
+        :param threshold: Minimum elapsed time of a recorded operation,
+                          in seconds.
+        :type threshold: Float
+        :param stack: Record the caller stack.
+        :type stack: Boolean
+        :param memory: Record the memory allocated by the operation, using
+                       tracemalloc. Tracing is started when not running.
+        :type memory: Boolean
+        :param profile: Profile every operation, and record the most
+                        expensive calls of slow operations.
+        :type profile: Boolean
+        :param callback: Callable receiving every record.
+        :type callback: Object
+        :param maxlen: Maximum number of records kept.
+        :type maxlen: Integer
+        """
+        self.threshold = threshold
+        self.stack = stack
+        self.memory = memory
+        self.profile = profile
+        self.callback = callback
+        self.records = collections.deque(maxlen=maxlen)
+        self._local = threading.local()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def phase(self, name: str, value: typing.Any):
+        """Add time to the phase of the current operation.
+
+        This is a metrics hook, values of metrics other than timers are
+        ignored.
+
+        :param name: Metric name.
+        :type name: String
+        :param value: Metric value.
+        :type value: Float
+        """
+        frames = getattr(self._local, "frames", None)
+        if not frames or not name.endswith("_seconds"):
+            return
+
+        frame = frames[-1]
+        if name != frame["operation"]:
+            phase = name[: -len("_seconds")]
+            frame["phases"][phase] = frame["phases"].get(phase, 0.0) + value
+
+    @contextlib.contextmanager
+    def operation(self, store: typing.Any, name: str, key: _KT = None):
+        """Time an operation, and record it when it is slow.
+
+        :param store: Store running the operation.
+        :type store: Object
+        :param name: Operation name.
+        :type name: String
+        :param key: Named object of the operation.
+        :type key: Object
+        """
+        frames = getattr(self._local, "frames", None)
+        if frames is None:
+            frames = self._local.frames = list()
+        frame = {"operation": name, "phases": dict()}
+        frames.append(frame)
+
+        profiler = None
+        if self.profile:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                profiler = None
+        memory = tracemalloc.get_traced_memory()[0] if self.memory else 0
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler:
+                profiler.disable()
+            frames.pop()
+            if elapsed >= self.threshold:
+                record = {
+                    "operation": name[: -len("_seconds")],
+                    "key_digest": None,
+                    "store_size": store._size(),
+                    "seconds": elapsed,
+                    "phases": frame["phases"],
+                }
+                if key is not None:
+                    record["key_digest"] = store._encoder(key)
+                if self.stack:
+                    record["stack"] = traceback.format_stack()[:-3]
+                if self.memory:
+                    allocated = tracemalloc.get_traced_memory()[0] - memory
+                    record["memory"] = allocated
+                if profiler:
+                    output = io.StringIO()
+                    profile = pstats.Stats(profiler, stream=output)
+                    profile.sort_stats("cumulative").print_stats(10)
+                    record["profile"] = output.getvalue()
+                self._record(record)
+
+    def _record(self, record: dict):
+        """Keep, log, and forward a record.
+
+        :param record: Slow operation record.
+        :type record: Dictionary
+        """
+        self.records.append(record)
+        _LOG.warning(
+            "Slow %s took %.6fs, key %s, size %s, phases %s",
+            record["operation"],
+            record["seconds"],
+            record["key_digest"],
+            record["store_size"],
+            record["phases"],
+        )
+        if self.callback:
+            self.callback(record)
+
+
+# Thread locks of striped lock tables, by process id and lock file path.
+_STRIPE_LOCKS = dict()
+_STRIPE_LOCKS_LOCK = threading.Lock()
+
+
+def _deadline(block: bool, timeout: float = None):
+    """Return the monotonic time to stop waiting for a lock at.
+
+    :param block: Wait for the lock.
+    :type block: Boolean
+    :param timeout: Maximum time to wait, in seconds.
+    :type timeout: Float
+    :returns: Float
+    """
+    if not block or timeout is None:
+        return None
+    return time.monotonic() + timeout
+
+
+def _acquire_thread_lock(lock: typing.Any, block: bool, deadline: float):
+    """Acquire a thread lock, waiting until a deadline.
+
+    :param lock: Thread lock.
+    :type lock: Object
+    :param block: Wait for the lock.
+    :type block: Boolean
+    :param deadline: Monotonic time to stop waiting at.
+    :type deadline: Float
+    :returns: Boolean
+    """
+    if deadline is None:
+        return lock.acquire(block)
+    return lock.acquire(True, max(deadline - time.monotonic(), 0))
+
+
+def _acquire_file_lock(
+    lock: typing.Callable, block: bool, deadline: float = None
+):
+    """Acquire an exclusive file lock, waiting until a deadline.
+
+    :param lock: Callable taking the fcntl lock flags.
+    :type lock: Object
+    :param block: Wait for the lock.
+    :type block: Boolean
+    :param deadline: Monotonic time to stop waiting at.
+    :type deadline: Float
+    :returns: Boolean
+    """
+    if block and deadline is None:
+        lock(fcntl.LOCK_EX)
+        return True
+
+    while True:
+        try:
+            lock(fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (BlockingIOError, PermissionError):
+            if not block or time.monotonic() >= deadline:
+                return False
+            time.sleep(0.001)
+        else:
+            return True
+
+
+class FileLock:
+    """Advisory file lock, shared by unrelated processes.
+
+    The lock is taken with `fcntl.flock` on a lock file, so any process
+    opening the same path is coordinated, without inheriting a lock object.
+    Threads within a process are coordinated by a thread lock. FileLock
+    objects can be pickled; the lock file is reopened by every process.
+
+    Dropping a store removes its lock file, and the next store opened at
+    the same path creates a new one. Locks are checked against the lock
+    file at their path once taken, and taken again on the new file when it
+    was replaced, so old and new handles keep excluding each other.
+
+    >>> lock = iodict.FileLock("/tmp/iodict")
+    >>> d = iodict.IODict(path="/tmp/iodict", lock=lock)
+    """
+
+    def __init__(self, path: str):
+        """Initialize the lock.
+
+        The lock file is a reserved file within the storage path, which is
+        created when the lock is first acquired.
+
+        :param path: Storage path
+        :type path: String
+        """
+        self.path = os.path.join(
+            os.path.abspath(os.path.expanduser(path)), _LOCK_FILE
+        )
+        self._thread_lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    def __getstate__(self):
+        """Return the picklable state of the lock.
+
+        :returns: Dictionary
+        """
+        return {"path": self.path}
+
+    def __setstate__(self, state: dict):
+        """Restore the lock, without opening the lock file.
+
+        :param state: Pickled state.
+        :type state: Dictionary
+        """
+        self.path = state["path"]
+        self._thread_lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+
+    def __enter__(self):
+        """Acquire the lock.
+
+        :returns: Boolean
+        """
+        return self.acquire()
+
+    def __exit__(self, *args):
+        """Release the lock."""
+        self.release()
+
+    def _fileno(self):
+        """Return the lock file descriptor of the current process.
+
+        Forked children share the descriptors of their parent, and a flock
+        taken through a shared descriptor is shared as well, so the lock file
+        is reopened when the process changes.
+
+        :returns: Integer
+        """
+        if self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+        return self._fd
+
+    def _stale(self):
+        """Return True when the lock file was removed or replaced.
+
+        :returns: Boolean
+        """
+        try:
+            return not os.path.samestat(os.fstat(self._fd), os.stat(self.path))
+        except FileNotFoundError:
+            return True
+
+    def _reopen(self):
+        """Close the lock file, so it is opened again by path."""
+        os.close(self._fd)
+        self._pid = None
+
+    def acquire(self, block: bool = True, timeout: float = None):
+        """Acquire the lock.
+
+        :param block: Wait for the lock.
+        :type block: Boolean
+        :param timeout: Maximum time to wait, in seconds.
+        :type timeout: Float
+        :returns: Boolean
+        """
+        deadline = _deadline(block, timeout)
+        if not _acquire_thread_lock(self._thread_lock, block, deadline):
+            return False
+
+        try:
+            while _acquire_file_lock(
+                functools.partial(fcntl.flock, self._fileno()),
+                block,
+                deadline,
+            ):
+                if not self._stale():
+                    return True
+                # Closing the lock file releases the lock taken on it.
+                self._reopen()
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+        self._thread_lock.release()
+        return False
+
+    def release(self):
+        """Release the lock."""
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+
+class _Stripe:
+    """A single stripe of a StripedFileLock, used as a lock object."""
+
+    def __init__(self, table: "StripedFileLock", index: int):
+        """Initialize the stripe.
+
+        :param table: Lock table.
+        :type table: Object
+        :param index: Stripe number.
+        :type index: Integer
+        """
+        self.table = table
+        self.index = index
+
+    def __enter__(self):
+        """Acquire the stripe.
+
+        :returns: Boolean
+        """
+        return self.acquire()
+
+    def __exit__(self, *args):
+        """Release the stripe."""
+        self.release()
+
+    def acquire(self, block: bool = True, timeout: float = None):
+        """Acquire the stripe.
+
+        :param block: Wait for the stripe.
+        :type block: Boolean
+        :param timeout: Maximum time to wait, in seconds.
+        :type timeout: Float
+        :returns: Boolean
+        """
+        return self.table._acquire(
+            [self.index], block, _deadline(block, timeout)
+        )
+
+    def release(self):
+        """Release the stripe."""
+        self.table._release([self.index])
+
+
+class StripedFileLock(FileLock):
+    """Table of advisory file locks, striped by stored item name.
+
+    Every item is guarded by one of `stripes` locks, chosen by a stable
+    hash of its name, so operations on items in different stripes run in
+    parallel, within a process and across unrelated processes. Stripes are
+    `fcntl.lockf` byte range locks on the lock file of the storage path.
+    Acquiring the table itself locks every stripe.
+
+    >>> lock = iodict.StripedFileLock("/tmp/iodict", stripes=64)
+    >>> d = iodict.IODict(path="/tmp/iodict", lock=lock)
+
+    > Byte range locks are held by processes, not by file descriptors, so
+      the thread locks of a table are shared by every table of the same
+      lock file within a process. Tables of the same lock file need the
+      same number of stripes, which stores record in their metadata.
+    """
+
+    def __init__(self, path: str, stripes: int = 64):
+        """Initialize the lock table.
+
+        :param path: Storage path
+        :type path: String
+        :param stripes: Number of stripes.
+        :type stripes: Integer
+        """
+        if stripes < 1:
+            raise ValueError("stripes must be a positive integer")
+
+        super().__init__(path)
+        self.stripes = stripes
+        self._retired = list()
+        self._thread_locks()
+
+    def __getstate__(self):
+        """Return the picklable state of the lock table.
+
+        :returns: Dictionary
+        """
+        return {"path": self.path, "stripes": self.stripes}
+
+    def __setstate__(self, state: dict):
+        """Restore the lock table, without opening the lock file.
+
+        :param state: Pickled state.
+        :type state: Dictionary
+        """
+        super().__setstate__(state)
+        self.stripes = state["stripes"]
+        self._retired = list()
+
+    def _reopen(self):
+        """Open the lock file again by path, keeping the old one open.
+
+        Closing any descriptor of a file drops every byte range lock the
+        process holds on it, including stripes held by other tables.
+        """
+        self._retired.append(self._fd)
+        self._pid = None
+
+    def _thread_locks(self):
+        """Return the thread locks of the stripes, shared within a process.
+
+        :returns: List
+        """
+        with _STRIPE_LOCKS_LOCK:
+            locks = _STRIPE_LOCKS.get((os.getpid(), self.path))
+            if locks is None:
+                locks = _STRIPE_LOCKS[(os.getpid(), self.path)] = [
+                    threading.Lock() for _ in range(self.stripes)
+                ]
+            elif len(locks) != self.stripes:
+                raise ValueError(
+                    "Lock file {} has {} stripes, not {}".format(
+                        self.path, len(locks), self.stripes
+                    )
+                )
+            return locks
+
+    def _acquire(
+        self, indexes: typing.List[int], block: bool, deadline: float
+    ):
+        """Acquire stripes, in order.
+
+        :param indexes: Stripe numbers, in ascending order.
+        :type indexes: List
+        :param block: Wait for the stripes.
+        :type block: Boolean
+        :param deadline: Monotonic time to stop waiting at.
+        :type deadline: Float
+        :returns: Boolean
+        """
+        locks = self._thread_locks()
+        held = list()
+        try:
+            for index in indexes:
+                if not _acquire_thread_lock(locks[index], block, deadline):
+                    return False
+                held.append(index)
+
+            if len(indexes) == 1:
+                length, start = 1, indexes[0]
+            else:
+                length, start = 0, 0
+            while True:
+                fd = self._fileno()
+                if not _acquire_file_lock(
+                    lambda flags: fcntl.lockf(fd, flags, length, start),
+                    block,
+                    deadline,
+                ):
+                    return False
+                elif not self._stale():
+                    held = list()
+                    return True
+                fcntl.lockf(fd, fcntl.LOCK_UN, length, start)
+                self._reopen()
+        finally:
+            for index in reversed(held):
+                locks[index].release()
+
+    def _release(self, indexes: typing.List[int]):
+        """Release stripes.
+
+        :param indexes: Stripe numbers.
+        :type indexes: List
+        """
+        locks = self._thread_locks()
+        try:
+            if len(indexes) == 1:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, indexes[0])
+            else:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 0, 0)
+        finally:
+            for index in reversed(indexes):
+                locks[index].release()
+
+    def acquire(self, block: bool = True, timeout: float = None):
+        """Acquire every stripe of the table.
+
+        :param block: Wait for the stripes.
+        :type block: Boolean
+        :param timeout: Maximum time to wait, in seconds.
+        :type timeout: Float
+        :returns: Boolean
+        """
+        return self._acquire(
+            list(range(self.stripes)), block, _deadline(block, timeout)
+        )
+
+    def release(self):
+        """Release every stripe of the table."""
+        self._release(list(range(self.stripes)))
+
+    def stripe(self, name: str):
+        """Return the lock guarding a stored item.
+
+        :param name: Stored item name.
+        :type name: String
+        :returns: Object
+        """
+        return _Stripe(self, zlib.crc32(name.encode()) % self.stripes)
+
+
+class _BloomFilter:
+    """Persisted Bloom filter of the item names within a storage path.
+
+    The filter file is memory mapped and shared by every process opening
+    the store on the same host. Names are added before their item is
+    written, and never removed, so a name missing from the filter is not
+    stored, while a name found may still be missing.
+    """
+
+    def __init__(self, path: str):
+        """Open an existing filter file.
+
+        :param path: Filter file path.
+        :type path: String
+        """
+        self.path = path
+        self._open()
+
+    def __getstate__(self):
+        """Return the picklable state of the filter.
+
+        :returns: Dictionary
+        """
+        return {"path": self.path}
+
+    def __setstate__(self, state: dict):
+        """Reopen the filter file.
+
+        :param state: Pickled state.
+        :type state: Dictionary
+        """
+        self.path = state["path"]
+        self._open()
+
+    def _open(self):
+        """Map the filter file."""
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR)
+        try:
+            self._map = mmap.mmap(self._fd, 0)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        magic, self.bits, self.hashes = _BLOOM_HEADER.unpack_from(self._map)
+        if magic != _BLOOM_MAGIC:
+            raise ValueError("{} is not a bloom filter".format(self.path))
+
+    @classmethod
+    def create(cls, path: str, capacity: int, rate: float = 0.01):
+        """Create a filter file, unless one exists, and open it.
+
+        :param path: Filter file path.
+        :type path: String
+        :param capacity: Expected number of items.
+        :type capacity: Integer
+        :param rate: False positive rate at capacity.
+        :type rate: Float
+        :returns: Object
+        """
+        bits = max(int(-capacity * math.log(rate) / math.log(2) ** 2), 64)
+        hashes = max(int(round(bits / capacity * math.log(2))), 1)
+        tmp_file = "{}-{}".format(
+            os.path.join(os.path.dirname(path), _RESERVED_PREFIX), _get_uuid()
+        )
+        try:
+            with open(tmp_file, "wb") as f:
+                f.write(_BLOOM_HEADER.pack(_BLOOM_MAGIC, bits, hashes))
+                f.truncate(_BLOOM_HEADER.size + (bits + 7) // 8)
+            os.link(tmp_file, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.unlink(tmp_file)
+        return cls(path)
+
+    @classmethod
+    def load(cls, path: str):
+        """Open a filter file, or return None when there is none.
+
+        :param path: Filter file path.
+        :type path: String
+        :returns: Object
+        """
+        try:
+            return cls(path)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _positions(self, name: str):
+        """Return the bit positions of a name.
+
+        :param name: Stored item name.
+        :type name: String
+        :returns: List
+        """
+        digest = hashlib.blake2b(name.encode(), digest_size=16).digest()
+        first, second = struct.unpack(">QQ", digest)
+        return [
+            (first + i * second) % self.bits + _BLOOM_HEADER.size * 8
+            for i in range(self.hashes)
+        ]
+
+    def __contains__(self, name: str):
+        """Return False when a name was never added.
+
+        :param name: Stored item name.
+        :type name: String
+        :returns: Boolean
+        """
+        bitmap = self._map
+        for position in self._positions(name):
+            if not bitmap[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, name: str):
+        """Add a name to the filter.
+
+        Bits are set under a lock of the filter file, so updates from other
+        processes are not lost.
+
+        :param name: Stored item name.
+        :type name: String
+        """
+        positions = self._positions(name)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                bitmap = self._map
+                for position in positions:
+                    bitmap[position >> 3] |= 1 << (position & 7)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+
+
+class _Generation:
+    """Counter of the writes made to a store, by any handle.
+
+    The counter is kept in a memory mapped file within the storage path, so
+    every process on the host shares it. It is advanced under an flock of
+    the file, which belongs to the open file, so handles of one process
+    exclude each other too.
+
+    Generations are tuples of the inode of the file and the counter, so
+    the generations of a store replaced by a new one never match.
+    """
+
+    def __init__(self, path: str):
+        """Open the counter of a storage path, creating it.
+
+        :param path: Storage path
+        :type path: String
+        """
+        self.path = os.path.join(path, _GENERATION_FILE)
+        self._open()
+
+    def _open(self):
+        """Map the counter file, creating it."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            info = os.fstat(fd)
+            if info.st_size < _GENERATION.size:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    if os.fstat(fd).st_size < _GENERATION.size:
+                        os.ftruncate(fd, _GENERATION.size)
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+            counter = mmap.mmap(fd, _GENERATION.size)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._map = counter
+        self.inode = info.st_ino
+
+    def read(self):
+        """Return the current generation.
+
+        The counter is reopened when its file was replaced, such as by a
+        background clear, or created again after the store was dropped.
+
+        :returns: Tuple
+        """
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            inode = None
+        if inode != self.inode:
+            self._map.close()
+            os.close(self._fd)
+            self._open()
+        return self.inode, _GENERATION.unpack_from(self._map)[0]
+
+    @contextlib.contextmanager
+    def advance(self):
+        """Advance the counter, yielding the generation it advanced from.
+
+        Other writers wait while the context is held.
+
+        :yields: Tuple
+        """
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            counter = _GENERATION.unpack_from(self._map)[0]
+            _GENERATION.pack_into(self._map, 0, counter + 1)
+            yield self.inode, counter
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class _OrderIndex:
+    """Birthtime ordered index of the items within a storage path.
+
+    The index is built by listing the storage path, and comparing the
+    listed names and inodes with the indexed ones. Only new or replaced
+    items have their metadata read.
+
+    The index is kept current in place by the writes of the handle owning
+    it. Every write to a store advances the store generation, and the index
+    is marked with the generation it is current for, so the storage path is
+    only listed again once another handle wrote to it. Stores without a
+    generation, such as read-only ones, mark the index with the
+    modification time of the storage path instead. A time taken too close
+    to the listing is not trusted, as further changes within the same
+    filesystem clock tick would not change it.
+
+    Items are rows of packed columns, sorted by birthtime, sequence number
+    and name: birthtimes, sequence numbers, inodes, and the offsets and
+    sizes of names and keys are kept in arrays, the names and keys
+    themselves in byte arenas. Hex digest names are kept as the digest
+    bytes. A row costs 48 bytes, plus its name and key, instead of the
+    hundreds of bytes of tuples and strings per item. Rows are found by
+    bisecting the columns, without a mapping of names.
+
+    Removed rows leave their bytes in the arenas, which are compacted once
+    most of their bytes are unused. Columns lent to a `frozen` copy are
+    copied before they are changed, so the copy stays consistent.
+
+    The rows sorted by key are indexed on first use, in arrays referring
+    to the arenas, and kept up to date as rows are inserted and removed.
+    """
+
+    # Filesystem timestamps can trail the system clock by a clock tick.
+    racy_window = 0.05
+
+    # Number of changed rows above which a refresh builds new columns.
+    resort_rows = 64
+
+    # Unused arena bytes below which the arenas are never compacted.
+    compact_bytes = 1 << 16
+
+    def __init__(self):
+        """Initialize an empty index."""
+        self._reset()
+        self.generation = None
+
+    def _reset(self):
+        """Empty the columns, without changing columns lent to copies."""
+        self.births = array.array("d")
+        self.sequences = array.array("Q")
+        self.inodes = array.array("Q")
+        self.name_offsets = array.array("Q")
+        self.name_sizes = array.array("I")
+        self.key_offsets = array.array("Q")
+        self.key_sizes = array.array("I")
+        self.names = bytearray()
+        self.keys = bytearray()
+        self.unused = 0
+        self.key_rows = None
+        self._lent = False
+
+    def __len__(self):
+        return len(self.births)
+
+    def _columns(self):
+        """Return the array columns of the index, in serialized order.
+
+        :returns: Tuple
+        """
+        return (
+            self.births,
+            self.sequences,
+            self.inodes,
+            self.name_offsets,
+            self.name_sizes,
+            self.key_offsets,
+            self.key_sizes,
+        )
+
+    def frozen(self):
+        """Return a copy of the index sharing its columns.
+
+        The copy is not changed by later changes to the index.
+
+        :returns: Object
+        """
+        self._lent = True
+        index = _OrderIndex.__new__(_OrderIndex)
+        index.__dict__.update(self.__dict__)
+        index.key_rows = None
+        return index
+
+    def _own(self):
+        """Copy the columns lent to frozen copies, before changing them."""
+        if self._lent:
+            (
+                self.births,
+                self.sequences,
+                self.inodes,
+                self.name_offsets,
+                self.name_sizes,
+                self.key_offsets,
+                self.key_sizes,
+            ) = [column[:] for column in self._columns()]
+            self._lent = False
+
+    def refresh(self, path: str, meta: typing.Callable):
+        """Refresh the index from the items within a storage path.
+
+        Few changes are applied to the rows in place, many build new
+        columns.
+
+        :param path: Storage path
+        :type path: String
+        :param meta: Callable returning the key and order of an item, from
+                     its path and stat callable.
+        :type meta: Object
+        :returns: Tuple
+        """
+        listed = dict()
+        with os.scandir(path) as items:
+            for item in items:
+                if not item.name.startswith(_RESERVED_PREFIX):
+                    listed[item.name] = item
+        total = len(listed)
+
+        dropped = list()
+        for position in range(len(self)):
+            name = self.name(position)
+            item = listed.get(name)
+            if item is not None and item.inode() == self.inodes[position]:
+                del listed[name]
+            else:
+                dropped.append(position)
+
+        added = list()
+        for name, item in listed.items():
+            try:
+                key, (birthtime, sequence) = meta(item.path, item.stat)
+            except FileNotFoundError:
+                continue
+            added.append(
+                (
+                    birthtime,
+                    sequence,
+                    self._pack_name(name),
+                    key.encode(errors="surrogateescape"),
+                    item.inode(),
+                )
+            )
+        added.sort()
+
+        self._own()
+        if len(dropped) + len(added) > self.resort_rows:
+            previous = self.frozen()
+            dropped = set(dropped)
+            kept = (
+                previous.row(position)
+                for position in range(len(previous))
+                if position not in dropped
+            )
+            self._reset()
+            for row in heapq.merge(kept, added):
+                self._insert_row(len(self), row)
+        else:
+            for position in reversed(dropped):
+                self._remove_row(position)
+            for row in added:
+                position, found = self._find(*row[:3])
+                if found:
+                    self.inodes[position] = row[4]
+                else:
+                    self._insert_row(position, row)
+        return total, len(added)
+
+    def clear(self):
+        """Remove every row."""
+        self._reset()
+
+    def insert(self, order: tuple, name: str, key: str, inode: int):
+        """Index an item, or update the inode of an indexed one.
+
+        :param order: Item birthtime and sequence number.
+        :type order: Tuple
+        :param name: Stored item name.
+        :type name: String
+        :param key: Item key.
+        :type key: String
+        :param inode: Inode number of the item.
+        :type inode: Integer
+        """
+        self._own()
+        name = self._pack_name(name)
+        position, found = self._find(order[0], order[1], name)
+        if found:
+            self.inodes[position] = inode
+        else:
+            row = (
+                order[0],
+                order[1],
+                name,
+                key.encode(errors="surrogateescape"),
+                inode,
+            )
+            self._insert_row(position, row)
+
+    def remove(self, order: tuple, name: str):
+        """Remove an item from the index, when it is indexed.
+
+        :param order: Item birthtime and sequence number.
+        :type order: Tuple
+        :param name: Stored item name.
+        :type name: String
+        """
+        position, found = self.find(order, name)
+        if found:
+            self._own()
+            self._remove_row(position)
+
+    def find(self, order: tuple, name: str):
+        """Return the position of an item, and whether it is indexed.
+
+        The position of an item which is not indexed is the position it
+        would be inserted at.
+
+        :param order: Item birthtime and sequence number.
+        :type order: Tuple
+        :param name: Stored item name.
+        :type name: String
+        :returns: Tuple
+        """
+        return self._find(order[0], order[1], self._pack_name(name))
+
+    def _find(self, birthtime: float, sequence: int, name: bytes):
+        """Return the position of a row, and whether it exists.
+
+        :param birthtime: Item birthtime.
+        :type birthtime: Float
+        :param sequence: Item sequence number.
+        :type sequence: Integer
+        :param name: Packed stored item name.
+        :type name: Bytes
+        :returns: Tuple
+        """
+        low = bisect.bisect_left(self.births, birthtime)
+        high = bisect.bisect_right(self.births, birthtime, low)
+        low = bisect.bisect_left(self.sequences, sequence, low, high)
+        high = bisect.bisect_right(self.sequences, sequence, low, high)
+        while low < high and self._name_bytes(low) < name:
+            low += 1
+        return low, low < high and self._name_bytes(low) == name
+
+    def _insert_row(self, position: int, row: tuple):
+        """Insert an encoded row at a position.
+
+        :param position: Ordered position.
+        :type position: Integer
+        :param row: Birthtime, sequence, name, key and inode, encoded.
+        :type row: Tuple
+        """
+        birthtime, sequence, name, key, inode = row
+        name_offset = len(self.names)
+        self.names += name
+        key_offset = len(self.keys)
+        self.keys += key
+        values = (
+            birthtime,
+            sequence,
+            inode,
+            name_offset,
+            len(name),
+            key_offset,
+            len(key),
+        )
+        for column, value in zip(self._columns(), values):
+            column.insert(position, value)
+        if self.key_rows is not None:
+            key_row = (
+                key_offset,
+                len(key),
+                birthtime,
+                sequence,
+                name_offset,
+                len(name),
+            )
+            key_position = self._key_position(key)
+            for column, value in zip(self.key_rows, key_row):
+                column.insert(key_position, value)
+
+    def _remove_row(self, position: int):
+        """Remove the row at a position.
+
+        :param position: Ordered position.
+        :type position: Integer
+        """
+        if self.key_rows is not None:
+            offsets = self.key_rows[0]
+            key = self._key_bytes(position)
+            key_position = self._key_position(key)
+            while (
+                key_position < len(offsets)
+                and offsets[key_position] != self.key_offsets[position]
+                and self._key_row_bytes(key_position) == key
+            ):
+                key_position += 1
+            if (
+                key_position < len(offsets)
+                and offsets[key_position] == self.key_offsets[position]
+            ):
+                for column in self.key_rows:
+                    del column[key_position]
+
+        self.unused += self.name_sizes[position] + self.key_sizes[position]
+        for column in self._columns():
+            del column[position]
+
+        used = len(self.names) + len(self.keys) - self.unused
+        if self.unused > max(self.compact_bytes, used):
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the arenas without the bytes of removed rows."""
+        names, keys = bytearray(), bytearray()
+        name_moves, key_moves = dict(), dict()
+        for position in range(len(self)):
+            start = self.name_offsets[position]
+            size = self.name_sizes[position]
+            name_moves[start, size] = len(names)
+            end = start + size
+            names += self.names[start:end]
+            self.name_offsets[position] = name_moves[start, size]
+
+            start = self.key_offsets[position]
+            size = self.key_sizes[position]
+            key_moves[start, size] = len(keys)
+            end = start + size
+            keys += self.keys[start:end]
+            self.key_offsets[position] = key_moves[start, size]
+
+        if self.key_rows is not None:
+            key_offsets, key_sizes, _, _, name_offsets, name_sizes = (
+                self.key_rows
+            )
+            for position in range(len(key_offsets)):
+                key_offsets[position] = key_moves[
+                    key_offsets[position], key_sizes[position]
+                ]
+                name_offsets[position] = name_moves[
+                    name_offsets[position], name_sizes[position]
+                ]
+        self.names, self.keys, self.unused = names, keys, 0
+
+    @staticmethod
+    def _pack_name(name: str):
+        """Return a stored item name as bytes.
+
+        Hex digests are packed into the digest bytes, after a NUL byte,
+        which file names never contain.
+
+        :param name: Stored item name.
+        :type name: String
+        :returns: Bytes
+        """
+        try:
+            digest = bytes.fromhex(name)
+        except ValueError:
+            digest = None
+        if digest is not None and digest.hex() == name:
+            return b"\x00" + digest
+        return name.encode(errors="surrogateescape")
+
+    @staticmethod
+    def _unpack_name(data: bytes):
+        """Return a stored item name packed by `_pack_name`.
+
+        :param data: Packed name.
+        :type data: Bytes
+        :returns: String
+        """
+        if data[:1] == b"\x00":
+            return data[1:].hex()
+        return data.decode(errors="surrogateescape")
+
+    def _name_bytes(self, position: int):
+        """Return the packed name of a row.
+
+        :param position: Ordered position.
+        :type position: Integer
+        :returns: Bytes
+        """
+        start = self.name_offsets[position]
+        end = start + self.name_sizes[position]
+        return bytes(self.names[start:end])
+
+    def _key_bytes(self, position: int):
+        """Return the encoded key of a row.
+
+        :param position: Ordered position.
+        :type position: Integer
+        :returns: Bytes
+        """
+        start = self.key_offsets[position]
+        end = start + self.key_sizes[position]
+        return bytes(self.keys[start:end])
+
+    def row(self, position: int):
+        """Return a row as birthtime, sequence, name, key and inode, encoded.
+
+        :param position: Ordered position.
+        :type position: Integer
+        :returns: Tuple
+        """
+        return (
+            self.births[position],
+            self.sequences[position],
+            self._name_bytes(position),
+            self._key_bytes(position),
+            self.inodes[position],
+        )
+
+    def name(self, position: int):
+        """Return the stored item name of a row.
+
+        :param position: Ordered position.
+        :type position: Integer
+        :returns: String
+        """
+        return self._unpack_name(self._name_bytes(position))
+
+    def key(self, position: int):
+        """Return the key of a row.
+
+        :param position: Ordered position.
+        :type position: Integer
+        :returns: Object
+        """
+        return self._key_bytes(position).decode(errors="surrogateescape")
+
+    def order(self, position: int):
+        """Return the birthtime and sequence number of a row.
+
+        :param position: Ordered position.
+        :type position: Integer
+        :returns: Tuple
+        """
+        return self.births[position], self.sequences[position]
+
+    def entry(self, position: int, path: str):
+        """Return the key, order, and file path of a row.
+
+        :param position: Ordered position.
+        :type position: Integer
+        :param path: Storage path
+        :type path: String
+        :returns: Tuple
+        """
+        return (
+            self.key(position),
+            self.order(position),
+            os.path.join(path, self.name(position)),
+        )
+
+    def _key_row_bytes(self, position: int):
+        """Return the encoded key of a row sorted by key.
+
+        :param position: Position within the rows sorted by key.
+        :type position: Integer
+        :returns: Bytes
+        """
+        start = self.key_rows[0][position]
+        end = start + self.key_rows[1][position]
+        return bytes(self.keys[start:end])
+
+    def _key_position(self, key: bytes):
+        """Return the position of a key within the rows sorted by key.
+
+        :param key: Encoded key.
+        :type key: Bytes
+        :returns: Integer
+        """
+        low, high = 0, len(self.key_rows[0])
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_row_bytes(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def prefixed(self, prefix: str):
+        """Return the keys starting with a prefix, with their order and name.
+
+        The rows sorted by key are built on first use, as arrays of key
+        offsets and sizes, birthtimes, sequence numbers, and name offsets
+        and sizes. They are then kept up to date as rows change.
+
+        :param prefix: Key prefix.
+        :type prefix: String
+        :returns: List
+        """
+        if self.key_rows is None:
+            rows = sorted(range(len(self)), key=self._key_bytes)
+            self.key_rows = tuple(
+                array.array(column.typecode, [column[row] for row in rows])
+                for column in (
+                    self.key_offsets,
+                    self.key_sizes,
+                    self.births,
+                    self.sequences,
+                    self.name_offsets,
+                    self.name_sizes,
+                )
+            )
+
+        prefix = prefix.encode(errors="surrogateescape")
+        _, _, births, sequences, name_offsets, name_sizes = self.key_rows
+        matched = list()
+        for position in range(self._key_position(prefix), len(births)):
+            key = self._key_row_bytes(position)
+            if not key.startswith(prefix):
+                break
+            start = name_offsets[position]
+            end = start + name_sizes[position]
+            matched.append(
+                (
+                    key.decode(errors="surrogateescape"),
+                    (births[position], sequences[position]),
+                    self._unpack_name(bytes(self.names[start:end])),
+                )
+            )
+        return matched
+
+    def dumps(self):
+        """Return the index, serialized.
+
+        The lengths of the columns are followed by the columns, written as
+        they are kept in memory, after compacting the arenas.
+
+        :returns: Bytes
+        """
+        if self.unused:
+            self._own()
+            self._compact()
+        with io.BytesIO() as f:
+            f.write(
+                _INDEX_COLUMNS.pack(len(self), len(self.names), len(self.keys))
+            )
+            for column in self._columns():
+                column.tofile(f)
+            f.write(self.names)
+            f.write(self.keys)
+            return f.getvalue()
+
+    @classmethod
+    def loads(cls, data: bytes, generation: tuple = None):
+        """Return an index from its serialized form.
+
+        :param data: Serialized index.
+        :type data: Bytes
+        :param generation: Store generation the index is current for.
+        :type generation: Tuple
+        :returns: Object
+        """
+        index = cls()
+        count, names, keys = _INDEX_COLUMNS.unpack_from(data)
+        offset = _INDEX_COLUMNS.size
+        for column in index._columns():
+            end = offset + count * column.itemsize
+            column.frombytes(data[offset:end])
+            offset = end
+        end = offset + names
+        index.names += data[offset:end]
+        offset, end = end, end + keys
+        index.keys += data[offset:end]
+        index.generation = generation
+        return index
+
+    def slice(self, start: int = None, stop: int = None):
+        """Return the names and keys of an ordered slice of items.
+
+        :param start: First position.
+        :type start: Integer
+        :param stop: Position to stop at.
+        :type stop: Integer
+        :returns: List
+        """
+        return [
+            (self.name(position), self.key(position))
+            for position in range(*slice(start, stop).indices(len(self)))
+        ]
+
+
+class _IndexEntries(collections.abc.Sequence):
+    """Entries of an ordered index, built as they are read.
+
+    Entries are tuples of key, birthtime, and file path, as returned by
+    scanning a storage path, without holding a tuple per item.
+    """
+
+    def __init__(self, index: _OrderIndex, path: str):
+        """Wrap a frozen copy of an index.
+
+        :param index: Ordered index.
+        :type index: Object
+        :param path: Storage path.
+        :type path: String
+        """
+        self._index = index.frozen()
+        self._path = path
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, position: typing.Union[int, slice]):
+        if isinstance(position, slice):
+            return [
+                self[i] for i in range(*position.indices(len(self._index)))
+            ]
+        return self._index.entry(position, self._path)
+
+
+def _shared_memory(name: str, create: bool = False, size: int = 0):
+    """Open a shared memory segment, which outlives the process.
+
+    :param name: Segment name.
+    :type name: String
+    :param create: Create the segment.
+    :type create: Boolean
+    :param size: Size of a created segment.
+    :type size: Integer
+    :returns: Object
+    """
+    try:
+        return shared_memory.SharedMemory(
+            name=name, create=create, size=size, track=False
+        )
+    except TypeError:
+        segment = shared_memory.SharedMemory(
+            name=name, create=create, size=size
+        )
+    # Segments are otherwise removed once the process opening them exits.
+    resource_tracker.unregister(segment._name, "shared_memory")
+    return segment
+
+
+class _SharedIndex:
+    """Ordered index shared by the processes of a host.
+
+    The last index refreshed by any process is published to shared memory,
+    and loaded by the others instead of listing the storage path, and
+    reading the metadata of every item, again. An index failing its
+    checksum is ignored, and replaced by the next refresh.
+    """
+
+    def __init__(self, path: str):
+        """Attach to the shared index of a storage path.
+
+        :param path: Storage path.
+        :type path: String
+        """
+        if shared_memory is None:
+            raise ValueError("Shared indexes require shared_memory")
+        self.path = path
+        self.name = "iodict-{}".format(
+            hashlib.blake2b(path.encode(), digest_size=12).hexdigest()
+        )
+        self.published = None
+        # Created up front, as creating it changes the stamp of the path.
+        os.close(
+            os.open(os.path.join(path, _INDEX_LOCK_FILE), os.O_CREAT, 0o666)
+        )
+
+    def __getstate__(self):
+        """Return the picklable state of the index.
+
+        :returns: Dictionary
+        """
+        return {"path": self.path}
+
+    def __setstate__(self, state: dict):
+        """Attach to the shared index again.
+
+        :param state: Pickled state.
+        :type state: Dictionary
+        """
+        self.__init__(state["path"])
+
+    @contextlib.contextmanager
+    def _flock(self, operation: int):
+        """Lock the shared index.
+
+        :param operation: `fcntl.LOCK_SH` or `fcntl.LOCK_EX`.
+        :type operation: Integer
+        """
+        fd = os.open(os.path.join(self.path, _INDEX_LOCK_FILE), os.O_RDONLY)
+        try:
+            fcntl.flock(fd, operation)
+            yield
+        finally:
+            os.close(fd)
+
+    def _control(self):
+        """Return the publication, generation, size and checksum.
+
+        :returns: Tuple
+        """
+        try:
+            segment = _shared_memory(self.name)
+        except FileNotFoundError:
+            return None
+        try:
+            magic, *control = _INDEX_CONTROL.unpack_from(segment.buf)
+        except struct.error:
+            return None
+        finally:
+            segment.close()
+        return control if magic == _INDEX_MAGIC else None
+
+    def load(self):
+        """Return the published index, unless this process has it.
+
+        :returns: Object
+        """
+        with self._flock(fcntl.LOCK_SH):
+            control = self._control()
+            if control is None or control[0] == self.published:
+                return None
+
+            published, inode, counter, size, crc = control
+            try:
+                segment = _shared_memory("{}-{}".format(self.name, published))
+            except FileNotFoundError:
+                return None
+            try:
+                data = bytes(segment.buf[:size])
+            finally:
+                segment.close()
+
+        if len(data) != size or zlib.crc32(data) != crc:
+            _LOG.warning("Ignoring corrupt shared index of %s", self.path)
+            return None
+
+        self.published = published
+        return _OrderIndex.loads(data, (inode, counter))
+
+    def publish(self, index: _OrderIndex):
+        """Publish an index, replacing the published one.
+
+        :param index: Index current for a store generation.
+        :type index: Object
+        """
+        data = index.dumps()
+        with self._flock(fcntl.LOCK_EX):
+            control = self._control()
+            previous = control[0] if control else 0
+            published = previous + 1
+            name = "{}-{}".format(self.name, published)
+            try:
+                segment = _shared_memory(name, True, max(len(data), 1))
+            except FileExistsError:
+                self._unlink(name)
+                segment = _shared_memory(name, True, max(len(data), 1))
+            try:
+                segment.buf[: len(data)] = data
+            finally:
+                segment.close()
+
+            try:
+                segment = _shared_memory(self.name)
+            except FileNotFoundError:
+                segment = _shared_memory(self.name, True, _INDEX_CONTROL.size)
+            try:
+                _INDEX_CONTROL.pack_into(
+                    segment.buf,
+                    0,
+                    _INDEX_MAGIC,
+                    published,
+                    *index.generation,
+                    len(data),
+                    zlib.crc32(data),
+                )
+            finally:
+                segment.close()
+            self.published = published
+            self._unlink("{}-{}".format(self.name, previous))
+
+    def _unlink(self, name: str):
+        """Remove a segment, if it exists.
+
+        :param name: Segment name.
+        :type name: String
+        """
+        try:
+            segment = shared_memory.SharedMemory(name=name)
+        except FileNotFoundError:
+            return
+        segment.close()
+        segment.unlink()
+
+    def unlink(self):
+        """Remove the shared index."""
+        control = self._control()
+        if control is not None:
+            self._unlink("{}-{}".format(self.name, control[0]))
+        self._unlink(self.name)
+
+
+class _Transaction:
+    """Sets and deletes buffered for a transaction of a store.
+
+    Reads see the buffered changes first, then the store.
+    """
+
+    def __init__(self, store: "IODict"):
+        """Start buffering changes.
+
+        :param store: Store the transaction is committed to.
+        :type store: Object
+        """
+        self._store = store
+        self._changes = collections.OrderedDict()
+
+    def __contains__(self, key: _KT):
+        """Return True when a key is set.
+
+        :param key: Named object.
+        :type key: Object
+        :returns: Boolean
+        """
+        if key in self._changes:
+            return self._changes[key] is not None
+        return key in self._store
+
+    def __delitem__(self, key: _KT):
+        """Delete an item when the transaction is committed.
+
+        :param key: Named object.
+        :type key: Object
+        """
+        if key not in self:
+            raise KeyError(key)
+        self._changes.pop(key, None)
+        self._changes[key] = None
+
+    def __getitem__(self, key: _KT):
+        """Return the value of a given key.
+
+        :param key: Named object.
+        :type key: Object
+        :returns: Object
+        """
+        if key not in self._changes:
+            return self._store[key]
+        elif self._changes[key] is None:
+            raise KeyError(key)
+        return self._store._loads(self._changes[key])
+
+    def __len__(self):
+        """Return the number of buffered changes.
+
+        :returns: Integer
+        """
+        return len(self._changes)
+
+    def __setitem__(self, key: _KT, value: _VT):
+        """Set an item when the transaction is committed.
+
+        The value is serialized right away.
+
+        :param key: Named object to set.
+        :type key: Object
+        :param value: Object to set.
+        :type value: Object
+        """
+        self._changes.pop(key, None)
+        self._changes[key] = self._store._dumps(value)
+
+    def get(self, key: _KT, default: typing.Any = None):
+        """Return the value of a given key, or a default.
+
+        :param key: Named object.
+        :type key: Object
+        :param default: Value returned when the key is not set.
+        :type default: Object
+        :returns: Object
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key: _KT, default: typing.Any = None):
+        """Delete an item when committed, and return its value.
+
+        :param key: Named object.
+        :type key: Object
+        :param default: Value returned when the key is not set.
+        :type default: Object
+        :returns: Object
+        """
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        del self[key]
+        return value
+
+    def update(self, mapping: typing.Mapping[_KT, _VT]):
+        """Set all items of a mapping when committed.
+
+        :param mapping: Key and value pairs.
+        :type mapping: Dictionary
+        """
+        for key, value in mapping.items():
+            self[key] = value
+
+
+class BaseClass:
+    """Base class for the iodict library."""
+
+    def __exit__(
+        self, exc_type: typing.Any, exc_value: typing.Any, tb: typing.Any
+    ):
+        """Exit and return boolean.
+
+        :returns: Boolean
+        """
+        if exc_type is not None:
+            traceback.print_exception(exc_type, exc_value, tb)
+            return False
+
+        return True
+
+
+class IODict(BaseClass):
+    def __init__(
+        self,
+        path: str,
+        lock: typing.Any = None,
+        digest: str = None,
+        metrics: typing.Any = None,
+        slow_log: typing.Any = None,
+        metadata: str = None,
+        bloom: int = None,
+        changes: bool = False,
+        dedup: bool = False,
+        shared_index: bool = False,
+        exclusive: bool = False,
+    ):
+        """Initialize the POSIX compatible datastore.
+
+        The POSIX cache store uses xattrs to store metadata about stored
+        objects. Metadata is used to store the key and expiry information
+        which is used to ensure we're maintaining a POSIX compliant data
+        store which leverages simple file hashing. If xattrs are not
+        availble on the filesystem, the cache method will fallback to a
+        standard string encoding, and rely on in file information for
+        expiry times.
+
+        > If a lock object is not provided, a multiprocessing lock will
+          be used.
+
+        When xattrs are available, keys are stored by their digest. The
+        digest algorithm, one of `sha3_224` (default), `blake2b`, or
+        `xxh3_128` (requires xxhash), is recorded in the store metadata when
+        the store is created. Stores created without metadata use
+        `sha3_224`. Opening a store with a different digest than the one
+        recorded raises ValueError.
+
+        Item metadata is kept in xattrs when they are available, and in a
+        header in front of every serialized object otherwise. The header
+        mode can also be requested with `metadata="header"`, which keeps
+        both in a single file and write, and needs no xattr calls. The mode
+        is recorded in the store metadata along with the digest, so later
+        opens do not probe the filesystem again. Stores created without
+        xattrs before headers existed name items by their key, and order
+        them by ctime.
+
+        When `metrics` is set, to a Metrics object or True, operation
+        latency, lock wait, serialization, I/O, xattr and scan metrics are
+        recorded and returned by `stats()`. Without metrics, no time is
+        taken or counted.
+
+        When `slow_log` is set to a SlowLog object, operations slower than
+        its threshold are recorded along with the time spent in each phase.
+        Metrics are used to time the phases, so a Metrics object is created
+        when one is not given.
+
+        When `dedup` is set, values written by this handle are stored once
+        per distinct value, in a content addressed blob, and items refer to
+        the blob. Writing a value which is already stored writes only the
+        reference. Every handle reads items referring to blobs.
+
+        When `shared_index` is set, the ordered index is shared with the
+        other processes of the host using a shared index for the store,
+        through shared memory. An index refreshed by one process is loaded
+        by the others, instead of each listing the storage path and reading
+        the metadata of every item. Iteration, `popitem` and queue gets then
+        use the index too.
+
+        When `exclusive` is set, the handle is taken to be the only writer
+        of the store, such as a server owning it. Once built, the ordered
+        index is kept current by the writes of the handle alone, without
+        checking the store generation, and `len`, `popitem` and queue gets
+        are answered from it without touching the storage path. Writes made
+        by other handles are not seen until the index is cleared.
+
+        When `bloom` is set to the expected number of items, a Bloom filter
+        of the stored names, sized for a 1% false positive rate, is created
+        and filled from the items already stored. The filter is kept in the
+        storage path, and used by every handle opening the store after it
+        was created, so lookups of missing keys do not touch the items.
+
+        > The filter is shared through memory mapping, which is coherent on
+          a single host only. Handles opened before the filter was created,
+          or before the store was dropped, must be reopened.
+
+        :param path: Storage path
+        :type path: String
+        :param lock: Lock type object
+        :type lock: Object
+        :param digest: Key digest algorithm
+        :type digest: String
+        :param metrics: Metrics object, or True to create one.
+        :type metrics: Object
+        :param slow_log: SlowLog object.
+        :type slow_log: Object
+        :param metadata: Item metadata mode, `xattr` or `header`.
+        :type metadata: String
+        :param bloom: Expected number of items, to create a Bloom filter.
+        :type bloom: Integer
+        :param changes: Create a change log, see `watch()`.
+        :type changes: Boolean
+        :param dedup: Store identical values once, see `collect_blobs()`.
+        :type dedup: Boolean
+        :param shared_index: Share the ordered index with other processes.
+        :type shared_index: Boolean
+        :param exclusive: Trust the ordered index kept by this handle.
+        :type exclusive: Boolean
+        """
+        if not lock:
+            lock = multiprocessing.Lock()
+
+        if metrics is True or (slow_log and not metrics):
+            metrics = Metrics()
+
+        if slow_log and slow_log.phase not in metrics._hooks:
+            metrics.add_hook(slow_log.phase)
+
+        self._lock = lock
+        self._metrics = metrics or None
+        self._slow_log = slow_log
+        self._index = None
+        self._index_lock = threading.RLock()
+        self._db_path = os.path.abspath(os.path.expanduser(path))
+        _makedirs(path=self._db_path)
+        self._generation = self._open_generation()
+        self._exclusive = exclusive and self._generation is not None
+        self._mode, digest = self._configure(digest, metadata)
+        self._check_stripes()
+        if self._mode == "legacy":
+            self._encoder = str
+        else:
+            self._encoder = _DIGESTS[digest]
+        self._dedup = dedup
+        self._shared_index = None
+        if shared_index:
+            self._shared_index = _SharedIndex(self._db_path)
+        self._bloom = self._open_bloom(bloom)
+        self._change_log = self._open_change_log(changes)
+        self._replay()
+
+    def _check_stripes(self):
+        """Record the stripes of a lock table in the store metadata.
+
+        Tables striped differently hash items to different byte ranges of
+        the lock file, so they never exclude each other. A store only
+        accepts tables striped like the first one it was opened with.
+        """
+        stripes = getattr(self._lock, "stripes", None)
+        if stripes is None:
+            return
+
+        stored = _read_metadata(self._db_path)
+        if stored is None:
+            return
+        elif "stripes" not in stored:
+            stored["stripes"] = stripes
+            _write_metadata(self._db_path, stored)
+        elif stored["stripes"] != stripes:
+            raise ValueError(
+                "Store lock has {} stripes, not {}".format(
+                    stored["stripes"], stripes
+                )
+            )
+
+    def _open_generation(self):
+        """Return the generation of the store, counting its writes.
+
+        Stores which can not be written to have none, and their ordered
+        index is checked against the modification time of the storage path.
+
+        :returns: Object
+        """
+        try:
+            return _Generation(self._db_path)
+        except OSError:
+            return None
+
+    def _open_bloom(self, capacity: int = None):
+        """Return the Bloom filter of the store, when it has one.
+
+        A new filter is published before it is filled, so names written
+        while it is being filled are added by their writers.
+
+        :param capacity: Expected number of items, to create a filter.
+        :type capacity: Integer
+        :returns: Object
+        """
+        path = os.path.join(self._db_path, _BLOOM_FILE)
+        bloom = _BloomFilter.load(path)
+        if bloom is not None or not capacity:
+            return bloom
+
+        bloom = _BloomFilter.create(path, capacity)
+        with os.scandir(self._db_path) as items:
+            for item in items:
+                if not item.name.startswith(_RESERVED_PREFIX):
+                    bloom.add(item.name)
+        return bloom
+
+    def _open_change_log(self, create: bool = False):
+        """Return a descriptor appending to the change log, when it exists.
+
+        :param create: Create the change log when it does not exist.
+        :type create: Boolean
+        :returns: Integer
+        """
+        flags = os.O_WRONLY | os.O_APPEND
+        if create:
+            flags |= os.O_CREAT
+        try:
+            return os.open(os.path.join(self._db_path, _CHANGES_FILE), flags)
+        except FileNotFoundError:
+            return None
+
+    def _log_change(self, op: int, key: _KT = None):
+        """Append a record to the change log, when the store has one.
+
+        Records are appended with a single write, so records written by
+        several processes are never interleaved.
+
+        :param op: Operation, one of `_CHANGE_SET`, `_CHANGE_DELETE` and
+                   `_CHANGE_CLEAR`.
+        :type op: Integer
+        :param key: Named object.
+        :type key: Object
+        """
+        if self._change_log is None:
+            return
+
+        key = b"" if key is None else str(key).encode()
+        record = _CHANGE_RECORD.pack(op, len(key), zlib.crc32(key)) + key
+        os.write(self._change_log, record)
+
+    def _configure(self, digest: str = None, metadata: str = None):
+        """Return the item metadata mode and key digest of the store.
+
+        Both are recorded in the store metadata when the store is created.
+        Metadata written before the mode was recorded is updated once, by
+        probing the filesystem for xattr support.
+
+        :param digest: Requested key digest algorithm
+        :type digest: String
+        :param metadata: Requested item metadata mode
+        :type metadata: String
+        :returns: Tuple
+        """
+        if digest and digest not in _DIGESTS:
+            raise ValueError("Digest {} is not available".format(digest))
+        elif metadata and metadata not in _METADATA_MODES[:2]:
+            raise ValueError("Metadata mode {} is unknown".format(metadata))
+
+        stored = _read_metadata(self._db_path)
+        if stored is None or "metadata" not in stored:
+            xattrs = _has_xattrs(self._db_path)
+            if stored is not None:
+                stored["metadata"] = "xattr" if xattrs else "legacy"
+            elif _has_items(self._db_path):
+                stored = {
+                    "digest": _DEFAULT_DIGEST,
+                    "metadata": "xattr" if xattrs else "legacy",
+                }
+            else:
+                if metadata == "xattr" and not xattrs:
+                    raise ValueError("Xattrs are not supported by the path")
+                stored = {
+                    "digest": digest or _DEFAULT_DIGEST,
+                    "metadata": metadata or ("xattr" if xattrs else "header"),
+                }
+            _write_metadata(self._db_path, stored)
+
+        mode = stored["metadata"]
+        digest_stored = stored.get("digest", _DEFAULT_DIGEST)
+        if metadata and metadata != mode:
+            raise ValueError(
+                "Store metadata mode is {}, not {}".format(mode, metadata)
+            )
+        elif mode not in _METADATA_MODES:
+            raise ValueError("Metadata mode {} is unknown".format(mode))
+        elif mode == "legacy":
+            return mode, None
+        elif digest and digest != digest_stored:
+            raise ValueError(
+                "Store digest is {}, not {}".format(digest_stored, digest)
+            )
+        elif digest_stored not in _DIGESTS:
+            raise ValueError(
+                "Digest {} is not available".format(digest_stored)
+            )
+
+        return mode, digest_stored
+
+    def __contains__(self, key: _KT):
+        """Return True when a key is stored.
+
+        :param key: Named object.
+        :type key: Object
+        :returns: Boolean
+        """
+        return self.has(key)
+
+    @_instrumented("delete_seconds")
+    def __delitem__(self, key: _KT):
+        """Delete an item from the datastore.
+
+        :param key: Named object.
+        :type key: Object
+        """
+        name = self._encoder(key)
+        item = os.path.join(self._db_path, name)
+        with self._locked(item):
+            order = self._item_order(item)
+            try:
+                os.unlink(item)
+            except FileNotFoundError:
+                raise KeyError(key) from None
+        self._log_change(_CHANGE_DELETE, key)
+        self._unindexed(name, order)
+
+    def __enter__(self):
+        """Contect manager enter object.
+
+        Entering the context manager will return itself.
+
+        :returns: Object
+        """
+        return self
+
+    def __exit__(
+        self, exc_type: typing.Any, exc_value: typing.Any, tb: typing.Any
+    ):
+        """Clean up the dictionary and exit the context manager.
+
+        :returns: Boolean
+        """
+        try:
+            self.clear()
+        finally:
+            return super().__exit__(exc_type, exc_value, tb)
+
+    def __getstate__(self):
+        """Return the picklable state of the store.
+
+        Stores are pickled as lightweight handles, holding the storage path,
+        the probed key encoder, and the lock. A lock which can not be shared
+        with other processes, such as the default multiprocessing lock, is
+        replaced by a FileLock for the storage path. Metrics, the slow log,
+        and the ordered index are not pickled, and handles are unpickled
+        without `exclusive`, as they no longer are the only writer.
+
+        > To coordinate with the processes a store is pickled to, use a
+          FileLock in the parent as well.
+
+        :returns: Dictionary
+        """
+        lock = self._lock
+        if not isinstance(lock, FileLock):
+            lock = FileLock(self._db_path)
+        return {
+            "path": self._db_path,
+            "encoder": self._encoder,
+            "mode": self._mode,
+            "lock": lock,
+            "bloom": self._bloom,
+            "changes": self._change_log is not None,
+            "dedup": self._dedup,
+            "shared_index": self._shared_index,
+        }
+
+    def __setstate__(self, state: dict):
+        """Reattach to a store, without probing the storage path again.
+
+        :param state: Pickled state.
+        :type state: Dictionary
+        """
+        self._lock = state["lock"]
+        self._db_path = state["path"]
+        self._encoder = state["encoder"]
+        self._mode = state["mode"]
+        self._bloom = state.get("bloom")
+        self._dedup = state.get("dedup", False)
+        self._shared_index = state.get("shared_index")
+        self._change_log = None
+        if state.get("changes"):
+            self._change_log = self._open_change_log()
+        self._metrics = None
+        self._slow_log = None
+        self._index = None
+        self._index_lock = threading.RLock()
+        self._generation = self._open_generation()
+        self._exclusive = False
+
+    @_instrumented("get_seconds")
+    def __getitem__(self, key: _KT):
+        """Return the value of a given key.
+
+        If a given key is not found, get will raise a KeyError exception.
+
+        :param key: Named object.
+        :type key: Object
+        :returns: Object
+        """
+        name = self._encoder(key)
+        if not self._maybe_stored(name):
+            raise KeyError(key)
+
+        file_object = os.path.join(self._db_path, name)
+        try:
+            return self._read(file_object)
+        except FileNotFoundError:
+            raise KeyError(key) from None
+
+    def _maybe_stored(self, name: str):
+        """Return False when the Bloom filter rules out a stored name.
+
+        :param name: Stored item name.
+        :type name: String
+        :returns: Boolean
+        """
+        if self._bloom is None or name in self._bloom:
+            return True
+
+        if self._metrics is not None:
+            self._metrics.count("bloom_negatives")
+        return False
+
+    def _locked(self, path: str = None):
+        """Return the store lock, timing the wait when metrics are enabled.
+
+        When the lock is a lock table, such as a StripedFileLock, only the
+        lock guarding the item at `path` is returned.
+
+        :param path: File path
+        :type path: String
+        :returns: Object
+        """
+        lock = self._lock
+        if path is not None:
+            stripe = getattr(lock, "stripe", None)
+            if stripe is not None:
+                lock = stripe(os.path.basename(path))
+
+        if self._metrics is None:
+            return lock
+        return self._metrics.lock(lock)
+
+    def _timed(self, name: str):
+        """Return a context manager timing a phase, when metrics are enabled.
+
+        :param name: Histogram name.
+        :type name: String
+        :returns: Object
+        """
+        if self._metrics is None:
+            return _NULL_TIMER
+        return self._metrics.timer(name)
+
+    def _size(self):
+        """Return the number of items, without reading any xattrs.
+
+        :returns: Integer
+        """
+        index = self._index
+        if index is not None:
+            try:
+                if index.generation == self._current():
+                    return len(index)
+            except FileNotFoundError:
+                return 0
+
+        try:
+            with os.scandir(self._db_path) as items:
+                return sum(
+                    1
+                    for item in items
+                    if not item.name.startswith(_RESERVED_PREFIX)
+                )
+        except FileNotFoundError:
+            return 0
+
+    def _dumps(self, value: typing.Any):
+        """Serialize an object.
+
+        :param value: Object to serialize.
+        :type value: Object
+        :returns: Bytes
+        """
+        if self._metrics is None:
+            return pickle.dumps(value)
+
+        with self._metrics.timer("serialize_seconds"):
+            data = pickle.dumps(value)
+        self._metrics.count("bytes_written", len(data))
+        return data
+
+    def _loads(self, data: bytes):
+        """Deserialize an object.
+
+        :param data: Serialized object.
+        :type data: Bytes
+        :returns: Object
+        """
+        if data[:8] == _RAW_MAGIC:
+            start = len(_RAW_MAGIC)
+            return bytes(data[start:])
+        elif self._metrics is None:
+            return pickle.loads(data)
+
+        self._metrics.count("bytes_read", len(data))
+        with self._metrics.timer("deserialize_seconds"):
+            return pickle.loads(data)
+
+    def _current(self):
+        """Return the generation of the store, to check indexes against.
+
+        Without a generation, the modification time of the storage path is
+        returned instead. Exclusive handles return the generation of their
+        index, once it is built.
+
+        :returns: Object
+        """
+        index = self._index
+        if self._exclusive and index is not None:
+            if index.generation is not None:
+                return index.generation
+        if self._generation is not None:
+            return self._generation.read()
+        return os.stat(self._db_path).st_mtime_ns
+
+    def _ordered(self):
+        """Return the ordered index, refreshing it when it may be stale.
+
+        The index is changed in place by later writes of this handle, so
+        reading more than one row should hold `_index_lock`.
+
+        :returns: Object
+        """
+        with self._index_lock:
+            started = time.time()
+            try:
+                generation = self._current()
+            except FileNotFoundError:
+                self._index = None
+                return _OrderIndex()
+
+            index = self._index
+            if index is not None and index.generation == generation:
+                if self._metrics is not None:
+                    self._metrics.count("index_hits")
+                return index
+
+            if self._shared_index is not None:
+                shared = self._shared_index.load()
+                if shared is not None:
+                    index = self._index = shared
+                    if index.generation == generation:
+                        if self._metrics is not None:
+                            self._metrics.count("index_shared_hits")
+                        return index
+
+            if index is None:
+                index = self._index = _OrderIndex()
+
+            try:
+                with self._timed("scan_seconds"):
+                    listed, added = index.refresh(
+                        self._db_path, self._item_meta
+                    )
+            except BaseException:
+                self._index = None
+                raise
+
+            if self._generation is None:
+                # Changes within the same clock tick keep the same time.
+                if generation / 1e9 >= started - index.racy_window:
+                    generation = None
+            index.generation = generation
+
+            if self._metrics is not None:
+                self._metrics.count("index_misses")
+                self._metrics.count("scan_items", listed)
+                if self._mode != "header":
+                    self._metrics.count("getxattr_calls", added * 2)
+
+            if self._shared_index is not None and self._generation is not None:
+                self._shared_index.publish(index)
+            return index
+
+    def _advance(self, change: typing.Callable = None):
+        """Advance the store generation, after a write by this handle.
+
+        When the ordered index was current before the write, `change` is
+        called with it to apply the write in place, keeping it current.
+        Otherwise the index is refreshed when it is next used. The index of
+        an exclusive handle is taken to be current.
+
+        :param change: Callable applying the write to the ordered index.
+        :type change: Object
+        """
+        if self._generation is None:
+            return
+
+        with self._index_lock:
+            with self._generation.advance() as generation:
+                index = self._index
+                if index is None or index.generation is None:
+                    return
+                elif change is not None and (
+                    self._exclusive or index.generation == generation
+                ):
+                    change(index)
+                    index.generation = generation[0], generation[1] + 1
+                elif self._exclusive:
+                    index.generation = None
+
+    def _vanished(self, path: str, order: tuple = None):
+        """Drop an item found missing from the ordered index.
+
+        Items removed outside of the store, such as by hand, do not advance
+        the store generation. Without the order of the item, the index is
+        refreshed when it is next used instead.
+
+        :param path: File path
+        :type path: String
+        :param order: Birthtime and sequence number of the item.
+        :type order: Tuple
+        """
+        with self._index_lock:
+            index = self._index
+            if index is None:
+                return
+            elif order is None:
+                index.generation = None
+            else:
+                index.remove(order, os.path.basename(path))
+
+    def _item_order(self, path: str):
+        """Return the order of an item, while the ordered index is in use.
+
+        :param path: File path
+        :type path: String
+        :returns: Tuple
+        """
+        if self._index is None:
+            return None
+        try:
+            return self._item_meta(path)[1]
+        except (OSError, ValueError):
+            return None
+
+    def _indexed(self, name: str, key: _KT, order: tuple, previous: tuple):
+        """Advance the store generation after setting an item.
+
+        :param name: Stored item name.
+        :type name: String
+        :param key: Item key.
+        :type key: Object
+        :param order: Birthtime and sequence number of the item.
+        :type order: Tuple
+        :param previous: Order of the replaced item, when it was indexed.
+        :type previous: Tuple
+        """
+        info = None
+        if self._index is not None:
+            path = os.path.join(self._db_path, name)
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                pass
+        if info is None:
+            self._advance()
+            return
+
+        if self._mode == "legacy":
+            order = _get_create_order(path, lambda: info)
+
+        def change(index: _OrderIndex):
+            if previous is not None:
+                index.remove(previous, name)
+            index.insert(order, name, str(key), info.st_ino)
+
+        self._advance(change)
+
+    def _unindexed(self, name: str, order: tuple):
+        """Advance the store generation after deleting an item.
+
+        :param name: Stored item name.
+        :type name: String
+        :param order: Order of the deleted item, when it was indexed.
+        :type order: Tuple
+        """
+        if order is None:
+            self._advance()
+        else:
+            self._advance(lambda index: index.remove(order, name))
+
+    def _read_slice(self, names: typing.List[typing.Tuple[str, _KT]]):
+        """Read the values of indexed items, and yield key, value tuples.
+
+        Items which vanished since they were indexed are skipped.
+
+        :param names: List of stored item names and keys.
+        :type names: List
+        :yields: Tuple
+        """
+        for name, key in names:
+            path = os.path.join(self._db_path, name)
+            try:
+                yield key, self._read(path)
+            except FileNotFoundError:
+                self._vanished(path)
+
+    def _select(self, prefix: str = None, match: typing.Any = None):
+        """Return entries for string keys matching a prefix or pattern.
+
+        Entries are tuples of key, birthtime, and file path, in birthtime
+        order. Candidates are found with the sorted key index, so only
+        keys sharing the prefix, or the literal start of a glob pattern,
+        are checked against the pattern.
+
+        :param prefix: Key prefix.
+        :type prefix: String
+        :param match: Glob pattern string, or compiled regular expression.
+        :type match: String || Object
+        :returns: List
+        """
+        narrow = prefix or ""
+        search = None
+        if isinstance(match, str):
+            literal = re.split(r"[*?\[]", match, maxsplit=1)[0]
+            if literal.startswith(narrow):
+                narrow = literal
+            elif not narrow.startswith(literal):
+                return list()
+            search = re.compile(fnmatch.translate(match)).match
+        elif match is not None:
+            search = match.search
+
+        with self._index_lock:
+            candidates = self._ordered().prefixed(narrow)
+
+        selected = [
+            (key, order, os.path.join(self._db_path, name))
+            for key, order, name in candidates
+            if search is None or search(key)
+        ]
+        selected.sort(key=operator.itemgetter(1))
+        return selected
+
+    def _item_meta(self, path: str, stat: typing.Callable = None):
+        """Return the key, and birthtime and sequence number, of an item.
+
+        Without metadata, such as for items of legacy stores, the key is the
+        file name, and birthtime falls back to the file stat.
+
+        :param path: File path
+        :type path: String
+        :param stat: Callable returning the file stat, such as the cached
+                     `stat` method of an `os.DirEntry`.
+        :type stat: Callable
+        :returns: Tuple
+        """
+        if self._mode == "header":
+            try:
+                return _read_header(path)
+            except ValueError:
+                return os.path.basename(path), _get_create_order(path, stat)
+
+        return _get_item_key(path), _get_create_order(path, stat=stat)
+
+    def _payload(self, data: bytes):
+        """Return the serialized object of item data, without its header.
+
+        :param data: Item data.
+        :type data: Bytes
+        :returns: Bytes
+        """
+        if self._mode == "header":
+            offset = _unpack_header(data)[2]
+            data = memoryview(data)[offset:]
+        if len(data) == _BLOB_REF_SIZE and bytes(data).startswith(
+            _BLOB_REF_MAGIC
+        ):
+            with open(self._blob_path(data), "rb") as f:
+                return f.read()
+        return data
+
+    def _blob_path(self, ref: bytes):
+        """Return the path of the blob a reference refers to.
+
+        :param ref: Blob reference.
+        :type ref: Bytes
+        :returns: String
+        """
+        start = len(_BLOB_REF_MAGIC)
+        digest = bytes(ref[start:]).decode()
+        return os.path.join(self._db_path, _BLOB_DIR, digest)
+
+    def _dedup_ref(self, data: bytes):
+        """Store a value as a blob, unless it is stored, and return its ref.
+
+        The modification time of an existing blob is refreshed, so it is
+        not collected while the reference is being written.
+
+        :param data: Serialized object.
+        :type data: Bytes
+        :returns: Bytes
+        """
+        ref = (
+            _BLOB_REF_MAGIC
+            + hashlib.blake2b(data, digest_size=32).hexdigest().encode()
+        )
+        blob = self._blob_path(ref)
+        try:
+            os.utime(blob)
+        except FileNotFoundError:
+            blob_dir = os.path.dirname(blob)
+            os.makedirs(blob_dir, exist_ok=True)
+            tmp_blob = os.path.join(
+                blob_dir, "{}-{}".format(_RESERVED_PREFIX, _get_uuid())
+            )
+            try:
+                with open(tmp_blob, "wb") as f:
+                    f.write(data)
+                os.rename(tmp_blob, blob)
+            except BaseException:
+                os.unlink(tmp_blob)
+                raise
+        else:
+            if self._metrics is not None:
+                self._metrics.count("dedup_hits")
+        return ref
+
+    def _scan(self):
+        """Scan the storage path and yield entries as they are found.
+
+        Entries are tuples of key, birthtime, and file path, in directory
+        order.
+
+        :yields: Tuple
+        """
+        if not os.path.exists(self._db_path):
+            return
+
+        count = 0
+        try:
+            for item in os.scandir(self._db_path):
+                if item.name.startswith(_RESERVED_PREFIX):
+                    continue
+                count += 1
+                try:
+                    key, order = self._item_meta(item.path, item.stat)
+                except FileNotFoundError:
+                    continue
+                yield key, order, item.path
+        finally:
+            if self._metrics is not None:
+                self._metrics.count("scan_items", count)
+                if self._mode != "header":
+                    self._metrics.count("getxattr_calls", count * 2)
+
+    def _entries(self, limit: int = None):
+        """Return stored entries sorted by birthtime.
+
+        Entries are tuples of key, birthtime, and file path, read from the
+        ordered index. Without a limit, they are built as they are read,
+        from a frozen copy of the index. With one, the oldest `limit`
+        entries are returned as a list.
+
+        :param limit: Maximum number of entries to return.
+        :type limit: Integer
+        :returns: Sequence
+        """
+        with self._index_lock:
+            index = self._ordered()
+            if limit is None:
+                return _IndexEntries(index, self._db_path)
+            return [
+                index.entry(position, self._db_path)
+                for position in range(min(limit, len(index)))
+            ]
+
+    def _prefetch(self, entries: typing.Iterable, prefetch: int):
+        """Read values ahead of the caller on a background thread.
+
+        Up to `prefetch` values are held in memory. When the caller stops
+        iterating, the background thread stops as well.
+
+        :param entries: Iterable of key, birthtime, and file path tuples.
+        :type entries: Iterable
+        :param prefetch: Number of values to read ahead.
+        :type prefetch: Integer
+        :yields: Tuple
+        """
+        buffer = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        done = object()
+
+        def _put(item):
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                except queue.Full:
+                    continue
+                else:
+                    return True
+            return False
+
+        def _reader():
+            try:
+                for key, _, path in entries:
+                    try:
+                        item = (key, self._read(path))
+                    except FileNotFoundError:
+                        continue
+                    if not _put(item):
+                        return
+            except BaseException as e:
+                _put((done, e))
+            else:
+                _put((done, None))
+
+        reader = threading.Thread(target=_reader, daemon=True)
+        reader.start()
+        try:
+            while True:
+                key, value = buffer.get()
+                if key is done:
+                    if value is not None:
+                        raise value
+                    return
+                yield key, value
+        finally:
+            stop.set()
+            reader.join()
+
+    def _read(self, path: str):
+        """Return the deserialized object stored at a given file path.
+
+        :param path: File path
+        :type path: String
+        :returns: Object
+        """
+        with self._locked(path):
+            with self._timed("io_seconds"):
+                with open(path, "rb") as f:
+                    data = f.read()
+
+        return self._loads(self._payload(data))
+
+    def _pop_path(self, path: str, key: _KT, order: tuple = None):
+        """Remove and return the object stored at a given file path.
+
+        :param path: File path
+        :type path: String
+        :param key: Named object.
+        :type key: Object
+        :param order: Birthtime and sequence number of the item, when known.
+        :type order: Tuple
+        :returns: Object
+        """
+        with self._locked(path):
+            if order is None:
+                order = self._item_order(path)
+            try:
+                with self._timed("io_seconds"):
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    os.unlink(path)
+            except FileNotFoundError:
+                raise KeyError(key) from None
+
+        self._log_change(_CHANGE_DELETE, key)
+        self._unindexed(os.path.basename(path), order)
+        return self._loads(self._payload(data))
+
+    def _create(self, key: _KT, data: bytes, birthtime: float, sequence: int):
+        """Create a new item in the datastore from serialized data.
+
+        The item is written to a reserved temporary name, has its attributes
+        set, and is then renamed into place. Readers never see a partially
+        written item, so the lock is not held and several callers can
+        create items in parallel.
+
+        > An existing item is replaced, and its birthtime is not kept.
+
+        :param key: Named object to set.
+        :type key: Object
+        :param data: Serialized object, or a callable writing the item
+                     payload to the open file.
+        :type data: Bytes || Callable
+        :param birthtime: Birthtime of the item.
+        :type birthtime: Float
+        :param sequence: Sequence number of the item.
+        :type sequence: Integer
+        """
+        name = self._encoder(key)
+        if self._bloom is not None:
+            self._bloom.add(name)
+        payload = data
+        if self._dedup and not callable(data) and len(data) >= _DEDUP_MIN_SIZE:
+            payload = self._dedup_ref(data)
+        tmp_object = os.path.join(
+            self._db_path, "{}-{}".format(_RESERVED_PREFIX, _get_uuid())
+        )
+        try:
+            with open(tmp_object, "wb") as f:
+                if self._mode == "header":
+                    f.write(_pack_header(key, birthtime, sequence))
+                if callable(payload):
+                    payload(f)
+                else:
+                    f.write(payload)
+
+            if self._mode == "header":
+                calls = None
+            else:
+                calls = _setxattr(
+                    path=tmp_object,
+                    key=key,
+                    birthtime=birthtime,
+                    sequence=sequence,
+                )
+            target = os.path.join(self._db_path, name)
+            previous = self._item_order(target)
+            os.rename(tmp_object, target)
+        except BaseException:
+            try:
+                os.unlink(tmp_object)
+            except FileNotFoundError:
+                pass
+            raise
+
+        self._log_change(_CHANGE_SET, key)
+        self._indexed(name, key, (birthtime, sequence), previous)
+
+        if self._metrics is not None and calls is not None:
+            self._metrics.count("getxattr_calls")
+            self._metrics.count("setxattr_calls", calls)
+
+    @_instrumented("commit_seconds")
+    def _commit(self, changes: typing.Mapping[_KT, bytes]):
+        """Log a transaction, apply it, then remove its log.
+
+        The log is written and synced once, before any item is changed, and
+        kept locked by this process until it is removed. Opening the store
+        applies logs left complete by a failed commit, and removes those
+        left incomplete.
+
+        :param changes: Serialized objects, or None for deletes, by key.
+        :type changes: Dictionary
+        """
+        if not changes:
+            return
+
+        wal_dir = os.path.join(self._db_path, _WAL_DIR)
+        os.makedirs(wal_dir, exist_ok=True)
+        wal = os.path.join(wal_dir, _get_uuid())
+        with self._locked(), open(wal, "wb") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                with self._timed("io_seconds"):
+                    self._write_log(f, changes)
+                    _fsync(wal_dir)
+            except BaseException:
+                os.unlink(wal)
+                raise
+
+            # A log which fails to apply is kept, and finished on next open.
+            self._apply(changes.items())
+            os.unlink(wal)
+
+    @staticmethod
+    def _write_log(f: typing.BinaryIO, changes: typing.Mapping[_KT, bytes]):
+        """Write and sync a transaction log.
+
+        :param f: Writable binary file object.
+        :type f: Object
+        :param changes: Serialized objects, or None for deletes, by key.
+        :type changes: Dictionary
+        """
+        f.write(_WAL_MAGIC)
+        for key, data in changes.items():
+            if data is None:
+                _write_record(f, pickle.dumps(key), b"", 0, _WAL_DELETE)
+            else:
+                _write_record(f, pickle.dumps(key), data, 0, _WAL_SET)
+        f.write(_SNAPSHOT_RECORD.pack(_SNAPSHOT_END, len(changes), 0, 0, 0))
+        f.flush()
+        os.fsync(f.fileno())
+
+    def _apply(self, changes: typing.Iterable[typing.Tuple[_KT, bytes]]):
+        """Apply logged changes to the store, with the store locked.
+
+        Applying changes again is harmless, so a log can be replayed after
+        it was partly applied. The filesystem of the store is synced before
+        returning, with a single call however many items were applied, so
+        the log can then be removed.
+
+        :param changes: Key and serialized object, or None for deletes.
+        :type changes: Iterable
+        """
+        for key, data in changes:
+            name = self._encoder(key)
+            path = os.path.join(self._db_path, name)
+            if data is None:
+                order = self._item_order(path)
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    continue
+                self._log_change(_CHANGE_DELETE, key)
+                self._unindexed(name, order)
+            else:
+                birthtime, sequence = self._kept_order(path)
+                self._create(
+                    key=key, data=data, birthtime=birthtime, sequence=sequence
+                )
+
+        _sync_filesystem(self._db_path)
+
+    def _replay(self):
+        """Finish, or roll back, transactions left by failed commits.
+
+        Logs still locked belong to commits in progress, and are skipped.
+        """
+        wal_dir = os.path.join(self._db_path, _WAL_DIR)
+        try:
+            logs = [
+                os.path.join(wal_dir, name) for name in os.listdir(wal_dir)
+            ]
+        except FileNotFoundError:
+            return
+
+        for log in logs:
+            try:
+                f = open(log, "rb")
+            except FileNotFoundError:
+                continue
+
+            with f:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+
+                try:
+                    changes = [
+                        (key, None if op == _WAL_DELETE else value)
+                        for key, _, op, value in _read_snapshot(
+                            f, _WAL_MAGIC, pickle.loads
+                        )
+                    ]
+                except ValueError:
+                    _LOG.warning("Rolling back transaction %s", log)
+                else:
+                    _LOG.warning("Finishing transaction %s", log)
+                    with self._locked():
+                        self._apply(changes)
+                os.unlink(log)
+
+    def _create_many(
+        self,
+        items: typing.Iterable[typing.Tuple[_KT, _VT]],
+        birthtime: float = None,
+        sequence: int = 0,
+    ):
+        """Create many new items in the datastore.
+
+        All items share one birthtime and are ordered by a sequence number,
+        starting at `sequence`.
+
+        :param items: Iterable of key and value tuples.
+        :type items: Iterable
+        :param birthtime: Birthtime of the batch, defaults to now.
+        :type birthtime: Float
+        :param sequence: Sequence number of the first item.
+        :type sequence: Integer
+        """
+        if birthtime is None:
+            birthtime = time.time()
+
+        for offset, (key, value) in enumerate(items):
+            self._create(
+                key=key,
+                data=self._dumps(value),
+                birthtime=birthtime,
+                sequence=sequence + offset,
+            )
+
+    def __iter__(self, index: int = None):
+        """Iterate over the keys and Yield.
+
+        :param index: Index number to start from.
+        :type index: Integer
+        :returns: List || :yield: Object
+        """
+        items = self._entries()
+        if not items:
+            return list()
+        elif index is not None and isinstance(index, int):
+            if not os.path.exists(items[index][-1]):
+                self._vanished(items[index][-1], items[index][1])
+                yield next(self.__iter__(index=index))
+            else:
+                yield items[index][0]
+        else:
+            for item in items:
+                try:
+                    if not os.path.exists(item[-1]):
+                        self._vanished(item[-1], item[1])
+                        continue
+                    yield item[0]
+                except GeneratorExit:
+                    pass
+
+    def __len__(self):
+        """Return a count of all keys in the datastore.
+
+        Exclusive handles count the rows of their ordered index.
+
+        :returns: Integer
+        """
+        if self._exclusive:
+            return len(self._ordered())
+
+        count = 0
+        for _ in self.__iter__():
+            count += 1
+        return count
+
+    def __repr__(self):
+        """Returns repr string."""
+        return str(dict(self.items()))
+
+    @_instrumented("set_seconds")
+    def __setitem__(self, key: _KT, value: _VT):
+        """Set an item in the datastore.
+
+        > objects are serialized. Files use xattrs to store meta-data which
+          is used to enhance operations.
+
+        Items are written to a new file which replaces the existing item,
+        keeping its birthtime, so files linked into a snapshot are never
+        modified.
+
+        :param key: Named object to set.
+        :type key: Object
+        :param value: Object to set.
+        :type value: Object
+        """
+        file_object = os.path.join(self._db_path, self._encoder(key))
+        data = self._dumps(value)
+        with self._locked(file_object):
+            with self._timed("io_seconds"):
+                birthtime, sequence = self._kept_order(file_object)
+                self._create(
+                    key=key, data=data, birthtime=birthtime, sequence=sequence
+                )
+
+    def _kept_order(self, path: str):
+        """Return the birthtime and sequence number of an existing item.
+
+        Items which do not exist, or carry no order, are given a new one.
+
+        :param path: File path
+        :type path: String
+        :returns: Tuple
+        """
+        try:
+            if self._mode == "header":
+                return _read_header(path)[1]
+            elif self._mode == "xattr":
+                if self._metrics is not None:
+                    self._metrics.count("getxattr_calls")
+                birthtime = getxattr(path, "user.birthtime")
+                if len(birthtime) == 16:
+                    return struct.unpack(">dQ", birthtime)
+                return struct.unpack(">d", birthtime)[0], 0
+        except (OSError, ValueError, struct.error):
+            pass
+        return time.time(), 0
+
+    def _sibling(self, purpose: str):
+        """Return a unique, hidden path next to the storage path.
+
+        :param purpose: Name describing the use of the path.
+        :type purpose: String
+        :returns: String
+        """
+        parent, name = os.path.split(self._db_path)
+        return os.path.join(
+            parent,
+            ".{}{}-{}-{}".format(name, _RESERVED_PREFIX, purpose, _get_uuid()),
+        )
+
+    def clear(self, background: bool = False):
+        """Remove all cache.
+
+        Items are unlinked straight from the directory scan, without
+        sorting them or reading their keys.
+
+        When `background` is set, the storage path is replaced by a new,
+        empty directory holding a copy of the store metadata, and the old
+        directory is removed on a background thread. The call returns once
+        the directories have been swapped, in two renames. Lock files, and
+        other files handles keep open, are linked into the new directory,
+        so locks held across the swap keep excluding new holders.
+
+        :param background: Remove the items on a background thread.
+        :type background: Boolean
+        """
+        self._index = None
+        if not os.path.exists(self._db_path):
+            return
+
+        if background:
+            fresh = self._sibling("new")
+            os.mkdir(fresh)
+            for item in os.scandir(self._db_path):
+                if item.name in _LINKED_FILES:
+                    # Linked, so open handles keep sharing them, and the
+                    # locks they hold, instead of using the old files.
+                    os.link(item.path, os.path.join(fresh, item.name))
+                elif (
+                    item.name.startswith(_RESERVED_PREFIX)
+                    and not item.name.startswith(_RESERVED_PREFIX + "-")
+                    and item.is_file()
+                ):
+                    shutil.copy2(item.path, fresh)
+
+            trash = self._sibling("trash")
+            os.rename(self._db_path, trash)
+            os.rename(fresh, self._db_path)
+            _setxattr(path=self._db_path)
+            _remove_tree(trash, background=True)
+            self._log_change(_CHANGE_CLEAR)
+            self._advance()
+            return
+
+        for item in os.scandir(self._db_path):
+            if item.name.startswith(_RESERVED_PREFIX):
+                continue
+            try:
+                os.unlink(item.path)
+            except FileNotFoundError:
+                pass
+        self._log_change(_CHANGE_CLEAR)
+        self._advance()
+
+    def collect_blobs(self, grace: float = 60.0):
+        """Remove the blobs no item refers to, and return how many were.
+
+        Items are scanned to mark the blobs they refer to, then unmarked
+        blobs are removed. Blobs stored, or written again, within `grace`
+        seconds of the scan starting are kept, so references being written
+        while scanning are never left dangling.
+
+        :param grace: Age, in seconds, a blob needs to be removed.
+        :type grace: Float
+        :returns: Integer
+        """
+        expiry = time.time() - grace
+        try:
+            blobs = list(os.scandir(os.path.join(self._db_path, _BLOB_DIR)))
+        except FileNotFoundError:
+            return 0
+
+        marked = set()
+        for item in self._scan_names():
+            try:
+                ref = self._read_ref(item)
+            except (FileNotFoundError, ValueError):
+                continue
+            if ref is not None:
+                marked.add(os.path.basename(self._blob_path(ref)))
+
+        removed = 0
+        for blob in blobs:
+            if blob.name in marked:
+                continue
+            try:
+                if blob.stat().st_mtime >= expiry:
+                    continue
+                os.unlink(blob.path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+        return removed
+
+    def _scan_names(self):
+        """Yield the paths of stored items, in directory order.
+
+        :yields: String
+        """
+        with os.scandir(self._db_path) as items:
+            for item in items:
+                if not item.name.startswith(_RESERVED_PREFIX):
+                    yield item.path
+
+    def _read_ref(self, path: str):
+        """Return the blob reference of an item, or None without one.
+
+        Only the start of the item is read.
+
+        :param path: File path
+        :type path: String
+        :returns: Bytes
+        """
+        with open(path, "rb", buffering=0) as f:
+            if self._mode == "header":
+                data = f.read(_HEADER.size)
+                try:
+                    length = _HEADER.unpack(data)[3]
+                except struct.error:
+                    raise ValueError("Item has no metadata header") from None
+                f.seek(_HEADER.size + length)
+            ref = f.read(_BLOB_REF_SIZE + 1)
+
+        if len(ref) == _BLOB_REF_SIZE and ref.startswith(_BLOB_REF_MAGIC):
+            return ref
+        return None
+
+    def copy(self, path: str = None):
+        """Return a copy of the datastore at `path`, or self without one.
+
+        :param path: Storage path of the copy.
+        :type path: String
+        :returns: Object
+        """
+        if path is None:
+            return self
+        return self.snapshot(path)
+
+    def drop(self, background: bool = False):
+        """Remove the datastore, including its storage path.
+
+        The storage path is renamed aside and then removed, so it is gone
+        once the call returns even when `background` is set. Locks of the
+        store are taken on the lock file of the next store created at the
+        same path from then on.
+
+        :param background: Remove the items on a background thread.
+        :type background: Boolean
+        """
+        self._index = None
+        trash = self._sibling("trash")
+        try:
+            os.rename(self._db_path, trash)
+        except FileNotFoundError:
+            return
+
+        if self._shared_index is not None:
+            self._shared_index.unlink()
+        _remove_tree(trash, background=background)
+
+    def export(self, snapshot: typing.Any):
+        """Export the datastore to a single snapshot file.
+
+        Items are streamed in birthtime order, one at a time, without being
+        deserialized. Every record carries its key, birthtime, and sequence
+        number, so the snapshot keeps item order on filesystems, or through
+        tools, which do not keep xattrs.
+
+        :param snapshot: Snapshot path or writable binary file object.
+        :type snapshot: String || Object
+        :returns: Integer
+        """
+        count = 0
+        with _open_snapshot(snapshot, "wb") as f:
+            f.write(_SNAPSHOT_MAGIC)
+            for key, (birthtime, sequence), path in self._entries():
+                try:
+                    with self._locked(path):
+                        with open(path, "rb") as item:
+                            value = self._payload(item.read())
+                except FileNotFoundError:
+                    continue
+
+                _write_record(f, str(key).encode(), value, birthtime, sequence)
+                count += 1
+
+            f.write(_SNAPSHOT_RECORD.pack(_SNAPSHOT_END, count, 0, 0, 0))
+
+        return count
+
+    def first(self):
+        """Return the oldest item as a key and value tuple.
+
+        :returns: Tuple
+        """
+        for item in self.range(0, 1):
+            return item
+        raise KeyError("first(): dictionary is empty")
+
+    def get(self, key: _KT, default: typing.Any = None):
+        """Return the value of a given key.
+
+        :param key: Named object.
+        :type key: Object
+        :param default: Default return.
+        :type default: Object
+        :returns: Object
+        """
+        try:
+            return self.__getitem__(key)
+        except KeyError:
+            return default
+
+    def fromkeys(self, iterable: typing.Iterable[_T], value: _S = None):
+        """Set a list of items using a default.
+
+        :param iterable: Iterable object to add to the data-store.
+        :type iterable: Iterable
+        """
+        for item in iterable:
+            self.__setitem__(item, value)
+
+    def has(self, key: _KT):
+        """Return True when a key is stored.
+
+        The item is checked with a single stat, which is skipped when the
+        Bloom filter of the store rules the key out.
+
+        :param key: Named object.
+        :type key: Object
+        :returns: Boolean
+        """
+        name = self._encoder(key)
+        if not self._maybe_stored(name):
+            return False
+
+        try:
+            os.stat(os.path.join(self._db_path, name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def items(
+        self,
+        ordered: bool = True,
+        prefetch: int = 0,
+        prefix: str = None,
+        match: typing.Any = None,
+    ):
+        """Iterate through all items and yield a tuples, for key and value.
+
+        Items are yielded in birthtime order. When `ordered` is False, the
+        storage path is streamed in a single pass and items are yielded as
+        they are found, without waiting for the full scan or sorting it.
+        When `prefetch` is set, up to that many values are read ahead on a
+        background thread.
+
+        When `prefix` or `match` is set, only items with string keys
+        starting with the prefix, or matching the glob pattern or compiled
+        regular expression, are yielded, in birthtime order.
+
+        :param ordered: Yield items in birthtime order.
+        :type ordered: Boolean
+        :param prefetch: Number of values to read ahead.
+        :type prefetch: Integer
+        :param prefix: Key prefix.
+        :type prefix: String
+        :param match: Glob pattern string, or compiled regular expression.
+        :type match: String || Object
+        :yields: Tuple
+        """
+        if prefix is not None or match is not None:
+            entries = self._select(prefix=prefix, match=match)
+        elif ordered:
+            entries = self._entries()
+        else:
+            entries = self._scan()
+        if prefetch:
+            yield from self._prefetch(entries, prefetch)
+            return
+
+        for key, _, path in entries:
+            try:
+                yield key, self._read(path)
+            except FileNotFoundError:
+                pass
+
+    def iter_from(self, key: _KT, inclusive: bool = False):
+        """Iterate through items stored after a given key.
+
+        Items are yielded as key and value tuples in birthtime order,
+        allowing iteration to resume from the last key seen.
+
+        :param key: Named object to start from.
+        :type key: Object
+        :param inclusive: Include the given key.
+        :type inclusive: Boolean
+        :yields: Tuple
+        """
+        name = self._encoder(key)
+        try:
+            order = self._item_meta(os.path.join(self._db_path, name))[1]
+        except (OSError, ValueError):
+            raise KeyError(key) from None
+
+        with self._index_lock:
+            index = self._ordered()
+            position, found = index.find(order, name)
+            if not found:
+                raise KeyError(key)
+            if not inclusive:
+                position += 1
+            names = index.slice(position)
+
+        yield from self._read_slice(names)
+
+    def keys(self, prefix: str = None, match: typing.Any = None):
+        """Return an array of all keys.
+
+        When `prefix` or `match` is set, only string keys starting with the
+        prefix, or matching the glob pattern or compiled regular
+        expression, are returned. These lookups use a sorted key index,
+        so no other keys are read.
+
+        :param prefix: Key prefix.
+        :type prefix: String
+        :param match: Glob pattern string, or compiled regular expression.
+        :type match: String || Object
+        :yields: item || :returns: List
+        """
+        if prefix is not None or match is not None:
+            for key, _, _ in self._select(prefix=prefix, match=match):
+                yield key
+            return
+
+        for item in self.__iter__():
+            yield item
+
+    def last(self):
+        """Return the newest item as a key and value tuple.
+
+        :returns: Tuple
+        """
+        for item in self.range(-1, None):
+            return item
+        raise KeyError("last(): dictionary is empty")
+
+    def load(self, snapshot: typing.Any):
+        """Load items from a snapshot file into the datastore.
+
+        The snapshot is read sequentially, one record at a time, and every
+        item is restored with its original birthtime and sequence number.
+        A record failing its checksum raises ValueError; records before it
+        have already been restored.
+
+        :param snapshot: Snapshot path or readable binary file object.
+        :type snapshot: String || Object
+        :returns: Integer
+        """
+        count = 0
+        with _open_snapshot(snapshot, "rb") as f:
+            for key, birthtime, sequence, value in _read_snapshot(f):
+                self._create(
+                    key=key, data=value, birthtime=birthtime, sequence=sequence
+                )
+                count += 1
+
+        return count
+
+    def open_value(self, key: _KT):
+        """Return a read only, binary file object of a stored value.
+
+        Values stored with `put_stream` or `put_file` are read straight
+        from the item file, without loading them into memory. The item
+        file stays open until the file object is closed, so the value read
+        is unaffected by later writes. Other bytes values are returned in a
+        memory buffer.
+
+        :param key: Named object.
+        :type key: Object
+        :returns: Object
+        """
+        path = os.path.join(self._db_path, self._encoder(key))
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            raise KeyError(key) from None
+
+        try:
+            offset = 0
+            if self._mode == "header":
+                offset = (
+                    _HEADER.size
+                    + _HEADER.unpack(os.pread(fd, _HEADER.size, 0))[3]
+                )
+            if os.pread(fd, len(_RAW_MAGIC), offset) == _RAW_MAGIC:
+                return io.BufferedReader(
+                    _ValueFile(fd, offset + len(_RAW_MAGIC)),
+                    buffer_size=_COPY_CHUNK,
+                )
+        except BaseException:
+            os.close(fd)
+            raise
+
+        os.close(fd)
+        value = self[key]
+        if not isinstance(value, (bytes, bytearray)):
+            raise TypeError("Value of {} is not bytes".format(key))
+        return io.BytesIO(value)
+
+    def peek(self, n: int = 1):
+        """Return the `n` oldest items as key and value tuples.
+
+        :param n: Number of items.
+        :type n: Integer
+        :returns: List
+        """
+        return list(self.range(0, n))
+
+    @_instrumented("pop_seconds")
+    def pop(self, key: _KT, default: typing.Any = None):
+        """Remove a given key from the cache.
+
+        :param key: Named object.
+        :type key: Object
+        :param default: Default return.
+        :type default: Object
+        :returns: Object
+        """
+        try:
+            return self._pop_path(
+                os.path.join(self._db_path, self._encoder(key)), key
+            )
+        except KeyError as e:
+            if default:
+                return default
+            else:
+                raise e
+
+    @_instrumented("popitem_seconds")
+    def popitem(self):
+        """Remove and return an item from the datastore.
+
+        :returns: Object
+        """
+        while True:
+            entries = self._entries(limit=1)
+            if not entries:
+                raise KeyError("popitem(): dictionary is empty")
+
+            key, order, path = entries[0]
+            try:
+                return self._pop_path(path, key, order)
+            except KeyError:
+                self._vanished(path, order)
+
+    def put_file(self, key: _KT, path: str):
+        """Store the contents of a file as a raw bytes value.
+
+        :param key: Named object to set.
+        :type key: Object
+        :param path: Path of the file to store.
+        :type path: String
+        :returns: Integer
+        """
+        with open(path, "rb") as f:
+            return self.put_stream(key, f)
+
+    @_instrumented("set_seconds")
+    def put_stream(self, key: _KT, fileobj: typing.BinaryIO):
+        """Store a binary file object, read to its end, as a raw value.
+
+        The value is copied into a new item without being held in memory,
+        by the kernel when the file object is a regular file, and keeps the
+        birthtime of the item it replaces. Reading the value returns bytes,
+        or a file object from `open_value`.
+
+        > The lock is not held while copying, so a concurrent write of the
+          same key may be replaced by the stream.
+
+        :param key: Named object to set.
+        :type key: Object
+        :param fileobj: Readable binary file object.
+        :type fileobj: Object
+        :returns: Integer
+        """
+        size = [0]
+
+        def _write(f):
+            f.write(_RAW_MAGIC)
+            size[0] = _copy_stream(fileobj, f)
+
+        birthtime, sequence = self._kept_order(
+            os.path.join(self._db_path, self._encoder(key))
+        )
+        with self._timed("io_seconds"):
+            self._create(
+                key=key, data=_write, birthtime=birthtime, sequence=sequence
+            )
+        if self._metrics is not None:
+            self._metrics.count("bytes_written", size[0])
+        return size[0]
+
+    def range(self, start: int = None, stop: int = None):
+        """Iterate through a slice of items by birthtime position.
+
+        Positions follow slice semantics, negative positions count from
+        the newest item. Items are yielded as key and value tuples. The
+        slice is taken from an ordered index which is kept between calls,
+        so only the items within the slice are read.
+
+        :param start: First position.
+        :type start: Integer
+        :param stop: Position to stop at.
+        :type stop: Integer
+        :yields: Tuple
+        """
+        with self._index_lock:
+            names = self._ordered().slice(start, stop)
+        yield from self._read_slice(names)
+
+    def setdefault(self, key: _KT, default: typing.Any = None):
+        """Return the value of a given key.
+
+        :param key: Named object.
+        :type key: Object
+        :param default: Default return.
+        :type default: Object
+        :returns: Object
+        """
+        self.__setitem__(key, default)
+        return default
+
+    def snapshot(self, path: str):
+        """Create a point in time copy of the datastore, and return it.
+
+        Items are hardlinked into the new storage path, falling back to
+        reflinks, and then to copies, when the filesystem can not link them.
+        Items are never modified in place, so the copy is unaffected by
+        later writes to either store, and linked items use no extra data
+        blocks. Items are taken one at a time, and an item written while
+        the copy is being made may or may not be part of it.
+
+        > Stores ordering items by ctime, created without xattrs before
+          headers existed, are copied, as linking changes the ctime.
+
+        :param path: New storage path, which must not exist.
+        :type path: String
+        :returns: Object
+        """
+        dest = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(dest)
+        methods = [_clone_file, shutil.copy2]
+        if self._mode == "legacy":
+            items = [i[-1] for i in self._entries()]
+        else:
+            methods.insert(0, os.link)
+            with os.scandir(self._db_path) as scan:
+                items = [
+                    i.path
+                    for i in scan
+                    if not i.name.startswith(_RESERVED_PREFIX)
+                ]
+
+        def _copy(source: str, target_dir: str):
+            target = os.path.join(target_dir, os.path.basename(source))
+            while True:
+                try:
+                    methods[0](source, target)
+                except FileNotFoundError:
+                    return
+                except OSError:
+                    if len(methods) == 1:
+                        raise
+                    methods.pop(0)
+                else:
+                    return
+
+        try:
+            shutil.copy2(os.path.join(self._db_path, _METADATA_FILE), dest)
+        except FileNotFoundError:
+            # Stores on paths they could not write to have no metadata, and
+            # the copy probes its path the same way.
+            pass
+        for item in items:
+            _copy(item, dest)
+
+        # Blobs are taken after the items, so every blob an item refers to
+        # is part of the copy.
+        try:
+            blobs = os.scandir(os.path.join(self._db_path, _BLOB_DIR))
+        except FileNotFoundError:
+            pass
+        else:
+            blob_dir = os.path.join(dest, _BLOB_DIR)
+            os.mkdir(blob_dir)
+            with blobs:
+                for blob in blobs:
+                    if not blob.name.startswith(_RESERVED_PREFIX):
+                        _copy(blob.path, blob_dir)
+
+        # Names are added to the filter before their item is written, so a
+        # filter copied after the items holds every one of them.
+        if self._bloom is not None:
+            shutil.copy2(self._bloom.path, dest)
+        return IODict(path=dest)
+
+    def stats(self):
+        """Return the recorded metrics, empty when metrics are disabled.
+
+        :returns: Dictionary
+        """
+        if self._metrics is None:
+            return dict()
+        return self._metrics.stats()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Buffer sets and deletes, and apply them all at once, or not at all.
+
+        Changes made through the yielded transaction are written to a log,
+        synced once, and then applied with the store locked. When the block
+        raises, nothing is changed. When the process dies while applying
+        them, the changes are finished the next time the store is opened.
+
+        >>> with store.transaction() as tx:
+        ...     tx["b"] = tx.pop("a")
+
+        > Transactions are atomic, not isolated. Items read within the block
+          may be changed by other writers before the commit.
+
+        :yields: Object
+        """
+        tx = _Transaction(self)
+        yield tx
+        self._commit(changes=tx._changes)
+
+    def update(self, mapping: typing.Mapping[_KT, _VT]):
+        """Update the datastore with a new mapping.
+
+        :param mapping: Map object, assumes a call to items.
+        :type mapping: Mapping
+        """
+        for k, v in mapping.items():
+            self.__setitem__(k, v)
+
+    def values(
+        self,
+        ordered: bool = True,
+        prefetch: int = 0,
+        prefix: str = None,
+        match: typing.Any = None,
+    ):
+        """Return an array of all values.
+
+        :param ordered: Yield values in birthtime order.
+        :type ordered: Boolean
+        :param prefetch: Number of values to read ahead.
+        :type prefetch: Integer
+        :param prefix: Key prefix.
+        :type prefix: String
+        :param match: Glob pattern string, or compiled regular expression.
+        :type match: String || Object
+        :yields: item || :returns: List
+        """
+        for _, value in self.items(
+            ordered=ordered, prefetch=prefetch, prefix=prefix, match=match
+        ):
+            yield value
+
+    def watch(
+        self,
+        since: int = None,
+        timeout: float = None,
+        interval: float = 0.1,
+    ):
+        """Yield changes to the datastore, in order, as they are made.
+
+        Changes are read from the change log of the store, created with
+        `IODict(path, changes=True)`, and yielded as tuples of operation,
+        key, and cursor. Operations are `set`, `delete`, and `clear`, which
+        has no key. Watching resumes after a change when its cursor is
+        passed as `since`; without one, only new changes are yielded.
+
+        The log is polled every `interval` seconds, without scanning the
+        store. When `timeout` is set, the generator returns once no change
+        has been made for `timeout` seconds.
+
+        > The change log grows with every change, until it is removed.
+
+        :param since: Cursor to resume after, 0 to start from the beginning.
+        :type since: Integer
+        :param timeout: Return after this many seconds without a change.
+        :type timeout: Float
+        :param interval: Seconds between polls of the change log.
+        :type interval: Float
+        :yields: Tuple
+        """
+        try:
+            f = open(os.path.join(self._db_path, _CHANGES_FILE), "rb")
+        except FileNotFoundError:
+            raise ValueError("Store has no change log") from None
+
+        with f:
+            if since is None:
+                f.seek(0, os.SEEK_END)
+            else:
+                f.seek(since)
+            cursor = f.tell()
+            pending = b""
+            deadline = _deadline(True, timeout)
+            while True:
+                chunk = f.read(65536)
+                if not chunk:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        return
+                    time.sleep(interval)
+                    continue
+
+                pending += chunk
+                offset = 0
+                while len(pending) - offset >= _CHANGE_RECORD.size:
+                    op, length, crc = _CHANGE_RECORD.unpack_from(
+                        pending, offset
+                    )
+                    start = offset + _CHANGE_RECORD.size
+                    end = start + length
+                    if end > len(pending):
+                        break
+
+                    key = pending[start:end]
+                    if zlib.crc32(key) != crc or op >= len(_CHANGE_OPS):
+                        raise ValueError(
+                            "Change log is corrupt at {}".format(cursor)
+                        )
+                    cursor += end - offset
+                    offset = end
+                    if op == _CHANGE_CLEAR:
+                        yield _CHANGE_OPS[op], None, cursor
+                    else:
+                        yield _CHANGE_OPS[op], key.decode(), cursor
+
+                pending = pending[offset:]
+                deadline = _deadline(True, timeout)
+
+
+class DurableQueue:
+    """DurableQueue class, used to ensure queued items are disk backed.
+
+    This implements the standard Queue API, allowing the user to replace
+    queue.Queue or mulriprocessing.Queue with a DurableQueue.
+
+    DurableQueue is IODict backed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        lock: typing.Any = None,
+        semaphore: typing.Any = None,
+        metrics: typing.Any = None,
+        slow_log: typing.Any = None,
+        metadata: str = None,
+        dedup: bool = False,
+        shared_index: bool = False,
+        exclusive: bool = False,
+    ):
+        """Initiallize the DurableQueue class.
+
+        Durable queues use a semephore to keep track of the puts vs gets. When
+        a Durable queue is loaded, the semaphore starts at zero and a
+        background thread recovers the `_count` from the items already on
+        disk. Recovery only scans the storage path, no xattrs are read and
+        nothing is sorted, and the semaphore is released as items are found,
+        so construction returns immediately and consumers can begin draining
+        the head of the queue while recovery continues.
+
+        :param path: Storage path
+        :type path: String
+        :param lock: Lock type object
+        :type lock: Object
+        :param semaphore: Semaphore type object
+        :type semaphore: Object
+        :param metrics: Metrics object, or True to create one.
+        :type metrics: Object
+        :param slow_log: SlowLog object.
+        :type slow_log: Object
+        :param metadata: Item metadata mode, `xattr` or `header`.
+        :type metadata: String
+        :param dedup: Store identical items once.
+        :type dedup: Boolean
+        :param shared_index: Share the ordered index with other processes.
+        :type shared_index: Boolean
+        :param exclusive: Take the queue to be the only writer of its store.
+        :type exclusive: Boolean
+        """
+
+        if not semaphore:
+            semaphore = multiprocessing.Semaphore
+
+        self._queue = IODict(
+            path=path,
+            lock=lock,
+            metrics=metrics,
+            slow_log=slow_log,
+            metadata=metadata,
+            dedup=dedup,
+            shared_index=shared_index,
+            exclusive=exclusive,
+        )
+        self._start(semaphore)
+
+    def __getstate__(self):
+        """Return the picklable state of the queue.
+
+        Queues are pickled as a handle of their store. The item count is
+        recovered by the process the queue is unpickled in.
+
+        :returns: Dictionary
+        """
+        return {"queue": self._queue}
+
+    def __setstate__(self, state: dict):
+        """Reattach to a queue, and recover its item count.
+
+        :param state: Pickled state.
+        :type state: Dictionary
+        """
+        self._queue = state["queue"]
+        self._start(multiprocessing.Semaphore)
+
+    def _start(self, semaphore: typing.Any):
+        """Start recovering the item count in the background.
+
+        :param semaphore: Semaphore type object
+        :type semaphore: Object
+        """
+        self._count = semaphore(0)
+        self._recovered = threading.Event()
+        self._recovery_lock = threading.Lock()
+        self._recovery_puts = set()
+        self._recovery_gets = set()
+        self._recovery = threading.Thread(target=self._recover, daemon=True)
+        self._recovery.start()
+
+    def _recover(self):
+        """Recover the item count from the storage path.
+
+        The storage path is scanned once, and the semaphore is released for
+        every item found. Items put by this queue while the scan is running
+        are already accounted for and are skipped. Items removed by this
+        queue before the scan reached them are released once the scan has
+        finished, so the count matches the items left on disk.
+        """
+
+        scanned = set()
+        try:
+            for item in os.scandir(self._queue._db_path):
+                if item.name.startswith(_RESERVED_PREFIX):
+                    continue
+                scanned.add(item.name)
+                with self._recovery_lock:
+                    if item.name in self._recovery_puts:
+                        continue
+
+                self._count.release()
+        except OSError:
+            pass
+        finally:
+            with self._recovery_lock:
+                missed = self._recovery_gets - scanned - self._recovery_puts
+                self._recovery_puts = self._recovery_gets = None
+
+            for _ in missed:
+                self._count.release()
+
+            self._recovered.set()
+
+    def _track(self, name: str, tracked: str, discard: bool = False):
+        """Track a stored item name while count recovery is running.
+
+        :param name: Stored item name.
+        :type name: String
+        :param tracked: Name of the tracking set, `puts` or `gets`.
+        :type tracked: String
+        :param discard: Remove the name instead of adding it.
+        :type discard: Boolean
+        """
+
+        with self._recovery_lock:
+            names = getattr(self, "_recovery_{}".format(tracked))
+            if names is None:
+                return
+            elif discard:
+                names.discard(name)
+            else:
+                names.add(name)
+
+    def close(self, background: bool = False):
+        """Close the current Queue and cleanup artifacts.
+
+        :param background: Remove the items on a background thread.
+        :type background: Boolean
+        """
+
+        self._queue.drop(background=background)
+
+    def empty(self):
+        """Return True if the queue is empty, False otherwise.
+
+        :returns: Boolean
+        """
+
+        return self.qsize() == 0
+
+    def export(self, snapshot: typing.Any):
+        """Export the queue to a single snapshot file.
+
+        :param snapshot: Snapshot path or writable binary file object.
+        :type snapshot: String || Object
+        :returns: Integer
+        """
+
+        return self._queue.export(snapshot)
+
+    def load(self, snapshot: typing.Any):
+        """Load items from a snapshot file into the queue.
+
+        :param snapshot: Snapshot path or readable binary file object.
+        :type snapshot: String || Object
+        :returns: Integer
+        """
+
+        self.wait_recovery()
+        count = 0
+        with _open_snapshot(snapshot, "rb") as f:
+            for key, birthtime, sequence, value in _read_snapshot(f):
+                self._queue._create(
+                    key=key, data=value, birthtime=birthtime, sequence=sequence
+                )
+                self._count.release()
+                count += 1
+
+        return count
+
+    def get(self, block: bool = True, timeout: float = None):
+        """Retrieve the first item from the queue.
+
+        :param block: Force the queue to block attempting to fetch an object.
+        :type block: Boolean
+        :param timeout: Set the block timeout
+        :type timeout: Float
+        :returns: Object
+        """
+
+        if timeout is not None and timeout < 0:
+            raise ValueError("timeout must be non-negative")
+
+        if not self._count.acquire(block, timeout):
+            raise queue.Empty
+
+        if self._recovered.is_set():
+            return self._queue.popitem()
+
+        try:
+            key = next(self._queue.__iter__(index=0))
+        except (IndexError, StopIteration):
+            raise KeyError("popitem(): dictionary is empty") from None
+
+        name = self._queue._encoder(key)
+        self._track(name, "gets")
+        try:
+            return self._queue.pop(key)
+        except KeyError:
+            self._track(name, "gets", discard=True)
+            raise
+
+    def get_many(
+        self, max_items: int, block: bool = True, timeout: float = None
+    ):
+        """Retrieve up to `max_items` from the head of the queue.
+
+        The queue is scanned once for the whole batch, instead of once per
+        item, and only the batch is held in memory while scanning.
+
+        :param max_items: Maximum number of items to return.
+        :type max_items: Integer
+        :param block: Force the queue to block attempting to fetch an object.
+        :type block: Boolean
+        :param timeout: Set the block timeout
+        :type timeout: Float
+        :returns: List
+        """
+
+        if max_items < 1:
+            raise ValueError("max_items must be a positive integer")
+
+        if timeout is not None and timeout < 0:
+            raise ValueError("timeout must be non-negative")
+
+        if not self._count.acquire(block, timeout):
+            raise queue.Empty
+
+        acquired = 1
+        while acquired < max_items and self._count.acquire(False):
+            acquired += 1
+
+        items = list()
+        for key, order, path in self._queue._entries(limit=acquired):
+            name = os.path.basename(path)
+            self._track(name, "gets")
+            try:
+                item = self._queue._pop_path(path, key, order)
+            except KeyError:
+                self._track(name, "gets", discard=True)
+                continue
+
+            items.append(item)
+
+        return items
+
+    def get_nowait(self):
+        """Retrieve the first item from the queue without blocking.
+
+        :returns: Object
+        """
+
+        return self.get(block=False)
+
+    def peek(self, n: int = 1):
+        """Return up to `n` items from the head of the queue, in order.
+
+        Items are left within the queue.
+
+        :param n: Number of items.
+        :type n: Integer
+        :returns: List
+        """
+
+        return [item for _, item in self._queue.peek(n)]
+
+    def put(self, item: typing.Any, block: bool = True, timeout: float = None):
+        """Put a new item within the queue.
+
+        > The block and timeout options are present for API compatibility,
+          but are otherwise unused.
+
+        :param item: Object to be entered into the queue.
+        :type item: Object
+        :param block: Force the queue to block attempting to fetch an object.
+        :type block: Boolean
+        :param timeout: Set the block timeout
+        :type timeout: Float
+        """
+
+        key = _get_uuid()
+        self._track(self._queue._encoder(key), "puts")
+        self._queue[key] = item
+        self._count.release()
+
+    def put_many(
+        self,
+        items: typing.Iterable[typing.Any],
+        birthtime: float = None,
+        sequence: int = 0,
+    ):
+        """Put many new items within the queue using a single write batch.
+
+        Items in a batch share a birthtime and keep their relative order
+        through a sequence number, allowing several batches to be written
+        in parallel as slices of one larger, ordered batch.
+
+        :param items: Objects to be entered into the queue.
+        :type items: Iterable
+        :param birthtime: Birthtime of the batch, defaults to now.
+        :type birthtime: Float
+        :param sequence: Sequence number of the first item.
+        :type sequence: Integer
+        """
+
+        batch = [(_get_uuid(), item) for item in items]
+        for key, _ in batch:
+            self._track(self._queue._encoder(key), "puts")
+
+        self._queue._create_many(batch, birthtime=birthtime, sequence=sequence)
+        for _ in batch:
+            self._count.release()
+
+    def put_nowait(self, item: typing.Any):
+        """Put a new item within the queue without blocking.
+
+        :param item: Object to be entered into the queue.
+        :type item: Object
+        """
+
+        self.put(item)
+
+    def stats(self):
+        """Return the recorded metrics, empty when metrics are disabled.
+
+        :returns: Dictionary
+        """
+        return self._queue.stats()
+
+    def wait_recovery(self, timeout: float = None):
+        """Block until the startup count recovery has finished.
+
+        :param timeout: Set the block timeout
+        :type timeout: Float
+        :returns: Boolean
+        """
+
+        return self._recovered.wait(timeout)
+
+    def qsize(self):
+        """Return the approximate size of the queue.
+
+        :returns: Integer
+        """
+
+        return len(self._queue)
+
 
-    def __exit__(
-        self, exc_type: typing.Any, exc_value: typing.Any, tb: typing.Any
-    ):
-        """Clean up the dictionary and exit the context manager.
+class SpillQueue:
+    """Queue held in memory, spilling to segment files past a threshold.
 
-        :returns: Boolean
-        """
-        try:
-            self.clear()
-        finally:
-            return super().__exit__(exc_type, exc_value, tb)
+    The head of the queue is held in a deque, like queue.Queue, while it
+    stays within `maxitems` and `maxbytes`. Items put beyond that are
+    spilled, and so is every later put, until the spilled items are
+    drained, so items leave the queue in the order they were put.
 
-    def __getitem__(self, key: _KT):
-        """Return the value of a given key.
+    Spilled items are written to segment files within the storage path, in
+    the snapshot record format, `batch_size` items per segment. Until a
+    segment is full, its items are held in memory. Once memory is empty,
+    the oldest segment is read back to memory, one segment at a time, and
+    removed. Segments are written and read without the queue locked.
 
-        If a given key is not found, get will raise a KeyError exception.
+    Items held in memory are lost when the process stops, unless they are
+    checkpointed. Items written to segments survive restarts.
+    """
 
-        :param key: Named object.
-        :type key: Object
-        :returns: Object
-        """
-        file_object = os.path.join(self._db_path, self._encoder(key))
-        with self._lock:
-            try:
-                with open(file_object, "rb") as f:
-                    return pickle.load(f)
-            except FileNotFoundError:
-                raise KeyError(key) from None
+    def __init__(
+        self,
+        path: str,
+        maxitems: int = 1024,
+        maxbytes: int = 0,
+        batch_size: int = 64,
+        checkpoint: float = None,
+    ):
+        """Initialize the SpillQueue class.
 
-    def __iter__(self, index: int = None):
-        """Iterate over the keys and Yield.
+        Segments found on disk are queued after the items of the last
+        checkpoint, which are restored to memory. Items taken from the
+        queue after the last checkpoint are restored again, so a
+        checkpoint bounds the loss of items to its interval, at the cost of
+        delivering some items twice. The number of spilled items is read
+        from the end record of every segment.
 
-        :param index: Index number to start from.
-        :type index: Integer
-        :returns: List || :yield: Object
+        :param path: Storage path
+        :type path: String
+        :param maxitems: Maximum number of items held in memory.
+        :type maxitems: Integer
+        :param maxbytes: Maximum pickled size of the items held in memory,
+                         unlimited when 0. Measuring items pickles them on
+                         put.
+        :type maxbytes: Integer
+        :param batch_size: Number of items per segment, at most
+                           `maxitems`.
+        :type batch_size: Integer
+        :param checkpoint: Interval between checkpoints of the items held
+                           in memory, in seconds, disabled when None.
+        :type checkpoint: Float
         """
-        items = list()
-        if not os.path.exists(self._db_path):
-            return items
 
-        for item in os.scandir(self._db_path):
-            try:
-                items.append(
-                    (
-                        _get_item_key(item.path),
-                        _get_create_time(item.path),
-                        item.path,
-                    )
-                )
-            except FileNotFoundError:
-                pass
+        if maxitems < 1:
+            raise ValueError("maxitems must be a positive integer")
+        elif batch_size < 1:
+            raise ValueError("batch_size must be a positive integer")
 
-        items = sorted(items, key=operator.itemgetter(1))
-        if not items:
-            return list()
-        elif index is not None and isinstance(index, int):
-            if not os.path.exists(items[index][-1]):
-                yield next(self.__iter__(index=index))
-            else:
-                yield items[index][0]
-        else:
-            for item in items:
-                try:
-                    if not os.path.exists(item[-1]):
-                        continue
-                    yield item[0]
-                except GeneratorExit:
-                    pass
+        self.maxitems = maxitems
+        self.maxbytes = maxbytes
+        self.batch_size = min(batch_size, maxitems)
+        self._path = os.path.abspath(os.path.expanduser(path))
+        _makedirs(path=self._path)
+        self._checkpoint_file = os.path.join(self._path, _CHECKPOINT_FILE)
+        self._memory = collections.deque()
+        self._bytes = 0
+        self._tail = list()
+        self._segments = collections.deque()
+        self._writing = set()
+        self._draining = False
+        self._spilled = 0
+        self._not_empty = threading.Condition()
+        self._recover()
+        self._restore(keep=bool(checkpoint))
 
-    def __len__(self):
-        """Return a count of all keys in the datastore.
+        self._stop = threading.Event()
+        if checkpoint:
+            threading.Thread(
+                target=self._checkpoints, args=(checkpoint,), daemon=True
+            ).start()
 
-        :returns: Integer
-        """
-        count = 0
-        for _ in self.__iter__():
-            count += 1
-        return count
+    @staticmethod
+    def _read(path: str, magic: bytes):
+        """Return the items of a segment or checkpoint file.
 
-    def __repr__(self):
-        """Returns repr string."""
-        return str(dict(self.items()))
+        :param path: File path
+        :type path: String
+        :param magic: Magic string the file starts with.
+        :type magic: Bytes
+        :returns: List
+        """
+        with open(path, "rb") as f:
+            return [
+                pickle.loads(value)
+                for _, _, _, value in _read_snapshot(f, magic)
+            ]
 
-    def __setitem__(self, key: _KT, value: _VT):
-        """Set an item in the datastore.
+    @staticmethod
+    def _write(path: str, magic: bytes, items: typing.List[typing.Any]):
+        """Write items to a segment or checkpoint file.
 
-        > objects are serialized. Files use xattrs to store meta-data which
-          is used to enhance operations.
+        The file is written aside and renamed into place, so a write
+        interrupted by a crash leaves the previous file, if any.
 
-        :param key: Named object to set.
-        :type key: Object
-        :param value: Object to set.
-        :type value: Object
+        :param path: File path
+        :type path: String
+        :param magic: Magic string the file starts with.
+        :type magic: Bytes
+        :param items: Objects to write.
+        :type items: List
         """
-        file_object = os.path.join(self._db_path, self._encoder(key))
-        with self._lock:
-            with open(file_object, "wb") as f:
-                pickle.dump(value, f)
+        tmp_file = os.path.join(
+            os.path.dirname(path),
+            "{}-{}".format(_RESERVED_PREFIX, _get_uuid()),
+        )
+        try:
+            with open(tmp_file, "wb") as f:
+                f.write(magic)
+                for sequence, item in enumerate(items):
+                    _write_record(f, b"", pickle.dumps(item), 0, sequence)
+                f.write(
+                    _SNAPSHOT_RECORD.pack(_SNAPSHOT_END, len(items), 0, 0, 0)
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_file, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_file)
+            except OSError:
+                pass
+            raise
 
-            _setxattr(path=file_object, key=key)
+    def _segment_path(self, number: int):
+        """Return the path of a segment.
 
-    def clear(self):
-        """Remove all cache."""
-        for item in self.__iter__():
-            self.__delitem__(item)
+        :param number: Segment number.
+        :type number: Integer
+        :returns: String
+        """
+        return os.path.join(
+            self._path, "{}{:020d}".format(_SEGMENT_PREFIX, number)
+        )
 
-    def copy(self):
-        """Return self.
+    def _recover(self):
+        """Queue the segments found within the storage path, in order.
 
-        :returns: Object
+        Only the end record of every segment is read, for its number of
+        items. Segments without one are ignored, and left in place.
         """
-        return self
+        numbers = list()
+        start = len(_SEGMENT_PREFIX)
+        for name in os.listdir(self._path):
+            if name.startswith(_SEGMENT_PREFIX) and name[start:].isdigit():
+                numbers.append(int(name[start:]))
+        numbers.sort()
+        self._next_segment = numbers[-1] + 1 if numbers else 0
 
-    def get(self, key: _KT, default: typing.Any = None):
-        """Return the value of a given key.
+        for number in numbers:
+            path = self._segment_path(number)
+            try:
+                with open(path, "rb") as f:
+                    f.seek(-_SNAPSHOT_RECORD.size, os.SEEK_END)
+                    end, count = _SNAPSHOT_RECORD.unpack(
+                        f.read(_SNAPSHOT_RECORD.size)
+                    )[:2]
+            except OSError:
+                end = None
+            if end != _SNAPSHOT_END:
+                _LOG.warning("Ignoring corrupt segment %s", path)
+                continue
+            self._segments.append((number, count))
+            self._spilled += count
 
-        :param key: Named object.
-        :type key: Object
-        :param default: Default return.
-        :type default: Object
-        :returns: Object
+    def _sizeof(self, item: typing.Any):
+        """Return the size counted against `maxbytes` for an item.
+
+        :param item: Object.
+        :type item: Object
+        :returns: Integer
         """
-        try:
-            return self.__getitem__(key)
-        except KeyError:
-            return default
+        if not self.maxbytes:
+            return 0
+        return len(pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL))
 
-    def fromkeys(self, iterable: typing.Iterable[_T], value: _S = None):
-        """Set a list of items using a default.
+    def _hold(self, item: typing.Any, size: int):
+        """Hold an item in memory, with the queue locked.
 
-        :param iterable: Iterable object to add to the data-store.
-        :type iterable: Iterable
+        :param item: Object.
+        :type item: Object
+        :param size: Size of the item.
+        :type size: Integer
         """
-        for item in iterable:
-            self.__setitem__(item, value)
+        self._memory.append((item, size))
+        self._bytes += size
 
-    def items(self):
-        """Iterate through all items and yield a tuples, for key and value.
+    def _fits(self, size: int):
+        """Return True when an item can be held in memory.
 
-        :yields: Tuple
+        Once items are spilled, every put is spilled until they are
+        drained, keeping items in order.
+
+        :param size: Size of the item.
+        :type size: Integer
+        :returns: Boolean
         """
-        for item in self.keys():
-            yield item, self.__getitem__(item)
+        return (
+            not self._spilled
+            and len(self._memory) < self.maxitems
+            and (not self.maxbytes or self._bytes + size <= self.maxbytes)
+        )
 
-    def keys(self):
-        """Return an array of all keys.
+    def _reserve(self, items: typing.List[typing.Any]):
+        """Queue segments for spilled items, with the queue locked.
 
-        :yields: item || :returns: List
+        Segments are queued before they are written, so they keep the order
+        of the puts spilling them, and are drained once written.
+
+        :param items: Objects to spill.
+        :type items: List
+        :returns: List
         """
-        for item in self.__iter__():
-            yield item
+        segments = list()
+        for start in range(0, len(items), self.batch_size):
+            stop = start + self.batch_size
+            number = self._next_segment
+            self._next_segment += 1
+            self._segments.append((number, len(items[start:stop])))
+            self._writing.add(number)
+            segments.append((number, items[start:stop]))
+        return segments
 
-    def pop(self, key: _KT, default: typing.Any = None):
-        """Remove a given key from the cache.
+    def _spill(self, segments: typing.List[typing.Tuple[int, list]]):
+        """Write queued segments, without the queue locked.
 
-        :param key: Named object.
-        :type key: Object
-        :param default: Default return.
-        :type default: Object
-        :returns: Object
+        A segment which can not be written is dropped from the queue, along
+        with its items, and the error is raised.
+
+        :param segments: Tuples of segment number and items.
+        :type segments: List
         """
-        try:
+        for number, items in segments:
             try:
-                return self.__getitem__(key)
+                self._write(self._segment_path(number), _SEGMENT_MAGIC, items)
+            except BaseException:
+                with self._not_empty:
+                    self._segments.remove((number, len(items)))
+                    self._spilled -= len(items)
+                raise
             finally:
-                self.__delitem__(key)
-        except KeyError as e:
-            if default:
-                return default
-            else:
-                raise e
+                with self._not_empty:
+                    self._writing.discard(number)
+                    self._not_empty.notify_all()
 
-    def popitem(self):
-        """Remove and return an item from the datastore.
+    def _claim(self):
+        """Claim the oldest spilled items, with the queue locked.
 
-        :returns: Object
+        Spilled items not written to a segment are moved to memory at once,
+        once every segment is drained. Otherwise the oldest segment is
+        returned to be drained, once it is written and no other segment is
+        being drained.
+
+        :returns: Tuple
         """
-        try:
-            return self.pop(next(self.__iter__(index=0)))
-        except (IndexError, StopIteration):
-            raise KeyError("popitem(): dictionary is empty") from None
+        if self._draining:
+            return None
+        elif not self._segments:
+            tail, self._tail = self._tail, list()
+            self._spilled -= len(tail)
+            for item in tail:
+                self._hold(item, self._sizeof(item))
+            return None
+        elif self._segments[0][0] in self._writing:
+            return None
 
-    def setdefault(self, key: _KT, default: typing.Any = None):
-        """Return the value of a given key.
+        self._draining = True
+        return self._segments.popleft()
 
-        :param key: Named object.
-        :type key: Object
-        :param default: Default return.
-        :type default: Object
-        :returns: Object
-        """
-        self.__setitem__(key, default)
-        return default
+    def _drain(self, number: int, count: int):
+        """Move the items of a claimed segment to memory.
 
-    def update(self, mapping: typing.Mapping[_KT, _VT]):
-        """Update the datastore with a new mapping.
+        The segment is read without the queue locked, and removed once its
+        items are held. Unreadable segments are dropped, and left in place.
 
-        :param mapping: Map object, assumes a call to items.
-        :type mapping: Mapping
+        :param number: Segment number.
+        :type number: Integer
+        :param count: Number of items of the segment.
+        :type count: Integer
         """
-        for k, v in mapping.items():
-            self.__setitem__(k, v)
+        path = self._segment_path(number)
+        try:
+            items = self._read(path, _SEGMENT_MAGIC)
+        except (OSError, ValueError) as e:
+            _LOG.warning("Dropping unreadable segment %s: %s", path, e)
+            items = None
+        except BaseException:
+            with self._not_empty:
+                self._segments.appendleft((number, count))
+                self._draining = False
+                self._not_empty.notify_all()
+            raise
 
-    def values(self):
-        """Return an array of all values.
+        with self._not_empty:
+            for item in items or ():
+                self._hold(item, self._sizeof(item))
+            self._spilled -= count
+            self._draining = False
+            self._not_empty.notify_all()
 
-        :yields: item || :returns: List
-        """
-        for item in self.__iter__():
-            yield self.__getitem__(item)
+        if items is not None:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
 
+    def _restore(self, keep: bool):
+        """Restore the items of the last checkpoint to memory.
 
-class DurableQueue:
-    """DurableQueue class, used to ensure queued items are disk backed.
+        :param keep: Keep the checkpoint file, which is otherwise removed
+                     once restored, as it would be restored again.
+        :type keep: Boolean
+        """
+        try:
+            items = self._read(self._checkpoint_file, _CHECKPOINT_MAGIC)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            _LOG.warning(
+                "Ignoring corrupt checkpoint %s", self._checkpoint_file
+            )
+            return
 
-    This implements the standard Queue API, allowing the user to replace
-    queue.Queue or mulriprocessing.Queue with a DurableQueue.
+        for item in items:
+            self._hold(item, self._sizeof(item))
+        if not keep:
+            os.unlink(self._checkpoint_file)
 
-    DurableQueue is IODict backed.
-    """
+    def _checkpoints(self, interval: float):
+        """Checkpoint the items held in memory until the queue is closed.
 
-    def __init__(
-        self, path: str, lock: typing.Any = None, semaphore: typing.Any = None
-    ):
-        """Initiallize the DurableQueue class.
+        :param interval: Interval between checkpoints, in seconds.
+        :type interval: Float
+        """
+        while not self._stop.wait(interval):
+            try:
+                self.checkpoint()
+            except OSError as e:
+                _LOG.warning(
+                    "Checkpoint %s failed: %s", self._checkpoint_file, e
+                )
 
-        Durable queues use a semephore to keep track of the puts vs gets. When
-        a Durable queue is loaded, it will scan the queue for items, and set
-        the initial `_count` accordingly.
+    def checkpoint(self):
+        """Write the items held in memory to the checkpoint file.
 
-        :param path: Storage path
-        :type path: String
-        :param lock: Lock type object
-        :type lock: Object
-        :param semaphore: Semaphore type object
-        :type semaphore: Object
+        Spilled items held in memory, until their segment is full, are
+        written to a segment first, as they are queued after the segments
+        already written. The checkpoint file is written aside and renamed
+        into place, so a checkpoint interrupted by a crash leaves the
+        previous one.
+
+        :returns: Integer
         """
 
-        if not semaphore:
-            semaphore = multiprocessing.Semaphore
+        with self._not_empty:
+            items = [item for item, _ in self._memory]
+            segments = self._reserve(self._tail)
+            self._tail = list()
 
-        self._queue = IODict(path=path, lock=lock)
+        self._spill(segments)
+        self._write(self._checkpoint_file, _CHECKPOINT_MAGIC, items)
+        return len(items)
 
-        self._count = semaphore(self.qsize())
+    def close(self, background: bool = False):
+        """Stop checkpoints, and remove the queue and its items.
 
-    def close(self):
-        """Close the current Queue and cleanup artifacts."""
+        :param background: Remove the items on a background thread.
+        :type background: Boolean
+        """
 
-        self._queue.clear()
-        try:
-            os.rmdir(self._queue._db_path)
-        except FileNotFoundError:
-            pass
+        self._stop.set()
+        with self._not_empty:
+            self._memory.clear()
+            self._tail = list()
+            self._segments.clear()
+            self._bytes = self._spilled = 0
+        _remove_tree(self._path, background=background)
 
     def empty(self):
         """Return True if the queue is empty, False otherwise.
@@ -470,6 +5499,24 @@ class DurableQueue:
 
         return self.qsize() == 0
 
+    def _wait(self, block: bool, deadline: float = None):
+        """Wait for an item to be put, with the queue locked.
+
+        :param block: Wait for an item, instead of raising queue.Empty.
+        :type block: Boolean
+        :param deadline: Monotonic time to stop waiting at.
+        :type deadline: Float
+        """
+        if not block:
+            raise queue.Empty
+
+        remaining = None
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise queue.Empty
+        self._not_empty.wait(remaining)
+
     def get(self, block: bool = True, timeout: float = None):
         """Retrieve the first item from the queue.
 
@@ -483,10 +5530,21 @@ class DurableQueue:
         if timeout is not None and timeout < 0:
             raise ValueError("timeout must be non-negative")
 
-        if not self._count.acquire(block, timeout):
-            raise queue.Empty
+        deadline = _deadline(block, timeout)
+        while True:
+            with self._not_empty:
+                segment = None
+                while not self._memory and segment is None:
+                    segment = self._claim()
+                    if segment is None and not self._memory:
+                        self._wait(block, deadline)
 
-        return self._queue.popitem()
+                if segment is None:
+                    item, size = self._memory.popleft()
+                    self._bytes -= size
+                    return item
+
+            self._drain(*segment)
 
     def get_nowait(self):
         """Retrieve the first item from the queue without blocking.
@@ -510,8 +5568,46 @@ class DurableQueue:
         :type timeout: Float
         """
 
-        self._queue[_get_uuid()] = item
-        self._count.release()
+        size = self._sizeof(item)
+        segments = ()
+        with self._not_empty:
+            if self._fits(size):
+                self._hold(item, size)
+            else:
+                self._tail.append(item)
+                self._spilled += 1
+                if len(self._tail) >= self.batch_size:
+                    segments = self._reserve(self._tail)
+                    self._tail = list()
+            self._not_empty.notify()
+        self._spill(segments)
+
+    def put_many(self, items: typing.Iterable[typing.Any]):
+        """Put many new items within the queue.
+
+        Items which do not fit in memory are written to segments before
+        returning, along with the spilled items held in memory.
+
+        :param items: Objects to be entered into the queue.
+        :type items: Iterable
+        """
+
+        items = list(items)
+        with self._not_empty:
+            held = 0
+            for item in items:
+                size = self._sizeof(item)
+                if not self._fits(size):
+                    break
+                self._hold(item, size)
+                held += 1
+
+            self._tail.extend(items[held:])
+            self._spilled += len(items) - held
+            segments = self._reserve(self._tail)
+            self._tail = list()
+            self._not_empty.notify(len(items))
+        self._spill(segments)
 
     def put_nowait(self, item: typing.Any):
         """Put a new item within the queue without blocking.
@@ -528,7 +5624,7 @@ class DurableQueue:
         :returns: Integer
         """
 
-        return len(self._queue)
+        return len(self._memory) + self._spilled
 
 
 class FlushQueue:
@@ -552,35 +5648,135 @@ class FlushQueue:
         self.lock = lock
         self.semaphore = semaphore
 
-    def flush(self):
-        """Flush all remaining items in queue to disk."""
+    def flush(
+        self,
+        batch_size: int = 1024,
+        progress: typing.Any = None,
+        workers: int = 1,
+    ):
+        """Flush all remaining items in queue to disk.
+
+        Items are drained from the queue in batches of `batch_size`, and the
+        batches are written by a pool of `workers` threads. Every item of a
+        flush shares one birthtime and carries its position in the queue as
+        a sequence number, so the original order is kept no matter which
+        worker writes an item, or when.
+
+        :param batch_size: Number of items written per batch.
+        :type batch_size: Integer
+        :param progress: Callable, receives the running count after each
+                         batch.
+        :type progress: Object
+        :param workers: Number of writer threads.
+        :type workers: Integer
+        :returns: Integer
+        """
 
         durable = DurableQueue(
             path=self.path, lock=self.lock, semaphore=self.semaphore
         )
-        while True:
-            try:
-                item = self.get_nowait()
-            except Exception:
-                break
-            else:
-                durable.put(item)
+        birthtime = time.time()
+        progress_lock = threading.Lock()
+        written = [0]
+
+        def _write(batch, sequence):
+            durable.put_many(batch, birthtime=birthtime, sequence=sequence)
+            with progress_lock:
+                written[0] += len(batch)
+                if progress:
+                    progress(written[0])
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers
+        ) as executor:
+            futures = list()
+            count = 0
+            while True:
+                batch = list()
+                while len(batch) < batch_size:
+                    try:
+                        batch.append(self.get_nowait())
+                    except Exception:
+                        break
+
+                if not batch:
+                    break
+
+                futures.append(executor.submit(_write, batch, count))
+                count += len(batch)
+
+            for future in futures:
+                future.result()
+
+        return count
+
+    def ingest(
+        self,
+        batch_size: int = 1024,
+        block: bool = False,
+        timeout: float = None,
+        progress: typing.Any = None,
+    ):
+        """Check for existing items in queue and restore them.
+
+        Items are read back in batches of `batch_size` using
+        `DurableQueue.get_many`, so at most one batch of values is held in
+        memory. When this queue has a `maxsize`, batches are sized to the
+        free space left in the queue. Once the queue is full, ingest returns
+        and the remaining items stay on disk for a later ingest, unless
+        `block` is set, in which case ingest waits for space until the
+        `timeout` expires.
 
-    def ingest(self):
-        """Check for existing items in queue and restore them."""
+        :param batch_size: Number of items read per batch.
+        :type batch_size: Integer
+        :param block: Wait for space when this queue is full.
+        :type block: Boolean
+        :param timeout: Set the block timeout
+        :type timeout: Float
+        :param progress: Callable, receives the running count after each
+                         batch.
+        :type progress: Object
+        :returns: Integer
+        """
 
         if not os.path.exists(self.path):
-            return
+            return 0
 
         durable = DurableQueue(
             path=self.path, lock=self.lock, semaphore=self.semaphore
         )
+        durable.wait_recovery()
+        maxsize = getattr(self, "maxsize", 0)
+        if timeout is not None:
+            timeout = time.time() + timeout
+
+        count = 0
         while True:
+            size = batch_size
+            if maxsize > 0:
+                size = min(size, maxsize - self.qsize())
+                if size < 1:
+                    if not block or (
+                        timeout is not None and time.time() >= timeout
+                    ):
+                        return count
+                    time.sleep(0.01)
+                    continue
+
             try:
-                item = durable.get_nowait()
-            except Exception:
+                items = durable.get_many(size, block=False)
+            except queue.Empty:
                 break
-            else:
+
+            if not items:
+                break
+
+            for item in items:
                 self.put(item)
 
+            count += len(items)
+            if progress:
+                progress(count)
+
         durable.close()
+        return count
@@ -0,0 +1,434 @@
+#   Copyright Peznauts <kevin@peznauts.com>. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+"""Benchmarks for the IODict and DurableQueue hot paths.
+
+Run with ``python -m iodict.bench``. Results are written as JSON, one
+record per measurement, so runs can be compared across versions.
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import shutil
+import sys
+import tempfile
+import time
+import typing
+
+import iodict
+from iodict import meta
+
+BENCHMARKS = ("dict", "backlog", "contention", "flush")
+
+
+class _FlushQueue(queue.Queue, iodict.FlushQueue):
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.lock = None
+        self.semaphore = None
+
+
+def _no_xattr(*args, **kwargs):
+    raise OSError("xattrs disabled for benchmarking")
+
+
+@contextlib.contextmanager
+def _xattrs(enabled: bool):
+    """Run the wrapped block with, or without, xattr support.
+
+    Without xattrs, the module level xattr functions are replaced with
+    ones which always fail, as they would on a filesystem without xattr
+    support.
+
+    :param enabled: Enable xattrs.
+    :type enabled: Boolean
+    """
+    if enabled:
+        yield
+        return
+
+    saved = iodict.getxattr, iodict.setxattr, iodict.listxattr
+    iodict.getxattr = iodict.setxattr = iodict.listxattr = _no_xattr
+    try:
+        yield
+    finally:
+        iodict.getxattr, iodict.setxattr, iodict.listxattr = saved
+
+
+def _result(name: str, ops: int, seconds: float, **params):
+    """Return a benchmark result record.
+
+    :param name: Benchmark name.
+    :type name: String
+    :param ops: Number of operations measured.
+    :type ops: Integer
+    :param seconds: Elapsed time.
+    :type seconds: Float
+    :returns: Dictionary
+    """
+    return {
+        "name": name,
+        "params": params,
+        "ops": ops,
+        "seconds": round(seconds, 6),
+        "ops_per_sec": round(ops / seconds, 2) if seconds else None,
+    }
+
+
+def _timed(func: typing.Callable, *args, **kwargs):
+    """Run a function, and return the elapsed time.
+
+    :param func: Callable to run.
+    :type func: Object
+    :returns: Float
+    """
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_dict(path: str, count: int, sizes: typing.List[int]):
+    """Measure set, get and delete throughput for different value sizes.
+
+    :param path: Storage path.
+    :type path: String
+    :param count: Number of items.
+    :type count: Integer
+    :param sizes: Value sizes, in bytes.
+    :type sizes: List
+    :returns: List
+    """
+    results = list()
+    for size in sizes:
+        store = iodict.IODict(path=os.path.join(path, "dict-{}".format(size)))
+        keys = ["key-{}".format(i) for i in range(count)]
+        value = os.urandom(size)
+
+        def _set():
+            for key in keys:
+                store[key] = value
+
+        def _get():
+            for key in keys:
+                store[key]
+
+        def _delete():
+            for key in keys:
+                del store[key]
+
+        for name, func in (("set", _set), ("get", _get), ("delete", _delete)):
+            results.append(
+                _result(
+                    "dict.{}".format(name),
+                    count,
+                    _timed(func),
+                    size=size,
+                )
+            )
+        store.drop()
+
+    return results
+
+
+def bench_backlog(path: str, count: int, backlogs: typing.List[int]):
+    """Measure popitem and queue throughput as the backlog grows.
+
+    Each backlog is written with `put_many`, then `count` items are
+    removed with `popitem`, and `count` items are put and got from the
+    queue on top of the backlog.
+
+    :param path: Storage path.
+    :type path: String
+    :param count: Number of operations measured per backlog.
+    :type count: Integer
+    :param backlogs: Number of items stored before measuring.
+    :type backlogs: List
+    :returns: List
+    """
+    results = list()
+    for backlog in backlogs:
+        q = iodict.DurableQueue(
+            path=os.path.join(path, "backlog-{}".format(backlog))
+        )
+        results.append(
+            _result(
+                "queue.put_many",
+                backlog,
+                _timed(q.put_many, range(backlog)),
+                backlog=backlog,
+            )
+        )
+        ops = min(count, backlog)
+
+        def _popitem():
+            for _ in range(ops):
+                q._queue.popitem()
+
+        def _put():
+            for i in range(ops):
+                q.put(i)
+
+        def _get():
+            for _ in range(ops):
+                q.get()
+
+        results.append(
+            _result("dict.popitem", ops, _timed(_popitem), backlog=backlog)
+        )
+        results.append(
+            _result("queue.put", ops, _timed(_put), backlog=backlog)
+        )
+        results.append(
+            _result("queue.get", ops, _timed(_get), backlog=backlog)
+        )
+        q.close()
+
+    return results
+
+
+def _contend(path: str, lock: typing.Any, worker: int, count: int):
+    """Set and get items within a shared store.
+
+    :param path: Storage path.
+    :type path: String
+    :param lock: Shared lock object.
+    :type lock: Object
+    :param worker: Worker number.
+    :type worker: Integer
+    :param count: Number of items.
+    :type count: Integer
+    """
+    store = iodict.IODict(path=path, lock=lock)
+    for i in range(count):
+        key = "{}-{}".format(worker, i)
+        store[key] = i
+        store[key]
+
+
+def bench_contention(path: str, count: int, processes: int):
+    """Measure set and get throughput with processes sharing one store.
+
+    :param path: Storage path.
+    :type path: String
+    :param count: Number of items set and got by each process.
+    :type count: Integer
+    :param processes: Number of processes.
+    :type processes: Integer
+    :returns: List
+    """
+    path = os.path.join(path, "contention")
+    lock = multiprocessing.Lock()
+    iodict.IODict(path=path, lock=lock)
+    workers = [
+        multiprocessing.Process(target=_contend, args=(path, lock, i, count))
+        for i in range(processes)
+    ]
+
+    def _run():
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    seconds = _timed(_run)
+    iodict.IODict(path=path).drop()
+    return [
+        _result(
+            "dict.contention",
+            count * processes * 2,
+            seconds,
+            processes=processes,
+        )
+    ]
+
+
+def bench_flush(path: str, count: int):
+    """Measure FlushQueue flush and ingest throughput.
+
+    :param path: Storage path.
+    :type path: String
+    :param count: Number of items.
+    :type count: Integer
+    :returns: List
+    """
+    results = list()
+    for workers in (1, 4):
+        q = _FlushQueue(path=os.path.join(path, "flush-{}".format(workers)))
+        for i in range(count):
+            q.put_nowait(i)
+        results.append(
+            _result(
+                "flush.flush",
+                count,
+                _timed(q.flush, workers=workers),
+                workers=workers,
+            )
+        )
+        results.append(
+            _result("flush.ingest", count, _timed(q.ingest), workers=workers)
+        )
+
+    return results
+
+
+def run(
+    path: str,
+    count: int = 1000,
+    sizes: typing.List[int] = (64, 4096, 65536),
+    backlogs: typing.List[int] = (1000, 10000),
+    processes: int = 4,
+    xattrs: typing.List[bool] = (True, False),
+    benchmarks: typing.List[str] = BENCHMARKS,
+):
+    """Run benchmarks, and return a report.
+
+    :param path: Base path for benchmark stores.
+    :type path: String
+    :param count: Number of operations measured by each benchmark.
+    :type count: Integer
+    :param sizes: Value sizes, in bytes.
+    :type sizes: List
+    :param backlogs: Backlog sizes.
+    :type backlogs: List
+    :param processes: Number of processes used for contention.
+    :type processes: Integer
+    :param xattrs: Run with, and or without, xattrs.
+    :type xattrs: List
+    :param benchmarks: Names of the benchmarks to run.
+    :type benchmarks: List
+    :returns: Dictionary
+    """
+    results = list()
+    for enabled in xattrs:
+        with _xattrs(enabled):
+            base = tempfile.mkdtemp(prefix="iodict-bench-", dir=path)
+            try:
+                for name in benchmarks:
+                    if name == "dict":
+                        records = bench_dict(base, count, sizes)
+                    elif name == "backlog":
+                        records = bench_backlog(base, count, backlogs)
+                    elif name == "contention":
+                        records = bench_contention(base, count, processes)
+                    elif name == "flush":
+                        records = bench_flush(base, count)
+                    else:
+                        raise ValueError("Unknown benchmark: {}".format(name))
+                    for record in records:
+                        record["xattr"] = enabled
+                        results.append(record)
+            finally:
+                shutil.rmtree(base, ignore_errors=True)
+
+    return {
+        "version": meta.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "results": results,
+    }
+
+
+def _ints(value: str):
+    """Return a list of integers from a comma separated string.
+
+    :param value: Comma separated integers.
+    :type value: String
+    :returns: List
+    """
+    return [int(i) for i in value.split(",") if i]
+
+
+def main(argv: typing.List[str] = None):
+    """Run benchmarks from the command line.
+
+    :param argv: Command line arguments.
+    :type argv: List
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m iodict.bench",
+        description="Benchmark the IODict and DurableQueue hot paths.",
+    )
+    parser.add_argument(
+        "--path",
+        default=None,
+        help="Base path for benchmark stores, defaults to the temp path.",
+    )
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=1000,
+        help="Number of operations measured by each benchmark.",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=_ints,
+        default=[64, 4096, 65536],
+        help="Comma separated value sizes, in bytes.",
+    )
+    parser.add_argument(
+        "--backlogs",
+        type=_ints,
+        default=[1000, 10000],
+        help="Comma separated backlog sizes, e.g. 1000,100000,1000000.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=4,
+        help="Number of processes used for contention.",
+    )
+    parser.add_argument(
+        "--xattr",
+        choices=("both", "on", "off"),
+        default="both",
+        help="Run with xattrs, without xattrs, or both.",
+    )
+    parser.add_argument(
+        "--benchmark",
+        action="append",
+        choices=BENCHMARKS,
+        help="Benchmark to run, may be repeated. Defaults to all.",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="File to write the JSON report to, defaults to stdout.",
+    )
+    args = parser.parse_args(argv)
+    xattrs = {"both": (True, False), "on": (True,), "off": (False,)}
+    report = run(
+        path=args.path,
+        count=args.count,
+        sizes=args.sizes,
+        backlogs=args.backlogs,
+        processes=args.processes,
+        xattrs=xattrs[args.xattr],
+        benchmarks=args.benchmark or BENCHMARKS,
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+#   Copyright Peznauts <kevin@peznauts.com>. All Rights Reserved.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License"); you may
+#   not use this file except in compliance with the License. You may obtain
+#   a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#   WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#   License for the specific language governing permissions and limitations
+#   under the License.
+"""Serve stores to local processes over a Unix domain socket.
+
+Run with ``python -m iodict.server --path /var/lib/iodict``. One server
+process owns the stores below the path, keeping their indexes, counts and
+locks in memory, and clients call them with `RemoteIODict` and
+`RemoteDurableQueue`.
+
+Requests and responses are pickled, and framed by a 4 byte big endian
+length. A request is a tuple of store kind, store name, method name,
+arguments and keyword arguments. A response is a tuple of a success flag
+and the result, or the exception raised. Responses are returned in request
+order, so clients can send several requests before reading any response.
+
+> Requests are unpickled by the server, so the socket is only accessible
+  to the user running the server.
+"""
+
+import argparse
+import os
+import pickle
+import socket
+import socketserver
+import struct
+import threading
+import types
+import typing
+
+import iodict
+
+_FRAME = struct.Struct(">I")
+
+# Methods clients may call, by store kind.
+_METHODS = {
+    "dict": frozenset(
+        (
+            "__contains__",
+            "__delitem__",
+            "__getitem__",
+            "__len__",
+            "__setitem__",
+            "clear",
+            "first",
+            "get",
+            "has",
+            "items",
+            "iter_from",
+            "keys",
+            "last",
+            "peek",
+            "pop",
+            "popitem",
+            "range",
+            "setdefault",
+            "stats",
+            "update",
+            "values",
+        )
+    ),
+    "queue": frozenset(
+        (
+            "empty",
+            "get",
+            "get_many",
+            "get_nowait",
+            "peek",
+            "put",
+            "put_many",
+            "put_nowait",
+            "qsize",
+            "stats",
+        )
+    ),
+}
+
+
+def _pack(*messages: typing.Any):
+    """Return messages as frames.
+
+    :param messages: Objects to send.
+    :type messages: Object
+    :returns: Bytes
+    """
+    frames = list()
+    for message in messages:
+        data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+        frames.append(_FRAME.pack(len(data)))
+        frames.append(data)
+    return b"".join(frames)
+
+
+def _recv_exact(sock: socket.socket, size: int):
+    """Receive exactly `size` bytes, or None when the peer has closed.
+
+    :param sock: Connected socket.
+    :type sock: Object
+    :param size: Number of bytes.
+    :type size: Integer
+    :returns: Bytes
+    """
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            if data:
+                raise ConnectionError("Connection closed within a frame")
+            return None
+        data += chunk
+    return bytes(data)
+
+
+def _recv(sock: socket.socket):
+    """Receive a message.
+
+    :param sock: Connected socket.
+    :type sock: Object
+    :returns: Object
+    """
+    header = _recv_exact(sock, _FRAME.size)
+    if header is None:
+        raise EOFError
+    data = _recv_exact(sock, _FRAME.unpack(header)[0])
+    if data is None:
+        raise ConnectionError("Connection closed within a frame")
+    return pickle.loads(data)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """Answer the requests of a client connection, in order."""
+
+    def handle(self):
+        """Serve requests until the client disconnects."""
+        while True:
+            try:
+                request = _recv(self.request)
+            except (EOFError, ConnectionError):
+                return
+
+            try:
+                data = _pack((True, self.server.call(*request)))
+            except Exception as e:
+                try:
+                    data = _pack((False, e))
+                except Exception:
+                    data = _pack((False, RuntimeError(repr(e))))
+            self.request.sendall(data)
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(
+        self, path: str, socket_path: str = None, **options: typing.Any
+    ):
+        """Serve the stores below a path over a Unix domain socket.
+
+        Stores are directories below the path, opened on first use, by
+        name, and kept open. The server is taken to be the only writer of
+        its stores, which are opened as `exclusive`, so their lengths, sizes
+        and gets are answered from the ordered index the server keeps
+        current as it writes. Every client connection is served
+        by its own thread, so a blocking queue get only blocks the client
+        waiting for it.
+
+        :param path: Base storage path.
+        :type path: String
+        :param socket_path: Socket path, defaults to `.iodict.sock` within
+                            the storage path.
+        :type socket_path: String
+        :param options: Options used to open every store, such as `lock`
+                        or `metadata`.
+        :type options: Dictionary
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(self.path, exist_ok=True)
+        if socket_path is None:
+            socket_path = os.path.join(
+                self.path, "{}.sock".format(iodict._RESERVED_PREFIX)
+            )
+        try:
+            os.unlink(socket_path)
+        except FileNotFoundError:
+            pass
+
+        self._options = dict(options, exclusive=True)
+        self._stores = dict()
+        self._stores_lock = threading.Lock()
+        umask = os.umask(0o077)
+        try:
+            super().__init__(socket_path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def store(self, kind: str, name: str = "default"):
+        """Return a store, opening it on first use.
+
+        :param kind: Store kind, `dict` or `queue`.
+        :type kind: String
+        :param name: Store name, a directory below the base path.
+        :type name: String
+        :returns: Object
+        """
+        with self._stores_lock:
+            if name in self._stores:
+                store_kind, store = self._stores[name]
+                if store_kind != kind:
+                    raise ValueError(
+                        "Store {} is a {}, not a {}".format(
+                            name, store_kind, kind
+                        )
+                    )
+                return store
+
+            if kind not in _METHODS:
+                raise ValueError("Store kind {} is unknown".format(kind))
+
+            if (
+                not isinstance(name, str)
+                or name in ("", ".", "..")
+                or os.sep in name
+                or name.startswith(iodict._RESERVED_PREFIX)
+            ):
+                raise ValueError("Store name {} is invalid".format(name))
+
+            path = os.path.join(self.path, name)
+
+            if kind == "dict":
+                store = iodict.IODict(path=path, **self._options)
+            else:
+                store = iodict.DurableQueue(path=path, **self._options)
+            self._stores[name] = (kind, store)
+            return store
+
+    def call(
+        self,
+        kind: str,
+        name: str,
+        method: str,
+        args: tuple = (),
+        kwargs: dict = None,
+    ):
+        """Call a method of a store, and return its result.
+
+        Iterators are returned as lists.
+
+        :param kind: Store kind, `dict` or `queue`.
+        :type kind: String
+        :param name: Store name.
+        :type name: String
+        :param method: Method name.
+        :type method: String
+        :param args: Positional arguments.
+        :type args: Tuple
+        :param kwargs: Keyword arguments.
+        :type kwargs: Dictionary
+        :returns: Object
+        """
+        if method not in _METHODS.get(kind, ()):
+            raise AttributeError("{} can not be called".format(method))
+
+        result = getattr(self.store(kind, name), method)(
+            *args, **(kwargs or {})
+        )
+        if isinstance(result, (types.GeneratorType, map, filter, zip)):
+            return list(result)
+        return result
+
+    def server_close(self):
+        """Close the socket, and remove it."""
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except FileNotFoundError:
+            pass
+
+
+class _Remote:
+    """Client connection calling one store of a server."""
+
+    _kind = None
+
+    def __init__(self, socket_path: str, name: str = "default"):
+        """Connect to a server.
+
+        :param socket_path: Server socket path.
+        :type socket_path: String
+        :param name: Store name, a directory below the server path.
+        :type name: String
+        """
+        self.socket_path = socket_path
+        self.name = name
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(socket_path)
+
+    def __getattr__(self, method: str):
+        """Return a callable calling a store method remotely.
+
+        :param method: Method name.
+        :type method: String
+        :returns: Callable
+        """
+        if method.startswith("_") or method not in _METHODS[self._kind]:
+            raise AttributeError(method)
+
+        def _call(*args, **kwargs):
+            return self._call(method, *args, **kwargs)
+
+        return _call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _call(self, method: str, *args, **kwargs):
+        """Call a store method, and return its result.
+
+        :param method: Method name.
+        :type method: String
+        :returns: Object
+        """
+        return self.batch([(method, args, kwargs)])[0]
+
+    def batch(self, calls: typing.Iterable[typing.Tuple[str, tuple, dict]]):
+        """Call many store methods, and return their results, in order.
+
+        Every request is sent before any response is read, so a batch
+        costs one round trip. When a call raises, the remaining calls are
+        still made, and the first exception is raised once all responses
+        are read.
+
+        :param calls: Tuples of method name, arguments and keyword
+                      arguments.
+        :type calls: Iterable
+        :returns: List
+        """
+        requests = [
+            (self._kind, self.name, method, tuple(args), dict(kwargs))
+            for method, args, kwargs in calls
+        ]
+        with self._lock:
+            self._sock.sendall(_pack(*requests))
+            responses = [_recv(self._sock) for _ in requests]
+
+        for ok, result in responses:
+            if not ok:
+                raise result
+        return [result for _, result in responses]
+
+    def close(self):
+        """Close the connection."""
+        self._sock.close()
+
+
+class RemoteIODict(_Remote):
+    """IODict served by a server process.
+
+    Supports the item, membership and length operators, and the reading and
+    writing methods of IODict. Iterating methods return lists.
+    """
+
+    _kind = "dict"
+
+    def __contains__(self, key: typing.Any):
+        return self._call("__contains__", key)
+
+    def __delitem__(self, key: typing.Any):
+        self._call("__delitem__", key)
+
+    def __getitem__(self, key: typing.Any):
+        return self._call("__getitem__", key)
+
+    def __iter__(self):
+        return iter(self._call("keys"))
+
+    def __len__(self):
+        return self._call("__len__")
+
+    def __setitem__(self, key: typing.Any, value: typing.Any):
+        self._call("__setitem__", key, value)
+
+
+class RemoteDurableQueue(_Remote):
+    """DurableQueue served by a server process.
+
+    Blocking gets wait within the server, and only block this connection.
+    """
+
+    _kind = "queue"
+
+
+def main(argv: typing.List[str] = None):
+    """Run a server from the command line.
+
+    :param argv: Command line arguments.
+    :type argv: List
+    """
+    parser = argparse.ArgumentParser(
+        prog="python -m iodict.server",
+        description="Serve stores to local processes over a Unix socket.",
+    )
+    parser.add_argument("--path", required=True, help="Base storage path.")
+    parser.add_argument(
+        "--socket",
+        default=None,
+        help="Socket path, defaults to .iodict.sock within the path.",
+    )
+    parser.add_argument(
+        "--metadata",
+        choices=("xattr", "header"),
+        default=None,
+        help="Item metadata mode of new stores.",
+    )
+    args = parser.parse_args(argv)
+    options = dict()
+    if args.metadata:
+        options["metadata"] = args.metadata
+
+    with Server(args.path, socket_path=args.socket, **options) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -3,7 +3,6 @@ import queue
 import sys
 import types
 
-
 possible_topdir = os.path.normpath(
     os.path.join(
         os.path.abspath(os.path.dirname(__file__)),
@@ -19,7 +18,6 @@ if os.path.exists(base_path):
 
 import iodict
 
-
 _D = iodict.IODict(path="/tmp/test-iodict")
 assert type(_D) == iodict.IODict
 
@@ -93,7 +91,9 @@ e = _D.pop("e")
 e()
 
 _D.clear()
-assert len(os.listdir("/tmp/test-iodict")) == 0
+assert not [
+    i for i in os.listdir("/tmp/test-iodict") if not i.startswith(".iodict")
+]
 
 
 _Q = iodict.DurableQueue(
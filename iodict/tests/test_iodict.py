@@ -12,8 +12,17 @@
 #   License for the specific language governing permissions and limitations
 #   under the License.
 
+import concurrent.futures
+import fcntl
+import io
+import os
 import pickle
 import queue
+import re
+import struct
+import tempfile
+import threading
+import time
 import unittest
 
 from unittest.mock import ANY
@@ -22,29 +31,39 @@ from unittest.mock import MagicMock
 from unittest.mock import patch
 
 import iodict
+from iodict import bench
+from iodict import server
 
 
 class MockItem:
     def __init__(self, path):
         self.path = path
+        self.name = path.split("/")[-1]
 
-
-class MockStat:
-    def __init__(*args, **kwargs) -> None:
-        pass
-
-    @property
-    def st_ctime(self) -> float:
-        return 1.0
+    def stat(self):
+        return os.stat(self.path)
 
 
 class BaseTest(unittest.TestCase):
     def setUp(self):
         self.patched_makedirs = patch("os.makedirs", autospec=True)
         self.mock_makedirs = self.patched_makedirs.start()
+        # Mocked stores are opened as existing stores without metadata.
+        self.patched_has_items = patch("iodict._has_items", autospec=True)
+        self.patched_has_items.start().return_value = True
 
     def tearDown(self):
         self.patched_makedirs.stop()
+        self.patched_has_items.stop()
+
+
+class StorageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "store")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
 
 
 class TestIODict(BaseTest):
@@ -110,9 +129,10 @@ class TestIODict(BaseTest):
         with self.assertRaises(KeyError):
             d.__delitem__("not-an-item")
 
+    @patch("os.rename", autospec=True)
     @patch("os.scandir", autospec=True)
     @patch("iodict.listxattr", autospec=True)
-    def test__exit__(self, mock_listxattr, mock_scandir):
+    def test__exit__(self, mock_listxattr, mock_scandir, mock_rename):
         with patch("builtins.open", unittest.mock.mock_open()):
             with patch.object(
                 iodict.IODict, "clear", autospec=True
@@ -139,91 +159,6 @@ class TestIODict(BaseTest):
             with self.assertRaises(KeyError):
                 d.__getitem__("not-an-item")
 
-    @patch("os.scandir", autospec=True)
-    @patch("os.path.exists", autospec=True)
-    @patch("os.getcwd", autospec=True)
-    @patch("os.chdir", autospec=True)
-    def test__iter__(self, mock_chdir, mock_getcwd, mock_exists, mock_scandir):
-        mock_getcwd.return_value = "/"
-        mock_exists.return_value = True
-        mock_scandir.return_value = [MockItem("file1"), MockItem("file2")]
-        d = iodict.IODict(path="/not/a/path")
-        with patch("iodict.getxattr") as mock_getxattr:
-            mock_getxattr.side_effect = [
-                b"key1",
-                b"A\xd8kl\xc1\xb1\xd9]",
-                b"key2",
-                b"A\xd8kn\x0f}\xda\x16",
-            ]
-            return_items = [i for i in d.__iter__()]
-            self.assertEqual(return_items, ["key1", "key2"])
-
-    @patch("os.scandir", autospec=True)
-    @patch("os.path.exists", autospec=True)
-    @patch("os.getcwd", autospec=True)
-    @patch("os.chdir", autospec=True)
-    def test__iter__not_found(
-        self, mock_chdir, mock_getcwd, mock_exists, mock_scandir
-    ):
-        mock_getcwd.return_value = "/"
-        mock_exists.return_value = True
-        mock_scandir.return_value = [MockItem("file1")]
-        d = iodict.IODict(path="/not/a/path")
-        with patch("iodict.getxattr") as mock_getxattr:
-            mock_getxattr.side_effect = [
-                b"key1",
-                b"A\xd8kn\x0f}\xda\x16",
-                FileNotFoundError,
-            ]
-            return_items = [i for i in d.__iter__()]
-            self.assertEqual(return_items, ["key1"])
-
-    @patch("os.stat", autospec=True)
-    @patch("os.scandir", autospec=True)
-    @patch("os.path.exists", autospec=True)
-    @patch("os.getcwd", autospec=True)
-    @patch("os.chdir", autospec=True)
-    def test__iter__no_xattr(
-        self,
-        mock_chdir,
-        mock_getcwd,
-        mock_exists,
-        mock_scandir,
-        mock_stat,
-    ):
-        mock_getcwd.return_value = "/"
-        mock_exists.return_value = True
-        mock_scandir.return_value = [
-            MockItem("key1"),
-            MockItem("key2"),
-        ]
-        d = iodict.IODict(path="/not/a/path")
-        with patch("iodict.getxattr") as mock_getxattr:
-            mock_getxattr.side_effect = OSError
-            mock_stat.return_value = MockStat()
-            return_items = [i for i in d.__iter__()]
-            self.assertEqual(return_items, ["key1", "key2"])
-
-    @patch("os.scandir", autospec=True)
-    @patch("os.path.exists", autospec=True)
-    @patch("os.getcwd", autospec=True)
-    @patch("os.chdir", autospec=True)
-    def test__iter__index(
-        self, mock_chdir, mock_getcwd, mock_exists, mock_scandir
-    ):
-        mock_getcwd.return_value = "/"
-        mock_exists.return_value = True
-        mock_scandir.return_value = [MockItem("file1"), MockItem("file2")]
-        d = iodict.IODict(path="/not/a/path")
-        with patch("iodict.getxattr") as mock_getxattr:
-            mock_getxattr.side_effect = [
-                b"key1",
-                b"A\xd8kn\x0f}\xda\x16",
-                b"key2",
-                b"A\xd8kl\xc1\xb1\xd9]",
-            ]
-            self.assertEqual([i for i in d.__iter__(index=1)], ["key1"])
-
     @patch("os.scandir", autospec=True)
     @patch("os.path.exists", autospec=True)
     @patch("os.getcwd", autospec=True)
@@ -237,84 +172,6 @@ class TestIODict(BaseTest):
         d = iodict.IODict(path="/not/a/path")
         self.assertEqual([i for i in d.__iter__()], [])
 
-    @patch("os.scandir", autospec=True)
-    @patch("os.path.exists", autospec=True)
-    def test__iter__no_exist(self, mock_exists, mock_scandir):
-        mock_exists.return_value = True
-        mock_scandir.return_value = [
-            MockItem("file1"),
-            MockItem("file2"),
-            MockItem("file3"),
-        ]
-        d = iodict.IODict(path="/not/a/path")
-        with patch("iodict.getxattr") as mock_getxattr:
-            mock_getxattr.side_effect = [
-                b"key1",
-                b"A\xd8kn\x0f}\xda\x16",
-                FileNotFoundError,
-                FileNotFoundError,
-                b"key3",
-                b"A\xd8kl\xc1\xb1\xd9]",
-            ]
-            self.assertEqual([i for i in d.__iter__()], ["key3", "key1"])
-
-    @patch("os.scandir", autospec=True)
-    @patch("os.path.exists", autospec=True)
-    def test__iter__exist_no_exist(self, mock_exists, mock_scandir):
-        mock_exists.side_effect = [True, True, False, False]
-        mock_scandir.return_value = [
-            MockItem("file1"),
-            MockItem("file2"),
-            MockItem("file3"),
-        ]
-        d = iodict.IODict(path="/not/a/path")
-        with patch("iodict.getxattr") as mock_getxattr:
-            mock_getxattr.side_effect = [
-                b"key1",
-                b"A\xd8kn\x0f}\xda\x16",
-                b"key2",
-                b"A\xd8kl\xc1\xb1\xd9]",
-                b"key3",
-                b"A\xd8kl\xc1\xb1\xd9]",
-            ]
-            self.assertEqual([i for i in d.__iter__()], ["key2"])
-
-    @patch("os.scandir", autospec=True)
-    @patch("os.path.exists", autospec=True)
-    def test__iter__reindex(self, mock_exists, mock_scandir):
-        mock_exists.side_effect = [True, False, True, True]
-        mock_scandir.side_effect = [
-            [MockItem("file1"), MockItem("file2")],
-            [MockItem("file2")],
-        ]
-        d = iodict.IODict(path="/not/a/path")
-        with patch("iodict.getxattr") as mock_getxattr:
-            mock_getxattr.side_effect = [
-                b"key1",
-                b"A\xd8kn\x0f}\xda\x16",
-                b"key2",
-                b"A\xd8kl\xc1\xb1\xd9]",
-                b"key2",
-                b"A\xd8kl\xc1\xb1\xd9]",
-            ]
-            self.assertEqual([i for i in d.__iter__(index=0)], ["key2"])
-
-    @patch("os.scandir", autospec=True)
-    @patch("os.path.exists", autospec=True)
-    def test__iter__generatorexit(self, mock_exists, mock_scandir):
-        mock_exists.side_effect = [True, True, GeneratorExit]
-        mock_scandir.return_value = [MockItem("file1"), MockItem("file2")]
-        d = iodict.IODict(path="/not/a/path")
-        with patch("iodict.getxattr") as mock_getxattr:
-            mock_getxattr.side_effect = [
-                b"key1",
-                b"A\xd8kl\xc1\xb1\xd9]",
-                b"key2",
-                b"A\xd8kn\x0f}\xda\x16",
-            ]
-            return_items = [i for i in d.__iter__()]
-            self.assertEqual(return_items, ["key1"])
-
     @patch("os.scandir", autospec=True)
     def test__len__zero(self, mock_scandir):
         mock_scandir.return_value = []
@@ -327,10 +184,14 @@ class TestIODict(BaseTest):
             mock__iter__.return_value = ["file1", "file2"]
             self.assertEqual(len(d), 2)
 
+    @patch("os.rename", autospec=True)
     @patch("iodict.setxattr", autospec=True)
     @patch("iodict.getxattr", autospec=True)
     @patch("iodict.listxattr", autospec=True)
-    def test__setitem__(self, mock_listxattr, mock_getxattr, mock_setxattr):
+    def test__setitem__(
+        self, mock_listxattr, mock_getxattr, mock_setxattr, mock_rename
+    ):
+        mock_getxattr.return_value = struct.pack(">dQ", 1.0, 2)
         read_data = pickle.dumps({"a": 1})
         d = iodict.IODict(path="/not/a/path")
         with patch(
@@ -338,18 +199,19 @@ class TestIODict(BaseTest):
         ):
             d.__setitem__("not-an-item", {"a": 1})
         mock_listxattr.assert_called_with("/not/a/path")
-        mock_getxattr.assert_called_with(
+        mock_getxattr.assert_any_call(
             "/not/a/path/29c4514efdb8379a19bae2c24d085d87ef0d0590d3c6c29b5b8b083a",
             "user.birthtime",
         )
-        mock_setxattr.assert_called_with(
+        mock_setxattr.assert_called_with(ANY, "user.key", b"not-an-item")
+        mock_rename.assert_called_with(
+            ANY,
             "/not/a/path/29c4514efdb8379a19bae2c24d085d87ef0d0590d3c6c29b5b8b083a",
-            "user.key",
-            b"not-an-item",
         )
 
+    @patch("os.rename", autospec=True)
     @patch("iodict.getxattr", autospec=True)
-    def test__setitem__no_xattrs(self, mock_getxattr):
+    def test__setitem__no_xattrs(self, mock_getxattr, mock_rename):
         mock_getxattr.side_effect = OSError
         read_data = pickle.dumps({"a": 1})
         d = iodict.IODict(path="/not/a/path")
@@ -357,18 +219,27 @@ class TestIODict(BaseTest):
             "builtins.open", unittest.mock.mock_open(read_data=read_data)
         ):
             d.__setitem__("not-an-item", {"a": 1})
+        mock_rename.assert_called_with(ANY, "/not/a/path/not-an-item")
 
-    def test_clear(self):
+    @patch("os.unlink", autospec=True)
+    @patch("os.scandir", autospec=True)
+    @patch("os.path.exists", autospec=True)
+    def test_clear(self, mock_exists, mock_scandir, mock_unlink):
+        mock_exists.return_value = True
+        mock_scandir.return_value = [
+            MockItem("/not/a/path/file1"),
+            MockItem("/not/a/path/.iodict.meta"),
+            MockItem("/not/a/path/file2"),
+        ]
         d = iodict.IODict(path="/not/a/path")
-        with patch.object(d, "__iter__", autospec=True) as mock__iter__:
-            mock__iter__.return_value = ["file1", "file2"]
-            with patch.object(
-                d, "__delitem__", autospec=True
-            ) as mock__delitem__:
-                d.clear()
-                mock__delitem__.assert_has_calls(
-                    [call("file1"), call("file2")]
-                )
+        mock_unlink.reset_mock()
+        mock_unlink.side_effect = [None, FileNotFoundError]
+        with patch("iodict.getxattr") as mock_getxattr:
+            d.clear()
+        mock_getxattr.assert_not_called()
+        mock_unlink.assert_has_calls(
+            [call("/not/a/path/file1"), call("/not/a/path/file2")]
+        )
 
     def test_copy(self):
         d = iodict.IODict(path="/not/a/path")
@@ -410,6 +281,19 @@ class TestIODict(BaseTest):
         with self.assertRaises(FileNotFoundError):
             iodict._get_item_key("/not/a/gAR9lC4=")
 
+    @patch("iodict.getxattr", autospec=True)
+    def test__get_create_order(self, mock_getxattr):
+        mock_getxattr.return_value = b"A\xd8kl\xc1\xb1\xd9]"
+        self.assertEqual(
+            iodict._get_create_order("/not/a/path"), (1638773510.7788918, 0)
+        )
+        mock_getxattr.return_value = b"A\xd8kl\xc1\xb1\xd9]" + bytes(
+            [0, 0, 0, 0, 0, 0, 0, 7]
+        )
+        self.assertEqual(
+            iodict._get_create_order("/not/a/path"), (1638773510.7788918, 7)
+        )
+
     def test__get_uuid(self):
         self.assertEqual(type(iodict._get_uuid()), str)
 
@@ -431,13 +315,17 @@ class TestIODict(BaseTest):
 
     def test_items(self):
         d = iodict.IODict(path="/not/a/path")
-        with patch.object(d, "__iter__", autospec=True) as mock__iter__:
-            mock__iter__.return_value = ["file1", "file2"]
-            with patch.object(
-                d, "__getitem__", autospec=True
-            ) as mock__getitem__:
-                mock__getitem__.side_effect = ["value1", "value2"]
+        with patch.object(d, "_entries", autospec=True) as mock__entries:
+            mock__entries.return_value = [
+                ("file1", (1.0, 0), "/not/a/path/1"),
+                ("file2", (2.0, 0), "/not/a/path/2"),
+            ]
+            with patch.object(d, "_read", autospec=True) as mock__read:
+                mock__read.side_effect = ["value1", "value2"]
                 return_items = [i for i in d.items()]
+                mock__read.assert_has_calls(
+                    [call("/not/a/path/1"), call("/not/a/path/2")]
+                )
         self.assertEqual(
             return_items, [("file1", "value1"), ("file2", "value2")]
         )
@@ -490,68 +378,69 @@ class TestIODict(BaseTest):
 
     def test_pop(self):
         d = iodict.IODict(path="/not/a/path")
-        with patch.object(d, "__getitem__", autospec=True) as mock__getitem__:
-            mock__getitem__.return_value = "value"
-            with patch.object(
-                d, "__delitem__", autospec=True
-            ) as mock__delitem__:
-                self.assertEqual(d.pop("file1"), "value")
-                mock__delitem__.assert_called_with("file1")
+        with patch.object(d, "_pop_path", autospec=True) as mock__pop_path:
+            mock__pop_path.return_value = "value"
+            self.assertEqual(d.pop("file1"), "value")
+            mock__pop_path.assert_called_with("/not/a/path/file1", "file1")
 
     def test_pop_default(self):
         d = iodict.IODict(path="/not/a/path")
-        with patch.object(d, "__getitem__", autospec=True) as mock__getitem__:
-            mock__getitem__.side_effect = KeyError
-            with patch.object(
-                d, "__delitem__", autospec=True
-            ) as mock__delitem__:
-                self.assertEqual(d.pop("file1", "default1"), "default1")
-                mock__delitem__.assert_called_with("file1")
+        with patch.object(d, "_pop_path", autospec=True) as mock__pop_path:
+            mock__pop_path.side_effect = KeyError
+            self.assertEqual(d.pop("file1", "default1"), "default1")
 
     def test_pop_no_default_keyerror(self):
         d = iodict.IODict(path="/not/a/path")
-        with patch.object(d, "__getitem__", autospec=True) as mock__getitem__:
-            mock__getitem__.side_effect = KeyError
-            with patch.object(
-                d, "__delitem__", autospec=True
-            ) as mock__delitem__:
-                with self.assertRaises(KeyError):
-                    d.pop("file1")
-                mock__delitem__.assert_called_with("file1")
+        with patch.object(d, "_pop_path", autospec=True) as mock__pop_path:
+            mock__pop_path.side_effect = KeyError
+            with self.assertRaises(KeyError):
+                d.pop("file1")
 
-    def test_popitem(self):
+    @patch("os.unlink", autospec=True)
+    def test__pop_path(self, mock_unlink):
+        read_data = pickle.dumps({"a": 1})
         d = iodict.IODict(path="/not/a/path")
-        with patch.object(d, "__getitem__", autospec=True):
-            with patch.object(d, "__delitem__", autospec=True):
-                with patch.object(
-                    d, "__iter__", autospec=True
-                ) as mock__iter__:
-                    mock__iter__.return_value = iter(["file1", "file2"])
-                    with patch.object(d, "pop", autospec=True) as mock_pop:
-                        mock_pop.side_effect = ["value1", "value2"]
-                        item_value = d.popitem()
+        with patch(
+            "builtins.open", unittest.mock.mock_open(read_data=read_data)
+        ):
+            self.assertEqual(d._pop_path("/not/a/path/a", "a"), {"a": 1})
+        mock_unlink.assert_called_with("/not/a/path/a")
 
-        self.assertEqual(item_value, "value1")
+    def test__pop_path_missing(self):
+        d = iodict.IODict(path="/not/a/path")
+        with patch("builtins.open", unittest.mock.mock_open()) as mock_f:
+            mock_f.side_effect = FileNotFoundError
+            with self.assertRaises(KeyError):
+                d._pop_path("/not/a/path/a", "a")
 
     def test_popitem(self):
         d = iodict.IODict(path="/not/a/path")
-        with patch.object(d, "__getitem__", autospec=True):
-            with patch.object(d, "__delitem__", autospec=True):
-                with patch.object(
-                    d, "__iter__", autospec=True
-                ) as mock__iter__:
-                    mock__iter__.return_value = iter(["file1", "file2"])
-                    with patch.object(d, "pop", autospec=True) as mock_pop:
-                        mock_pop.side_effect = StopIteration
-                        with self.assertRaises(KeyError):
-                            d.popitem()
+        with patch.object(d, "_entries", autospec=True) as mock__entries:
+            mock__entries.side_effect = [
+                [("file1", (1.0, 0), "/not/a/path/1")],
+                [("file2", (2.0, 0), "/not/a/path/2")],
+            ]
+            with patch.object(d, "_pop_path", autospec=True) as mock__pop_path:
+                mock__pop_path.side_effect = [KeyError, "value2"]
+                item_value = d.popitem()
+
+        mock__entries.assert_called_with(limit=1)
+        self.assertEqual(item_value, "value2")
+
+    def test_popitem_empty(self):
+        d = iodict.IODict(path="/not/a/path")
+        with patch.object(d, "_entries", autospec=True) as mock__entries:
+            mock__entries.return_value = []
+            with self.assertRaises(KeyError):
+                d.popitem()
 
     @patch("os.scandir", autospec=True)
     def test_repr(self, mock_scandir):
         d = iodict.IODict(path="/not/a/path")
         self.assertEqual(d.__repr__(), "{}")
 
-    def test_setdefault(self):
+    @patch("os.rename", autospec=True)
+    def test_setdefault(self, mock_rename):
         read_data = pickle.dumps("")
         d = iodict.IODict(path="/not/a/path")
         with patch(
@@ -561,7 +450,8 @@ class TestIODict(BaseTest):
 
         self.assertEqual(item, None)
 
-    def test_setdefault_default(self):
+    @patch("os.rename", autospec=True)
+    def test_setdefault_default(self, mock_rename):
         read_data = pickle.dumps({"a": 1})
         d = iodict.IODict(path="/not/a/path")
         with patch(
@@ -582,15 +472,87 @@ class TestIODict(BaseTest):
 
     def test_values(self):
         d = iodict.IODict(path="/not/a/path")
-        with patch.object(d, "__iter__", autospec=True) as mock__iter__:
-            mock__iter__.return_value = ["file1", "file2"]
-            with patch.object(
-                d, "__getitem__", autospec=True
-            ) as mock__getitem__:
-                mock__getitem__.side_effect = ["value1", "value2"]
+        with patch.object(d, "_entries", autospec=True) as mock__entries:
+            mock__entries.return_value = [
+                ("file1", (1.0, 0), "/not/a/path/1"),
+                ("file2", (2.0, 0), "/not/a/path/2"),
+            ]
+            with patch.object(d, "_read", autospec=True) as mock__read:
+                mock__read.side_effect = ["value1", FileNotFoundError]
                 return_items = [i for i in d.values()]
 
-        self.assertEqual(return_items, ["value1", "value2"])
+        self.assertEqual(return_items, ["value1"])
+
+
+class TestIter(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.d = iodict.IODict(path=self.path)
+        for key in ("key1", "key2", "key3"):
+            self.d[key] = key
+
+    def test__iter__(self):
+        self.assertEqual(list(self.d.__iter__()), ["key1", "key2", "key3"])
+
+    def test__iter__birthtime(self):
+        self.d._create("key0", pickle.dumps(0), birthtime=1.0, sequence=0)
+        self.assertEqual(list(self.d), ["key0", "key1", "key2", "key3"])
+
+    def test__iter__not_found(self):
+        meta = self.d._item_meta
+
+        def _meta(path, stat=None):
+            if path.endswith(self.d._encoder("key2")):
+                raise FileNotFoundError(path)
+            return meta(path, stat)
+
+        with patch.object(self.d, "_item_meta", side_effect=_meta):
+            self.assertEqual(list(self.d), ["key1", "key3"])
+
+    def test__iter__no_xattr(self):
+        path = os.path.join(self.tmpdir.name, "legacy")
+        os.mkdir(path)
+        for key in ("key1", "key2"):
+            with open(os.path.join(path, key), "wb") as f:
+                f.write(pickle.dumps(key))
+        with patch("iodict._has_xattrs", autospec=True, return_value=False):
+            d = iodict.IODict(path=path)
+        self.assertEqual(d._mode, "legacy")
+        self.assertEqual(list(d), ["key1", "key2"])
+
+    def test__iter__index(self):
+        self.assertEqual(list(self.d.__iter__(index=1)), ["key2"])
+
+    def test__iter__no_exist(self):
+        self.d._ordered()
+        with patch("os.path.exists", side_effect=[True, False, True]):
+            self.assertEqual(list(self.d.__iter__()), ["key1", "key3"])
+
+    def test__iter__reindex(self):
+        self.d._ordered()
+        os.unlink(os.path.join(self.path, self.d._encoder("key1")))
+        self.assertEqual(list(self.d.__iter__(index=0)), ["key2"])
+        self.assertEqual(list(self.d), ["key2", "key3"])
+
+    def test__iter__generatorexit(self):
+        self.d._ordered()
+        with patch("os.path.exists", side_effect=[True, GeneratorExit, True]):
+            self.assertEqual(list(self.d.__iter__()), ["key1", "key3"])
+
+    def test__iter__frozen(self):
+        keys = self.d.__iter__()
+        self.assertEqual(next(keys), "key1")
+        del self.d["key1"]
+        self.d["key4"] = 4
+        self.assertEqual(list(keys), ["key2", "key3"])
+
+    def test__len__(self):
+        self.d._ordered()
+        with patch("os.scandir", side_effect=AssertionError):
+            self.d["key4"] = 4
+            self.assertEqual(len(self.d), 4)
+            self.assertEqual(self.d.popitem(), "key1")
+            self.assertEqual(len(self.d), 3)
 
 
 class TestDurableQueue(BaseTest):
@@ -607,21 +569,18 @@ class TestDurableQueue(BaseTest):
 
     def test_close(self):
         q = iodict.DurableQueue(path="/not/a/path")
-        with patch("os.rmdir") as mock_rmdir:
-            q.close()
-            mock_rmdir.assert_called_once_with("/not/a/path")
+        q.close()
+        self.m.drop.assert_called_once_with(background=False)
 
-    def test_close_missing(self):
+    def test_close_background(self):
         q = iodict.DurableQueue(path="/not/a/path")
-        with patch("os.rmdir") as mock_rmdir:
-            mock_rmdir.side_effect = FileNotFoundError
-            q.close()
-            mock_rmdir.assert_called_once_with("/not/a/path")
+        q.close(background=True)
+        self.m.drop.assert_called_once_with(background=True)
 
     def test_empty(self):
         q = iodict.DurableQueue(path="/not/a/path")
         self.assertEqual(q.empty(), True)
-        with patch.object(self.m, "__len__", autospec=True) as mock_len:
+        with patch.object(self.m, "__len__") as mock_len:
             mock_len.return_value = 1
             self.assertEqual(q.empty(), False)
 
@@ -636,38 +595,70 @@ class TestDurableQueue(BaseTest):
             q.get(timeout=0.1)
 
     def test_get(self):
-        with patch.object(self.m, "__len__", autospec=True) as mock_len:
-            mock_len.return_value = 1
+        with patch("os.scandir", autospec=True) as mock_scandir:
+            mock_scandir.return_value = [MockItem("file1")]
             q = iodict.DurableQueue(path="/not/a/path")
-            with patch.object(
-                self.m, "popitem", autospec=True
-            ) as mock_popitem:
+            q.wait_recovery()
+            with patch.object(self.m, "popitem") as mock_popitem:
                 mock_popitem.return_value = "test"
                 self.assertEqual(q.get(), "test")
 
     def test_getnowait(self):
-        with patch.object(self.m, "__len__", autospec=True) as mock_len:
-            mock_len.return_value = 1
+        with patch("os.scandir", autospec=True) as mock_scandir:
+            mock_scandir.return_value = [MockItem("file1")]
             q = iodict.DurableQueue(path="/not/a/path")
-            with patch.object(
-                self.m, "popitem", autospec=True
-            ) as mock_popitem:
+            q.wait_recovery()
+            with patch.object(self.m, "popitem") as mock_popitem:
                 mock_popitem.return_value = "test"
                 self.assertEqual(q.get_nowait(), "test")
 
-    def test_put(self):
+    def test_recovery(self):
+        with patch("os.scandir", autospec=True) as mock_scandir:
+            mock_scandir.return_value = [MockItem("file1"), MockItem("file2")]
+            q = iodict.DurableQueue(path="/not/a/path")
+            self.assertTrue(q.wait_recovery(timeout=5))
+        mock_scandir.assert_called_once_with("/not/a/path")
+        self.assertTrue(q._count.acquire(False))
+        self.assertTrue(q._count.acquire(False))
+        self.assertFalse(q._count.acquire(False))
+
+    def test_recovery_skips_puts(self):
+        self.m._encoder = str
         q = iodict.DurableQueue(path="/not/a/path")
-        with patch.object(self.m, "_queue", autospec=True) as mock__queue:
-            mock__queue.return_value = dict()
+        q.wait_recovery(timeout=5)
+        q._recovery_puts = set()
+        q._recovery_gets = set()
+        with patch("iodict._get_uuid", autospec=True) as mock_uuid:
+            mock_uuid.return_value = "file1"
             q.put("test")
-            mock__queue.assert_called()
+        with patch("os.scandir", autospec=True) as mock_scandir:
+            mock_scandir.return_value = [MockItem("file1"), MockItem("file2")]
+            q._recover()
+        self.assertTrue(q._count.acquire(False))
+        self.assertTrue(q._count.acquire(False))
+        self.assertFalse(q._count.acquire(False))
+
+    def test_recovery_releases_missed_gets(self):
+        self.m._encoder = str
+        q = iodict.DurableQueue(path="/not/a/path")
+        q.wait_recovery(timeout=5)
+        q._recovery_puts = {"file2"}
+        q._recovery_gets = {"file1"}
+        with patch("os.scandir", autospec=True) as mock_scandir:
+            mock_scandir.return_value = [MockItem("file2")]
+            q._recover()
+        self.assertTrue(q._count.acquire(False))
+        self.assertFalse(q._count.acquire(False))
+
+    def test_put(self):
+        q = iodict.DurableQueue(path="/not/a/path")
+        q.put("test")
+        self.m.__setitem__.assert_called_with(ANY, "test")
 
     def test_putnowait(self):
         q = iodict.DurableQueue(path="/not/a/path")
-        with patch.object(self.m, "_queue", autospec=True) as mock__queue:
-            mock__queue.return_value = dict()
-            q.put_nowait("test")
-            mock__queue.assert_called()
+        q.put_nowait("test")
+        self.m.__setitem__.assert_called_with(ANY, "test")
 
 
 class _FlushQueue(queue.Queue, iodict.FlushQueue):
@@ -685,7 +676,7 @@ class TestFlushQueue(BaseTest):
         self.mock_iodict = self.patched_iodict.start()
         self.m = self.mock_iodict.return_value = MagicMock()
         self.m._db_path = "/not/a/path"
-        self.patched_queue = patch.object(self.m, "_queue", autospec=True)
+        self.patched_queue = patch.object(self.m, "_queue")
         self.mock__queue = self.patched_queue.start()
         self.mock__queue.return_value = dict()
 
@@ -704,11 +695,10 @@ class TestFlushQueue(BaseTest):
         self.assertEqual(q.qsize(), 0)
         with patch("os.path.exists", autospec=True) as mock_exists:
             mock_exists.return_value = True
-            with patch("os.rmdir", autospec=True) as mock_rmdir:
-                q.ingest()
+            q.ingest()
 
         mock_exists.assert_called()
-        mock_rmdir.assert_called()
+        self.m.drop.assert_called_once_with(background=False)
 
     def test_ingest_no_exists(self):
         q = _FlushQueue(path="/not/a/path")
@@ -723,9 +713,11 @@ class TestFlushQueue(BaseTest):
             mock_exists.return_value = True
             with patch("iodict.DurableQueue") as mock_durablequeue:
                 m = mock_durablequeue.return_value = MagicMock()
-                g = m.get_nowait = MagicMock()
-                g.side_effect = ["a", KeyError]
-                q.ingest()
+                g = m.get_many = MagicMock()
+                g.side_effect = [["a"], queue.Empty]
+                self.assertEqual(q.ingest(), 1)
+                m.close.assert_called_once_with()
+        self.assertEqual(q.get_nowait(), "a")
         self.mock__queue.assert_not_called()
 
     def test_flushqueue_attrs(self):
@@ -733,3 +725,1478 @@ class TestFlushQueue(BaseTest):
         self.assertEqual(q.path, "/not/a/path")
         self.assertEqual(q.lock, None)
         self.assertEqual(q.semaphore, None)
+
+
+class TestDurableQueueStorage(StorageTest):
+    def test_get_during_recovery(self):
+        iodict.DurableQueue(path=self.path).put("a")
+        release = threading.Event()
+        scandir, listdir = os.scandir, os.listdir
+
+        def _slow(func):
+            def _call(path):
+                if threading.current_thread() is not threading.main_thread():
+                    release.wait(5)
+                return func(path)
+
+            return _call
+
+        with patch("os.scandir", side_effect=_slow(scandir)), patch(
+            "os.listdir", side_effect=_slow(listdir)
+        ):
+            q = iodict.DurableQueue(path=self.path)
+            q.put("b")
+            self.assertEqual(q.get(), "a")
+            release.set()
+            self.assertTrue(q.wait_recovery(timeout=5))
+
+        self.assertEqual(q.get(timeout=1), "b")
+        with self.assertRaises(queue.Empty):
+            q.get(timeout=0.1)
+
+    def test_get_many(self):
+        q = iodict.DurableQueue(path=self.path)
+        q.put_many(range(5))
+        self.assertEqual(q.get_many(3), [0, 1, 2])
+        self.assertEqual(q.get_many(3), [3, 4])
+        with self.assertRaises(queue.Empty):
+            q.get_many(3, block=False)
+        with self.assertRaises(ValueError):
+            q.get_many(0)
+
+    def test_get_many_race(self):
+        q = iodict.DurableQueue(path=self.path)
+        q.put_many(["a", "b"])
+        q.wait_recovery()
+        unlink = os.unlink
+        seen = list()
+
+        def _unlink(path):
+            if not seen:
+                seen.append(path)
+                unlink(path)
+            unlink(path)
+
+        with patch("os.unlink", side_effect=_unlink):
+            self.assertEqual(q.get_many(2), ["b"])
+
+
+class TestFlushQueueStorage(StorageTest):
+    def test_flush_ingest_batches(self):
+        q = _FlushQueue(path=self.path)
+        for i in range(10):
+            q.put(i)
+
+        progress = list()
+        self.assertEqual(q.flush(batch_size=4, progress=progress.append), 10)
+        self.assertEqual(progress, [4, 8, 10])
+        self.assertEqual(q.qsize(), 0)
+        self.assertEqual(q.ingest(batch_size=3), 10)
+        self.assertEqual([q.get() for _ in range(10)], list(range(10)))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_flush_workers(self):
+        q = _FlushQueue(path=self.path)
+        for i in range(100):
+            q.put(i)
+
+        self.assertEqual(q.flush(batch_size=7, workers=4), 100)
+        self.assertEqual(q.ingest(), 100)
+        self.assertEqual([q.get() for _ in range(100)], list(range(100)))
+
+    def test_flush_skips_reserved(self):
+        q = _FlushQueue(path=self.path)
+        q.put("a")
+        q.flush()
+        open(os.path.join(self.path, ".iodict-tmp"), "wb").close()
+        self.assertEqual(len(iodict.IODict(path=self.path)), 1)
+
+    def test_ingest_maxsize(self):
+        q = _FlushQueue(path=self.path)
+        for i in range(5):
+            q.put(i)
+        q.flush()
+
+        small = _FlushQueue(path=self.path)
+        small.maxsize = 2
+        self.assertEqual(small.ingest(), 2)
+        self.assertEqual(small.ingest(), 0)
+        self.assertEqual([small.get(), small.get()], [0, 1])
+        self.assertEqual(small.ingest(), 2)
+        self.assertEqual([small.get(), small.get()], [2, 3])
+        self.assertEqual(small.ingest(), 1)
+        self.assertEqual(small.get(), 4)
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_ingest_block_timeout(self):
+        q = _FlushQueue(path=self.path)
+        for i in range(3):
+            q.put(i)
+        q.flush()
+
+        small = _FlushQueue(path=self.path)
+        small.maxsize = 1
+        self.assertEqual(small.ingest(block=True, timeout=0.05), 1)
+        self.assertTrue(os.path.exists(self.path))
+
+
+class TestSnapshot(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.snapshot = os.path.join(self.tmpdir.name, "store.snap")
+
+    def test_export_load(self):
+        d = iodict.IODict(path=self.path)
+        for i in range(5):
+            d[str(i)] = {"value": i}
+
+        self.assertEqual(d.export(self.snapshot), 5)
+        restored = iodict.IODict(path=os.path.join(self.tmpdir.name, "new"))
+        self.assertEqual(restored.load(self.snapshot), 5)
+        self.assertEqual(list(restored.items()), list(d.items()))
+
+    def test_export_load_fileobj(self):
+        d = iodict.IODict(path=self.path)
+        d["a"] = 1
+        f = io.BytesIO()
+        d.export(f)
+        d.clear()
+        f.seek(0)
+        self.assertEqual(d.load(f), 1)
+        self.assertEqual(d["a"], 1)
+
+    def test_load_checksum(self):
+        d = iodict.IODict(path=self.path)
+        d["a"] = 1
+        f = io.BytesIO()
+        d.export(f)
+        data = bytearray(f.getvalue())
+        data[-(iodict._SNAPSHOT_RECORD.size + 1)] ^= 0xFF
+        with self.assertRaises(ValueError):
+            d.load(io.BytesIO(bytes(data)))
+
+    def test_load_truncated(self):
+        d = iodict.IODict(path=self.path)
+        d["a"] = 1
+        f = io.BytesIO()
+        d.export(f)
+        with self.assertRaises(ValueError):
+            d.load(io.BytesIO(f.getvalue()[:-4]))
+
+    def test_queue_export_load(self):
+        q = iodict.DurableQueue(path=self.path)
+        q.put_many(["a", "b", "c"])
+        self.assertEqual(q.export(self.snapshot), 3)
+        restored = iodict.DurableQueue(
+            path=os.path.join(self.tmpdir.name, "new")
+        )
+        self.assertEqual(restored.load(self.snapshot), 3)
+        self.assertEqual(restored.get_many(3, block=False), ["a", "b", "c"])
+
+
+class TestDigest(StorageTest):
+    def test_digest_recorded(self):
+        d = iodict.IODict(path=self.path, digest="blake2b")
+        self.assertEqual(d._encoder, iodict._object_blake2b)
+        d["a"] = 1
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(self.path, iodict._object_blake2b("a"))
+            )
+        )
+        self.assertEqual(
+            iodict.IODict(path=self.path)._encoder, iodict._object_blake2b
+        )
+        with self.assertRaises(ValueError):
+            iodict.IODict(path=self.path, digest="sha3_224")
+
+    def test_digest_legacy_store(self):
+        os.makedirs(self.path)
+        with open(os.path.join(self.path, "item"), "wb") as f:
+            pickle.dump(1, f)
+        with self.assertRaises(ValueError):
+            iodict.IODict(path=self.path, digest="blake2b")
+        self.assertEqual(
+            iodict.IODict(path=self.path)._encoder, iodict._object_sha3_224
+        )
+
+    def test_digest_unknown(self):
+        with self.assertRaises(ValueError):
+            iodict.IODict(path=self.path, digest="md4")
+        self.assertIsNone(iodict._read_metadata(self.path))
+
+
+class TestIteration(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.d = iodict.IODict(path=self.path)
+        for i in range(20):
+            self.d[str(i)] = i
+
+    def test_items_unordered(self):
+        self.assertEqual(
+            sorted(self.d.items(ordered=False)),
+            sorted((str(i), i) for i in range(20)),
+        )
+
+    def test_items_prefetch(self):
+        self.assertEqual(
+            list(self.d.items(prefetch=4)), [(str(i), i) for i in range(20)]
+        )
+        self.assertEqual(list(self.d.values(prefetch=4)), list(range(20)))
+
+    def test_items_prefetch_stop(self):
+        items = self.d.items(prefetch=2)
+        self.assertEqual(next(items), ("0", 0))
+        items.close()
+
+    def test_items_prefetch_error(self):
+        with patch.object(self.d, "_read", autospec=True) as mock__read:
+            mock__read.side_effect = pickle.UnpicklingError
+            with self.assertRaises(pickle.UnpicklingError):
+                list(self.d.items(prefetch=2))
+
+
+class TestClear(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.d = iodict.IODict(path=self.path, digest="blake2b")
+        for i in range(10):
+            self.d[str(i)] = i
+
+    def test_clear(self):
+        self.d.clear()
+        self.assertEqual(len(self.d), 0)
+        self.assertEqual(
+            sorted(os.listdir(self.path)),
+            sorted([iodict._GENERATION_FILE, iodict._METADATA_FILE]),
+        )
+
+    def test_clear_background(self):
+        self.d.clear(background=True)
+        self.assertEqual(len(self.d), 0)
+        self.assertEqual(
+            iodict.IODict(path=self.path)._encoder, iodict._object_blake2b
+        )
+        self.d["a"] = 1
+        self.assertEqual(dict(self.d.items()), {"a": 1})
+
+    def test_clear_background_locks(self):
+        lock = iodict.StripedFileLock(self.path, stripes=8)
+        d = iodict.IODict(path=self.path, lock=lock)
+        with lock.stripe("a"):
+            inode = os.fstat(lock._fd).st_ino
+            d.clear(background=True)
+            self.assertEqual(os.stat(lock.path).st_ino, inode)
+            with concurrent.futures.ProcessPoolExecutor(1) as pool:
+                self.assertEqual(
+                    pool.submit(_try_stripes, lock, ["a"]).result(),
+                    [False, False],
+                )
+        d["a"] = 1
+        self.assertEqual(lock._retired, [])
+
+    def test_drop(self):
+        self.d.drop()
+        self.assertEqual(os.listdir(self.tmpdir.name), [])
+        self.d.drop()
+
+    def test_drop_locks(self):
+        lock = iodict.FileLock(self.path)
+        d = iodict.IODict(path=self.path, lock=lock)
+        d["a"] = 1
+        d.drop()
+        other = iodict.FileLock(self.path)
+        d = iodict.IODict(path=self.path, lock=other)
+        with other:
+            self.assertFalse(lock.acquire(timeout=0.01))
+        with lock:
+            self.assertTrue(
+                os.path.samestat(os.fstat(lock._fd), os.stat(other.path))
+            )
+
+    def test_drop_background(self):
+        self.d.drop(background=True)
+        self.assertFalse(os.path.exists(self.path))
+
+
+class TestOrderedAccess(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.d = iodict.IODict(path=self.path)
+        for i in range(10):
+            self.d[str(i)] = i
+
+    def test_peek(self):
+        self.assertEqual(self.d.peek(), [("0", 0)])
+        self.assertEqual(self.d.peek(3), [("0", 0), ("1", 1), ("2", 2)])
+        self.assertEqual(len(self.d), 10)
+
+    def test_first_last(self):
+        self.assertEqual(self.d.first(), ("0", 0))
+        self.assertEqual(self.d.last(), ("9", 9))
+
+    def test_first_last_empty(self):
+        self.d.clear()
+        with self.assertRaises(KeyError):
+            self.d.first()
+        with self.assertRaises(KeyError):
+            self.d.last()
+
+    def test_range(self):
+        self.assertEqual(list(self.d.range(2, 4)), [("2", 2), ("3", 3)])
+        self.assertEqual(list(self.d.range(-2)), [("8", 8), ("9", 9)])
+
+    def test_iter_from(self):
+        self.assertEqual([k for k, _ in self.d.iter_from("7")], ["8", "9"])
+        self.assertEqual(
+            [k for k, _ in self.d.iter_from("8", inclusive=True)], ["8", "9"]
+        )
+        with self.assertRaises(KeyError):
+            list(self.d.iter_from("missing"))
+
+    def test_index_updates(self):
+        self.d.first()
+        del self.d["0"]
+        self.d.pop("1")
+        self.d["10"] = 10
+        self.assertEqual(self.d.first(), ("2", 2))
+        self.assertEqual(self.d.last(), ("10", 10))
+
+    def test_index_invalidated(self):
+        self.d.first()
+        other = iodict.IODict(path=self.path)
+        del other["0"]
+        other["10"] = 10
+        self.assertEqual(self.d.first(), ("1", 1))
+        self.assertEqual(self.d.last(), ("10", 10))
+
+    def test_index_same_tick(self):
+        settled = os.stat(self.path).st_mtime_ns - 10**9
+        os.utime(self.path, ns=(settled, settled))
+        self.d.first()
+        self.d["10"] = 10
+        stamp = os.stat(self.path).st_mtime_ns
+        self.d.first()
+        other = iodict.IODict(path=self.path)
+        del other["0"]
+        os.utime(self.path, ns=(stamp, stamp))
+        self.assertEqual(self.d.first(), ("1", 1))
+
+    def test_index_replaced(self):
+        self.d.first()
+        other = iodict.IODict(path=self.path)
+        other._create("0", pickle.dumps(0), birthtime=None, sequence=0)
+        self.assertEqual(self.d.first(), ("1", 1))
+        self.assertEqual(self.d.last(), ("0", 0))
+
+    def test_queue_peek(self):
+        q = iodict.DurableQueue(path=os.path.join(self.tmpdir.name, "q"))
+        for i in range(3):
+            q.put(i)
+        self.assertEqual(q.peek(2), [0, 1])
+        self.assertEqual(q.get(), 0)
+        self.assertEqual(q.peek(2), [1, 2])
+        q.close()
+
+
+class TestKeyScan(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.d = iodict.IODict(path=self.path)
+        for job in ("12", "1234", "2"):
+            for task in range(3):
+                self.d["job:{}:{}".format(job, task)] = task
+
+    def test_keys_prefix(self):
+        self.assertEqual(
+            list(self.d.keys(prefix="job:1234:")),
+            ["job:1234:0", "job:1234:1", "job:1234:2"],
+        )
+        self.assertEqual(list(self.d.keys(prefix="job:3")), [])
+
+    def test_items_prefix(self):
+        self.assertEqual(
+            list(self.d.items(prefix="job:2:")),
+            [("job:2:0", 0), ("job:2:1", 1), ("job:2:2", 2)],
+        )
+        self.assertEqual(list(self.d.values(prefix="job:12:")), [0, 1, 2])
+
+    def test_keys_glob(self):
+        self.assertEqual(
+            list(self.d.keys(match="job:12*:1")), ["job:12:1", "job:1234:1"]
+        )
+        self.assertEqual(list(self.d.keys(prefix="job:2", match="job:1*")), [])
+
+    def test_keys_regex(self):
+        self.assertEqual(
+            list(self.d.keys(match=re.compile(r":2$"))),
+            ["job:12:2", "job:1234:2", "job:2:2"],
+        )
+
+    def test_key_index_updates(self):
+        list(self.d.keys(prefix="job:"))
+        key_rows = self.d._ordered().key_rows
+        del self.d["job:12:0"]
+        self.d["job:12:3"] = 3
+        self.d["job:2:1"] = 10
+        self.assertEqual(
+            list(self.d.keys(prefix="job:12:")),
+            ["job:12:1", "job:12:2", "job:12:3"],
+        )
+        self.assertEqual(
+            list(self.d.items(prefix="job:2:1")), [("job:2:1", 10)]
+        )
+        self.assertIs(self.d._ordered().key_rows, key_rows)
+
+    def test_key_index_compacted(self):
+        index = self.d._ordered()
+        list(self.d.keys(prefix="job:"))
+        arenas = len(index.names) + len(index.keys)
+        with patch.object(index, "compact_bytes", 0):
+            for job in ("12", "1234"):
+                for task in range(3):
+                    del self.d["job:{}:{}".format(job, task)]
+        self.assertLess(len(index.names) + len(index.keys), arenas)
+        self.assertEqual(
+            list(self.d.keys(prefix="job:")),
+            ["job:2:{}".format(task) for task in range(3)],
+        )
+
+
+class TestBench(unittest.TestCase):
+    def test_run(self):
+        with tempfile.TemporaryDirectory() as path:
+            report = bench.run(
+                path=path,
+                count=10,
+                sizes=[16],
+                backlogs=[10],
+                processes=2,
+            )
+            self.assertEqual(os.listdir(path), [])
+
+        self.assertIn("version", report)
+        names = {(r["name"], r["xattr"]) for r in report["results"]}
+        for xattr in (True, False):
+            for name in ("dict.set", "dict.popitem", "queue.get"):
+                self.assertIn((name, xattr), names)
+            self.assertIn(("dict.contention", xattr), names)
+            self.assertIn(("flush.ingest", xattr), names)
+
+
+class TestMetrics(StorageTest):
+    def test_disabled(self):
+        d = iodict.IODict(path=self.path)
+        d["a"] = 1
+        self.assertEqual(d.stats(), {})
+
+    def test_stats(self):
+        d = iodict.IODict(path=self.path, metrics=True)
+        d["a"] = 1
+        d["b"] = 2
+        self.assertEqual(d["a"], 1)
+        # Wait out the window in which the index stamp is not trusted.
+        time.sleep(0.1)
+        list(d.range(0, 1))
+        list(d.range(0, 1))
+        d.popitem()
+        stats = d.stats()
+        self.assertEqual(stats["set_seconds"]["count"], 2)
+        self.assertEqual(stats["get_seconds"]["count"], 1)
+        self.assertEqual(stats["popitem_seconds"]["count"], 1)
+        self.assertEqual(stats["set_seconds"]["buckets"][float("inf")], 2)
+        self.assertGreaterEqual(stats["lock_wait_seconds"]["count"], 3)
+        self.assertEqual(stats["bytes_written"], 2 * len(pickle.dumps(1)))
+        self.assertGreater(stats["bytes_read"], 0)
+        self.assertEqual(stats["setxattr_calls"], 4)
+        self.assertGreaterEqual(stats["scan_items"], 2)
+        self.assertIn("scan_seconds", stats)
+        self.assertIn("deserialize_seconds", stats)
+        self.assertGreater(stats["index_hit_rate"], 0)
+
+    def test_hooks(self):
+        recorded = list()
+        metrics = iodict.Metrics(hooks=[lambda n, v: recorded.append(n)])
+        q = iodict.DurableQueue(path=self.path, metrics=metrics)
+        q.wait_recovery()
+        q.put(1)
+        self.assertEqual(q.get(), 1)
+        self.assertIn("set_seconds", recorded)
+        self.assertIn("popitem_seconds", recorded)
+        self.assertEqual(q.stats()["set_seconds"]["count"], 1)
+        q.close()
+
+    def test_collect(self):
+        d = iodict.IODict(path=self.path, metrics=True)
+        d["a"] = 1
+        text = d._metrics.collect()
+        self.assertIn("# TYPE iodict_set_seconds histogram", text)
+        self.assertIn('iodict_set_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn("iodict_set_seconds_count 1", text)
+        self.assertIn("# TYPE iodict_bytes_written counter", text)
+
+
+class TestSlowLog(StorageTest):
+    def test_threshold(self):
+        slow_log = iodict.SlowLog(threshold=60)
+        d = iodict.IODict(path=self.path, slow_log=slow_log)
+        d["a"] = 1
+        self.assertEqual(list(slow_log.records), [])
+
+    def test_records(self):
+        records = list()
+        slow_log = iodict.SlowLog(threshold=0, callback=records.append)
+        d = iodict.IODict(path=self.path, slow_log=slow_log)
+        d["a"] = 1
+        self.assertEqual(d["a"], 1)
+        d.popitem()
+        self.assertEqual(records, list(slow_log.records))
+        set_record, get_record, popitem_record = records
+        self.assertEqual(set_record["operation"], "set")
+        self.assertEqual(set_record["key_digest"], d._encoder("a"))
+        self.assertEqual(set_record["store_size"], 1)
+        self.assertIn("serialize", set_record["phases"])
+        self.assertIn("lock_wait", get_record["phases"])
+        self.assertIn("io", get_record["phases"])
+        self.assertIn("deserialize", get_record["phases"])
+        self.assertNotIn("get", get_record["phases"])
+        self.assertEqual(popitem_record["operation"], "popitem")
+        self.assertIsNone(popitem_record["key_digest"])
+        self.assertIn("scan", popitem_record["phases"])
+        self.assertNotIn("stack", popitem_record)
+
+    def test_stack_memory(self):
+        slow_log = iodict.SlowLog(threshold=0, stack=True, memory=True)
+        d = iodict.IODict(path=self.path, slow_log=slow_log)
+        try:
+            d["a"] = "x" * 4096
+        finally:
+            iodict.tracemalloc.stop()
+        record = slow_log.records[0]
+        self.assertIn("test_stack_memory", "".join(record["stack"]))
+        self.assertIn("memory", record)
+
+    def test_queue(self):
+        slow_log = iodict.SlowLog(threshold=0)
+        q = iodict.DurableQueue(path=self.path, slow_log=slow_log)
+        q.wait_recovery()
+        q.put(1)
+        q.get()
+        operations = [r["operation"] for r in slow_log.records]
+        self.assertEqual(operations, ["set", "popitem"])
+        q.close()
+
+
+def _put_in_child(q, item):
+    q.put(item)
+    return q._queue._lock.path
+
+
+def _try_lock(lock):
+    return lock.acquire(block=False)
+
+
+def _try_stripes(lock, names):
+    acquired = list()
+    for name in names:
+        stripe = lock.stripe(name)
+        acquired.append(stripe.acquire(block=False))
+        if acquired[-1]:
+            stripe.release()
+    acquired.append(lock.acquire(block=False))
+    return acquired
+
+
+class TestHandles(StorageTest):
+    def test_pickle_dict(self):
+        d = iodict.IODict(path=self.path, metrics=True)
+        d["a"] = 1
+        with patch("iodict.listxattr", autospec=True) as mock_listxattr:
+            handle = pickle.loads(pickle.dumps(d))
+            mock_listxattr.assert_not_called()
+        self.assertEqual(handle["a"], 1)
+        self.assertIs(handle._encoder, d._encoder)
+        self.assertIsInstance(handle._lock, iodict.FileLock)
+        self.assertEqual(handle.stats(), {})
+
+    def test_pickle_file_lock(self):
+        lock = iodict.FileLock(self.path)
+        d = iodict.IODict(path=self.path, lock=lock)
+        d["a"] = 1
+        handle = pickle.loads(pickle.dumps(d))
+        self.assertEqual(handle._lock.path, lock.path)
+        self.assertEqual(os.path.basename(lock.path), ".iodict.lock")
+        self.assertEqual(list(handle.keys()), ["a"])
+
+    def test_file_lock_processes(self):
+        lock = iodict.FileLock(self.path)
+        with concurrent.futures.ProcessPoolExecutor(1) as pool:
+            with lock:
+                self.assertFalse(pool.submit(_try_lock, lock).result())
+            self.assertTrue(pool.submit(_try_lock, lock).result())
+
+    def test_file_lock_timeout(self):
+        lock = iodict.FileLock(self.path)
+        with lock:
+            self.assertFalse(lock.acquire(timeout=0.01))
+        self.assertTrue(lock.acquire(timeout=0.01))
+        lock.release()
+
+    def test_queue_pool(self):
+        q = iodict.DurableQueue(path=self.path)
+        with concurrent.futures.ProcessPoolExecutor(4) as pool:
+            paths = set(pool.map(_put_in_child, [q] * 8, range(8)))
+        self.assertEqual(paths, {os.path.join(self.path, ".iodict.lock")})
+        # Puts by other processes are counted by queues recovered after.
+        handle = pickle.loads(pickle.dumps(q))
+        handle.wait_recovery()
+        self.assertEqual(handle.qsize(), 8)
+        self.assertEqual(
+            sorted(handle.get(timeout=1) for _ in range(8)), list(range(8))
+        )
+        handle.close()
+
+
+class TestStripedFileLock(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.lock = iodict.StripedFileLock(self.path, stripes=8)
+
+    def _names(self):
+        first = self.lock.stripe("a").index
+        other = next(
+            str(i)
+            for i in range(100)
+            if self.lock.stripe(str(i)).index != first
+        )
+        return "a", other
+
+    def test_stripes(self):
+        with self.assertRaises(ValueError):
+            iodict.StripedFileLock(self.path, stripes=0)
+        self.assertEqual(
+            self.lock.stripe("a").index,
+            iodict.StripedFileLock(self.path, stripes=8).stripe("a").index,
+        )
+        with self.assertRaises(ValueError):
+            iodict.StripedFileLock(self.path, stripes=16)
+        with self.lock.stripe("a"):
+            self.assertFalse(self.lock.stripe("a").acquire(timeout=0.01))
+        self.assertTrue(self.lock.acquire(timeout=0.01))
+        self.lock.release()
+
+    def test_store_stripes(self):
+        d = iodict.IODict(path=self.path, lock=self.lock)
+        self.assertEqual(iodict._read_metadata(self.path)["stripes"], 8)
+        handle = iodict.IODict(path=self.path, lock=self.lock)
+        self.assertEqual(handle._lock.stripes, 8)
+        with patch.dict(iodict._STRIPE_LOCKS, clear=True):
+            with self.assertRaises(ValueError):
+                iodict.IODict(
+                    path=self.path,
+                    lock=iodict.StripedFileLock(self.path, stripes=4),
+                )
+        d["a"] = 1
+        self.assertEqual(d["a"], 1)
+
+    def test_processes(self):
+        same, other = self._names()
+        with concurrent.futures.ProcessPoolExecutor(1) as pool:
+            with self.lock.stripe(same):
+                self.assertEqual(
+                    pool.submit(
+                        _try_stripes, self.lock, [same, other]
+                    ).result(),
+                    [False, True, False],
+                )
+            with self.lock:
+                self.assertEqual(
+                    pool.submit(_try_stripes, self.lock, [other]).result(),
+                    [False, False],
+                )
+            self.assertEqual(
+                pool.submit(_try_stripes, self.lock, [same]).result(),
+                [True, True],
+            )
+
+    def test_threads(self):
+        same, other = self._names()
+        table = iodict.StripedFileLock(self.path, stripes=8)
+        with self.lock.stripe(same):
+            self.assertFalse(table.stripe(same).acquire(timeout=0.01))
+            self.assertFalse(table.acquire(timeout=0.01))
+            result = list()
+            thread = threading.Thread(
+                target=lambda: result.append(_try_stripes(table, [other]))
+            )
+            thread.start()
+            thread.join()
+            self.assertEqual(result, [[True, False]])
+
+    def test_store(self):
+        d = iodict.IODict(path=self.path, lock=self.lock, metrics=True)
+        d["a"] = 1
+        self.assertEqual(d["a"], 1)
+        handle = pickle.loads(pickle.dumps(d))
+        self.assertIsInstance(handle._lock, iodict.StripedFileLock)
+        self.assertEqual(handle._lock.stripes, 8)
+        self.assertEqual(handle.pop("a"), 1)
+        self.assertEqual(d.stats()["lock_wait_seconds"]["count"], 2)
+
+
+class TestHeaderMetadata(StorageTest):
+    def test_items(self):
+        d = iodict.IODict(path=self.path, metadata="header")
+        with patch("iodict.getxattr", autospec=True) as mock_getxattr:
+            with patch("iodict.setxattr", autospec=True) as mock_setxattr:
+                for i in range(5):
+                    d["key/{}".format(i)] = i
+                d["key/0"] = "replaced"
+                self.assertEqual(
+                    list(d.items()),
+                    [("key/0", "replaced")]
+                    + [("key/{}".format(i), i) for i in range(1, 5)],
+                )
+                self.assertEqual(d.first(), ("key/0", "replaced"))
+                self.assertEqual(d.pop("key/1"), 1)
+                self.assertEqual(d.popitem(), "replaced")
+        mock_getxattr.assert_not_called()
+        mock_setxattr.assert_not_called()
+        with open(os.path.join(self.path, d._encoder("key/2")), "rb") as f:
+            self.assertTrue(f.read().startswith(iodict._HEADER_MAGIC))
+
+    def test_overwrite_shorter(self):
+        d = iodict.IODict(path=self.path, metadata="header")
+        d["a"] = "x" * 1024
+        d["a"] = "y"
+        self.assertEqual(d["a"], "y")
+
+    def test_queue_snapshot(self):
+        q = iodict.DurableQueue(path=self.path, metadata="header")
+        q.put_many(range(5))
+        snapshot = os.path.join(self.tmpdir.name, "snap")
+        self.assertEqual(q._queue.export(snapshot), 5)
+        restored = iodict.IODict(path=self.path + "-r", metadata="header")
+        self.assertEqual(q.get(), 0)
+        restored.load(snapshot)
+        self.assertEqual(list(restored.values()), list(range(5)))
+        q.close()
+
+    def test_probe_cached(self):
+        with patch("iodict.listxattr", autospec=True) as mock_listxattr:
+            mock_listxattr.side_effect = OSError
+            d = iodict.IODict(path=self.path)
+        self.assertEqual(d._mode, "header")
+        d["a"] = 1
+        with patch("iodict.listxattr", autospec=True) as mock_listxattr:
+            d = iodict.IODict(path=self.path)
+            mock_listxattr.assert_not_called()
+        self.assertEqual(d._mode, "header")
+        self.assertEqual(d["a"], 1)
+
+    def test_mode_errors(self):
+        iodict.IODict(path=self.path, metadata="header")
+        with self.assertRaises(ValueError):
+            iodict.IODict(path=self.path, metadata="xattr")
+        with self.assertRaises(ValueError):
+            iodict.IODict(path=self.path + "-x", metadata="sidecar")
+        with patch("iodict.listxattr", autospec=True) as mock_listxattr:
+            mock_listxattr.side_effect = OSError
+            with self.assertRaises(ValueError):
+                iodict.IODict(path=self.path + "-y", metadata="xattr")
+
+    def test_legacy(self):
+        os.makedirs(self.path)
+        with open(os.path.join(self.path, "a"), "wb") as f:
+            pickle.dump(1, f)
+        with patch("iodict.listxattr", autospec=True) as mock_listxattr:
+            mock_listxattr.side_effect = OSError
+            d = iodict.IODict(path=self.path)
+        self.assertEqual(d._mode, "legacy")
+        self.assertEqual(d["a"], 1)
+        self.assertEqual(iodict.IODict(path=self.path)._mode, "legacy")
+
+
+class TestContains(StorageTest):
+    def test_contains(self):
+        d = iodict.IODict(path=self.path)
+        d["a"] = 1
+        with patch("os.scandir", autospec=True) as mock_scandir:
+            self.assertIn("a", d)
+            self.assertNotIn("b", d)
+            self.assertTrue(d.has("a"))
+            mock_scandir.assert_not_called()
+        del d["a"]
+        self.assertFalse(d.has("a"))
+
+    def test_bloom(self):
+        d = iodict.IODict(path=self.path, metadata="header")
+        d["a"] = 1
+        d = iodict.IODict(path=self.path, bloom=100, metrics=True)
+        other = iodict.IODict(path=self.path)
+        other["b"] = 2
+        other._create_many([("c", 3)])
+        with patch("os.stat", autospec=True) as mock_stat:
+            self.assertNotIn("missing", d)
+            with self.assertRaises(KeyError):
+                d["missing"]
+            mock_stat.assert_not_called()
+        self.assertEqual(d.stats()["bloom_negatives"], 2)
+        self.assertEqual([k in d for k in "abc"], [True, True, True])
+        self.assertEqual(d["b"], 2)
+
+    def test_bloom_handles(self):
+        d = iodict.IODict(path=self.path, bloom=100)
+        restored = pickle.loads(pickle.dumps(d))
+        d["a"] = 1
+        self.assertIn("a", restored)
+        d.clear(background=True)
+        d["b"] = 2
+        self.assertIn("b", iodict.IODict(path=self.path))
+        self.assertIn("b", restored)
+
+
+class TestLinkedSnapshot(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.dest = os.path.join(self.tmpdir.name, "copy")
+
+    def _check(self, metadata, linked=True):
+        d = iodict.IODict(path=self.path, metadata=metadata)
+        for i in range(5):
+            d[str(i)] = i
+        d["0"] = "replaced"
+        snap = d.snapshot(self.dest)
+        name = d._encoder("1")
+        self.assertEqual(
+            os.stat(os.path.join(self.path, name)).st_ino
+            == os.stat(os.path.join(self.dest, name)).st_ino,
+            linked,
+        )
+        d["1"] = "changed"
+        del d["2"]
+        d["5"] = 5
+        self.assertEqual(
+            list(snap.items()),
+            [("0", "replaced"), ("1", 1)] + [(str(i), i) for i in range(2, 5)],
+        )
+        self.assertEqual(d["1"], "changed")
+        self.assertEqual(d.first(), ("0", "replaced"))
+        self.assertEqual(snap._mode, d._mode)
+
+    def test_header(self):
+        self._check("header")
+
+    def test_xattr(self):
+        self._check("xattr")
+
+    def test_fallback(self):
+        with patch("os.link", autospec=True) as mock_link:
+            mock_link.side_effect = OSError(18, "Invalid cross-device link")
+            self._check("header", linked=False)
+        mock_link.assert_called_once()
+
+    def test_no_metadata(self):
+        d = iodict.IODict(path=self.path, metadata="xattr")
+        d["a"] = 1
+        os.unlink(os.path.join(self.path, iodict._METADATA_FILE))
+        snap = d.snapshot(self.dest)
+        self.assertEqual(snap["a"], 1)
+        self.assertEqual(snap._mode, "xattr")
+
+    def test_bloom_copy(self):
+        d = iodict.IODict(path=self.path, bloom=100)
+        d["a"] = 1
+        snap = d.copy(self.dest)
+        d["b"] = 2
+        self.assertIn("a", snap)
+        self.assertNotIn("b", snap)
+        self.assertIs(d.copy(), d)
+        with self.assertRaises(FileExistsError):
+            d.snapshot(self.dest)
+
+
+class TestTransaction(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.wal = os.path.join(self.path, iodict._WAL_DIR)
+
+    def test_commit(self):
+        d = iodict.IODict(path=self.path)
+        d["a"] = 1
+        d["c"] = 3
+        with d.transaction() as tx:
+            tx["b"] = tx.pop("a")
+            del tx["c"]
+            tx.update({"d": 4})
+            self.assertNotIn("a", tx)
+            self.assertEqual(tx["b"], 1)
+            self.assertEqual(d["a"], 1)
+            with self.assertRaises(KeyError):
+                del tx["missing"]
+        self.assertEqual(dict(d.items()), {"b": 1, "d": 4})
+        self.assertEqual(os.listdir(self.wal), [])
+
+    def test_abort(self):
+        d = iodict.IODict(path=self.path)
+        d["a"] = 1
+        with self.assertRaises(RuntimeError):
+            with d.transaction() as tx:
+                tx["a"] = 2
+                tx["b"] = 3
+                raise RuntimeError
+        self.assertEqual(dict(d.items()), {"a": 1})
+
+    def test_single_sync(self):
+        d = iodict.IODict(path=self.path)
+        for count in (1, 100):
+            with patch("os.fsync", autospec=True) as mock_fsync:
+                with patch(
+                    "iodict._sync_filesystem", autospec=True
+                ) as mock_sync:
+                    with d.transaction() as tx:
+                        tx.update({str(i): i for i in range(count)})
+            self.assertEqual(mock_fsync.call_count, 2)
+            mock_sync.assert_called_once_with(self.path)
+
+    def test_synced_before_unlink(self):
+        d = iodict.IODict(path=self.path)
+        calls = list()
+        unlink = os.unlink
+        with patch(
+            "iodict._sync_filesystem", side_effect=lambda p: calls.append(p)
+        ):
+            with patch(
+                "os.unlink",
+                side_effect=lambda p: (calls.append(p), unlink(p)),
+            ):
+                with d.transaction() as tx:
+                    tx["a"] = 1
+        self.assertEqual(calls[0], self.path)
+        self.assertEqual(os.path.dirname(calls[1]), self.wal)
+
+    def test_replay_keys(self):
+        d = iodict.IODict(path=self.path, metadata="header")
+        with patch.object(d, "_create", side_effect=OSError):
+            with self.assertRaises(OSError):
+                with d.transaction() as tx:
+                    tx[1] = "one"
+                    tx[(2, "b")] = "two"
+        d = iodict.IODict(path=self.path, metadata="header")
+        self.assertEqual(d[1], "one")
+        self.assertEqual(d[(2, "b")], "two")
+
+    def test_replay(self):
+        d = iodict.IODict(path=self.path)
+        d["a"] = 1
+        create = d._create
+
+        def _fail_second(**kwargs):
+            if kwargs["key"] != "a":
+                raise OSError("No space left on device")
+            create(**kwargs)
+
+        with patch.object(d, "_create", side_effect=_fail_second):
+            with self.assertRaises(OSError):
+                with d.transaction() as tx:
+                    tx["a"] = 2
+                    tx["b"] = 3
+        self.assertEqual(len(os.listdir(self.wal)), 1)
+        self.assertEqual(dict(d.items()), {"a": 2})
+        d = iodict.IODict(path=self.path)
+        self.assertEqual(dict(d.items()), {"a": 2, "b": 3})
+        self.assertEqual(os.listdir(self.wal), [])
+
+    def test_rollback(self):
+        d = iodict.IODict(path=self.path)
+        d["a"] = 1
+        with d.transaction() as tx:
+            tx["b"] = 2
+        live = os.path.join(self.wal, "live")
+        with open(live, "wb") as f:
+            iodict.IODict._write_log(f, {"a": None, "b": pickle.dumps(3)})
+        with open(live, "rb") as f:
+            log = f.read()
+        with open(os.path.join(self.wal, "torn"), "wb") as f:
+            f.write(log[:-8])
+        with open(live, "rb") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            d = iodict.IODict(path=self.path)
+        self.assertEqual(os.listdir(self.wal), ["live"])
+        self.assertEqual(dict(d.items()), {"a": 1, "b": 2})
+        d = iodict.IODict(path=self.path)
+        self.assertEqual(os.listdir(self.wal), [])
+        self.assertEqual(dict(d.items()), {"b": 3})
+
+
+class TestWatch(StorageTest):
+    def test_watch(self):
+        d = iodict.IODict(path=self.path, changes=True)
+        other = iodict.IODict(path=self.path)
+        d["a"] = 1
+        other["b"] = 2
+        self.assertEqual(d.pop("a"), 1)
+        with other.transaction() as tx:
+            del tx["b"]
+            tx["c"] = 3
+        d.clear()
+        changes = list(d.watch(since=0, timeout=0))
+        self.assertEqual(
+            [change[:2] for change in changes],
+            [
+                ("set", "a"),
+                ("set", "b"),
+                ("delete", "a"),
+                ("delete", "b"),
+                ("set", "c"),
+                ("clear", None),
+            ],
+        )
+        resumed = list(d.watch(since=changes[2][2], timeout=0))
+        self.assertEqual(resumed, changes[3:])
+        self.assertEqual(list(d.watch(timeout=0)), [])
+
+    def test_watch_follow(self):
+        d = iodict.IODict(path=self.path, changes=True)
+        watcher = d.watch(timeout=5, interval=0.01)
+        threading.Timer(0.1, d.__setitem__, args=("a", 1)).start()
+        self.assertEqual(next(watcher)[:2], ("set", "a"))
+        handle = pickle.loads(pickle.dumps(d))
+        handle["b"] = 2
+        self.assertEqual(next(watcher)[:2], ("set", "b"))
+
+    def test_watch_disabled(self):
+        d = iodict.IODict(path=self.path)
+        d["a"] = 1
+        with self.assertRaises(ValueError):
+            next(d.watch())
+
+
+class TestDedup(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.blobs = os.path.join(self.path, iodict._BLOB_DIR)
+
+    def _check(self, metadata):
+        d = iodict.IODict(
+            path=self.path, metadata=metadata, dedup=True, metrics=True
+        )
+        blob = {"config": "x" * 1024}
+        for i in range(10):
+            d[str(i)] = blob
+        d["small"] = 1
+        self.assertEqual(len(os.listdir(self.blobs)), 1)
+        self.assertEqual(d.stats()["dedup_hits"], 9)
+        self.assertLess(
+            os.path.getsize(os.path.join(self.path, d._encoder("0"))), 1024
+        )
+        reader = iodict.IODict(path=self.path)
+        self.assertEqual(reader["3"], blob)
+        self.assertEqual(list(reader.values())[:2], [blob, blob])
+        snapshot = os.path.join(self.tmpdir.name, "snap")
+        d.export(snapshot)
+        restored = iodict.IODict(path=os.path.join(self.tmpdir.name, "r"))
+        restored.load(snapshot)
+        self.assertEqual(restored["9"], blob)
+
+    def test_xattr(self):
+        self._check("xattr")
+
+    def test_header(self):
+        self._check("header")
+
+    def test_collect(self):
+        d = iodict.IODict(path=self.path, metadata="header", dedup=True)
+        d["a"] = "a" * 1024
+        d["b"] = "b" * 1024
+        d["c"] = "b" * 1024
+        self.assertEqual(d.collect_blobs(grace=0), 0)
+        del d["a"]
+        d["b"] = 1
+        self.assertEqual(d.collect_blobs(), 0)
+        self.assertEqual(d.collect_blobs(grace=0), 1)
+        self.assertEqual(len(os.listdir(self.blobs)), 1)
+        copy = d.snapshot(os.path.join(self.tmpdir.name, "copy"))
+        del d["c"]
+        self.assertEqual(d.collect_blobs(grace=0), 1)
+        self.assertEqual(copy["c"], "b" * 1024)
+
+    def test_queue(self):
+        q = iodict.DurableQueue(path=self.path, dedup=True)
+        q.put_many(["q" * 1024] * 5)
+        self.assertEqual(len(os.listdir(self.blobs)), 1)
+        self.assertEqual(q.get_many(5), ["q" * 1024] * 5)
+        q.close()
+
+
+class TestStreams(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.source = os.path.join(self.tmpdir.name, "artifact")
+        self.data = os.urandom(3 * 1024 * 1024 + 7)
+        with open(self.source, "wb") as f:
+            f.write(self.data)
+
+    def _check(self, metadata):
+        d = iodict.IODict(path=self.path, metadata=metadata)
+        d["a"] = 1
+        d["b"] = 2
+        self.assertEqual(d.put_file("a", self.source), len(self.data))
+        self.assertEqual(list(d.keys()), ["a", "b"])
+        with d.open_value("a") as f:
+            self.assertEqual(f.read(10), self.data[:10])
+            f.seek(-7, os.SEEK_END)
+            self.assertEqual(f.read(), self.data[-7:])
+            f.seek(0)
+            d["a"] = "replaced"
+            self.assertEqual(f.read(), self.data)
+        d.put_stream("c", io.BytesIO(b"in memory"))
+        self.assertEqual(d["c"], b"in memory")
+
+    def test_xattr(self):
+        self._check("xattr")
+
+    def test_header(self):
+        self._check("header")
+
+    @unittest.skipUnless(
+        hasattr(os, "copy_file_range"), "requires copy_file_range"
+    )
+    def test_fallback(self):
+        d = iodict.IODict(path=self.path)
+        with open(self.source, "rb") as f:
+            f.seek(7)
+            with patch("os.copy_file_range", side_effect=OSError(18, "")):
+                with patch("os.sendfile", side_effect=OSError(22, "")):
+                    self.assertEqual(d.put_stream("a", f), len(self.data) - 7)
+            self.assertEqual(f.read(), b"")
+        self.assertEqual(d["a"], self.data[7:])
+
+    def test_open_value_pickled(self):
+        d = iodict.IODict(path=self.path)
+        d["a"] = b"bytes"
+        d["b"] = 1
+        self.assertEqual(d.open_value("a").read(), b"bytes")
+        with self.assertRaises(TypeError):
+            d.open_value("b")
+        with self.assertRaises(KeyError):
+            d.open_value("c")
+
+
+class TestServer(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.server = server.Server(self.path)
+        self.socket = self.server.server_address
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        super().tearDown()
+
+    def test_dict(self):
+        with server.RemoteIODict(self.socket) as d:
+            d["a"] = 1
+            d.update({"b": 2, "c": 3})
+            self.assertEqual(d["a"], 1)
+            self.assertIn("b", d)
+            self.assertEqual(len(d), 3)
+            self.assertEqual(list(d), ["a", "b", "c"])
+            self.assertEqual(d.items(prefix="b"), [("b", 2)])
+            self.assertEqual(d.pop("a"), 1)
+            with self.assertRaises(KeyError):
+                d["a"]
+            self.assertEqual(
+                d.batch(
+                    [
+                        ("__setitem__", ("d", 4), {}),
+                        ("get", ("d",), {}),
+                        ("keys", (), {}),
+                    ]
+                ),
+                [None, 4, ["b", "c", "d"]],
+            )
+            with self.assertRaises(AttributeError):
+                d._call("_scan")
+            with self.assertRaises(AttributeError):
+                d.drop()
+        local = iodict.IODict(os.path.join(self.server.path, "default"))
+        self.assertEqual(local["d"], 4)
+        self.assertTrue(self.server.store("dict")._exclusive)
+
+    def test_queue(self):
+        q = server.RemoteDurableQueue(self.socket, name="jobs")
+        consumer = server.RemoteDurableQueue(self.socket, name="jobs")
+        threading.Timer(0.1, q.put, args=("job",)).start()
+        self.assertEqual(consumer.get(timeout=5), "job")
+        q.put_many(range(3))
+        self.assertEqual(q.qsize(), 3)
+        self.assertEqual(consumer.get_many(5), [0, 1, 2])
+        with self.assertRaises(queue.Empty):
+            consumer.get(timeout=0.01)
+        with self.assertRaises(ValueError):
+            server.RemoteIODict(self.socket, name="jobs")["a"]
+        with self.assertRaises(ValueError):
+            server.RemoteIODict(self.socket, name="../escape")["a"]
+        q.close()
+        consumer.close()
+
+
+@unittest.skipIf(iodict.shared_memory is None, "requires shared_memory")
+class TestSharedIndex(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.store = iodict.IODict(path=self.path, shared_index=True)
+
+    def tearDown(self):
+        self.store.drop()
+        super().tearDown()
+
+    def test_shared(self):
+        for i in range(10):
+            self.store[str(i)] = i
+        self.assertEqual(self.store.first(), ("0", 0))
+        other = iodict.IODict(path=self.path, shared_index=True, metrics=True)
+        with patch.object(other, "_item_meta", autospec=True) as mock_meta:
+            self.assertEqual(other.last(), ("9", 9))
+            self.assertEqual(list(other), [str(i) for i in range(10)])
+            mock_meta.assert_not_called()
+        self.assertEqual(other.stats()["index_shared_hits"], 1)
+        self.assertEqual(other.popitem(), 0)
+        handle = pickle.loads(pickle.dumps(other))
+        self.assertEqual(handle.peek(1), [("1", 1)])
+
+    def test_corrupt(self):
+        self.store["a"] = 1
+        self.store.first()
+        shared = self.store._shared_index
+        published = shared.published
+        segment = iodict._shared_memory("{}-{}".format(shared.name, published))
+        segment.buf[0] ^= 0xFF
+        segment.close()
+        other = iodict.IODict(path=self.path, shared_index=True)
+        with self.assertLogs("iodict", "WARNING"):
+            self.assertEqual(other.first(), ("a", 1))
+        self.assertEqual(other._shared_index.published, published + 1)
+
+    def test_queue(self):
+        q = iodict.DurableQueue(path=self.path, shared_index=True)
+        q.put_many(range(3))
+        self.assertEqual(q.get_many(3), [0, 1, 2])
+        self.assertIsNotNone(q._queue._shared_index.published)
+
+    def test_drop(self):
+        self.store["a"] = 1
+        self.store.first()
+        name = self.store._shared_index.name
+        self.store.drop()
+        with self.assertRaises(FileNotFoundError):
+            iodict._shared_memory(name)
+
+
+class TestOrderIndex(StorageTest):
+    def setUp(self):
+        super().setUp()
+        self.store = iodict.IODict(path=self.path)
+
+    def test_columns(self):
+        for i in range(10):
+            self.store["key{}".format(i)] = i
+        index = self.store._ordered()
+        self.assertEqual(len(index), 10)
+        self.assertEqual(len(index.births), 10)
+        self.assertIsInstance(index.names, bytearray)
+        self.assertEqual(index.key(3), "key3")
+        name = self.store._encoder("key3")
+        self.assertEqual(index.name(3), name)
+        self.assertEqual(index.name_sizes[0], len(name) // 2 + 1)
+        self.assertEqual(index.find(index.order(3), name), (3, True))
+        self.assertFalse(index.find(index.order(3), name[1:])[1])
+
+    def test_refresh(self):
+        for i in range(5):
+            self.store[str(i)] = i
+        index = self.store._ordered()
+        self.assertEqual([key for key, _, _ in index.prefixed("3")], ["3"])
+        entries = iodict._IndexEntries(index, self.path)
+        self.store["5"] = 5
+        del self.store["1"]
+        self.assertIs(self.store._ordered(), index)
+        self.assertEqual([key for _, key in index.slice()], list("02345"))
+        self.assertEqual(
+            index.prefixed("5"), [("5", index.order(4), index.name(4))]
+        )
+        self.assertEqual([key for key, _, _ in entries], list("01234"))
+        self.assertEqual(entries[-1][0], "4")
+        self.assertEqual([key for key, _, _ in entries[1:3]], ["1", "2"])
+
+    def test_own_writes(self):
+        for i in range(5):
+            self.store[str(i)] = i
+        index = self.store._ordered()
+        with patch("os.scandir", side_effect=AssertionError) as mock_scandir:
+            self.store["5"] = 5
+            self.store["2"] = 20
+            del self.store["1"]
+            self.assertEqual(self.store.pop("0"), 0)
+            self.assertEqual(
+                self.store.peek(5), [("2", 20), ("3", 3), ("4", 4), ("5", 5)]
+            )
+            self.assertEqual(self.store._size(), 4)
+            mock_scandir.assert_not_called()
+        self.assertIs(self.store._ordered(), index)
+
+    def test_other_writes(self):
+        for i in range(5):
+            self.store[str(i)] = i
+        index = self.store._ordered()
+        other = iodict.IODict(path=self.path)
+        other["5"] = 5
+        del other["0"]
+        self.assertEqual(self.store.last(), ("5", 5))
+        self.assertEqual(self.store.first(), ("1", 1))
+        self.assertEqual(len(self.store), 5)
+        self.assertIs(self.store._ordered(), index)
+
+    def test_exclusive(self):
+        store = iodict.IODict(path=self.path, exclusive=True)
+        for i in range(5):
+            store[str(i)] = i
+        index = store._ordered()
+        with patch("os.scandir", side_effect=AssertionError), patch(
+            "os.stat", side_effect=AssertionError
+        ):
+            self.assertEqual(len(store), 5)
+            self.assertEqual(store.popitem(), 0)
+            self.assertEqual(store._size(), 4)
+        store.clear()
+        self.assertEqual(len(store), 0)
+        store["a"] = 1
+        self.assertEqual(len(store), 1)
+        self.assertIsNot(store._ordered(), index)
+        self.assertFalse(pickle.loads(pickle.dumps(store))._exclusive)
+
+    def test_dumps(self):
+        for i in range(5):
+            self.store["key{}".format(i)] = i
+        index = self.store._ordered()
+        loaded = iodict._OrderIndex.loads(index.dumps(), (1, 2))
+        self.assertEqual(loaded.generation, (1, 2))
+        self.assertEqual(loaded.slice(), index.slice())
+        self.assertEqual(loaded.order(4), index.order(4))
+        self.assertEqual(loaded.inodes, index.inodes)
+
+
+class TestSpillQueue(StorageTest):
+    def _stored(self):
+        return [
+            i for i in os.listdir(self.path) if not i.startswith(".iodict")
+        ]
+
+    def test_memory(self):
+        q = iodict.SpillQueue(path=self.path, maxitems=4)
+        for i in range(4):
+            q.put(i)
+        self.assertEqual(self._stored(), [])
+        self.assertEqual([q.get() for _ in range(4)], [0, 1, 2, 3])
+        self.assertTrue(q.empty())
+        with self.assertRaises(queue.Empty):
+            q.get(timeout=0.01)
+
+    def test_spill(self):
+        q = iodict.SpillQueue(path=self.path, maxitems=3, batch_size=2)
+        q.put_many(range(5))
+        q.put(5)
+        self.assertEqual(len(self._stored()), 1)
+        self.assertEqual(q.qsize(), 6)
+        self.assertEqual(q.get(), 0)
+        q.put(6)
+        self.assertEqual(len(self._stored()), 2)
+        self.assertEqual([q.get() for _ in range(3)], [1, 2, 3])
+        self.assertEqual(len(self._stored()), 1)
+        self.assertEqual([q.get() for _ in range(3)], [4, 5, 6])
+        self.assertEqual(self._stored(), [])
+        q.put(7)
+        self.assertEqual(self._stored(), [])
+        self.assertEqual(q.get_nowait(), 7)
+
+    def test_maxbytes(self):
+        q = iodict.SpillQueue(path=self.path, maxbytes=64)
+        q.put(b"a")
+        q.put(b"b" * 64)
+        q.put(b"c")
+        self.assertEqual(q.qsize(), 3)
+        self.assertEqual([q.get() for _ in range(3)], [b"a", b"b" * 64, b"c"])
+        self.assertEqual(self._stored(), [])
+
+    def test_segments(self):
+        q = iodict.SpillQueue(path=self.path, maxitems=4, batch_size=4)
+        q.put_many(range(12))
+        self.assertEqual(len(self._stored()), 2)
+        q.put(12)
+        self.assertEqual(q.checkpoint(), 4)
+        self.assertEqual(len(self._stored()), 3)
+        q._stop.set()
+        q = iodict.SpillQueue(path=self.path, maxitems=4, batch_size=4)
+        self.assertEqual(q.qsize(), 13)
+        self.assertEqual([q.get() for _ in range(5)], [0, 1, 2, 3, 4])
+        self.assertEqual(len(self._stored()), 2)
+        self.assertEqual([q.get() for _ in range(8)], list(range(5, 13)))
+        self.assertEqual(self._stored(), [])
+
+    def test_unlocked_spill(self):
+        q = iodict.SpillQueue(path=self.path, maxitems=1, batch_size=1)
+        q.put(0)
+        taken = list()
+        write = q._write
+
+        def _write(*args):
+            consumer = threading.Thread(
+                target=lambda: taken.append(q.get_nowait())
+            )
+            consumer.start()
+            consumer.join(5)
+            write(*args)
+
+        with patch.object(q, "_write", side_effect=_write):
+            q.put(1)
+        self.assertEqual(taken, [0])
+        self.assertEqual(q.get(timeout=5), 1)
+
+    def test_restart(self):
+        q = iodict.SpillQueue(path=self.path, maxitems=2, checkpoint=60)
+        q.put_many(range(4))
+        self.assertEqual(q.checkpoint(), 2)
+        q._stop.set()
+        q = iodict.SpillQueue(path=self.path, maxitems=2)
+        self.assertEqual([q.get() for _ in range(4)], [0, 1, 2, 3])
+        self.assertFalse(
+            os.path.exists(os.path.join(self.path, ".iodict.checkpoint"))
+        )
+        q = iodict.SpillQueue(path=self.path, maxitems=2)
+        self.assertTrue(q.empty())
+
+    def test_periodic(self):
+        q = iodict.SpillQueue(path=self.path, checkpoint=0.01)
+        q.put("item")
+        checkpoint = os.path.join(self.path, ".iodict.checkpoint")
+        for _ in range(500):
+            if os.path.exists(checkpoint):
+                break
+            time.sleep(0.01)
+        q._stop.set()
+        q = iodict.SpillQueue(path=self.path)
+        self.assertEqual(q.get_nowait(), "item")
+
+    def test_blocking(self):
+        q = iodict.SpillQueue(path=self.path)
+        timer = threading.Timer(0.05, q.put, args=("item",))
+        timer.start()
+        self.assertEqual(q.get(timeout=5), "item")
+        timer.join()
+        q.close()
+        self.assertFalse(os.path.exists(self.path))